@@ -0,0 +1,196 @@
+# analysis.py (分析ページ用の集計処理)
+
+import threading
+
+from sqlalchemy import func
+
+from extensions import db
+import revisions
+from models import Teacher, Shift, TimeSlot, Assignment, Subject, Lesson, StudentRequest
+
+
+# period_id -> (バージョン, 分析データ)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_cached_analysis_data(period, get_sorted_students):
+    """期間のバージョンが変わっていなければ、計算済みの分析データを返す
+
+    get_sorted_students は生徒リストを返す関数 (キャッシュが古いときだけ呼ぶ)。
+    """
+    # 集計前にバージョンを読むので、集計中の変更は次回の呼び出しで反映される
+    version = revisions.period_version(period.id)
+    with _cache_lock:
+        cached = _cache.get(period.id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    data = get_analysis_data(period, get_sorted_students())
+    with _cache_lock:
+        _cache[period.id] = (version, data)
+    return data
+
+
+def _rate(numerator, denominator, default=0):
+    return round(numerator / denominator *
+                 100, 1) if denominator > 0 else default
+
+
+def get_analysis_data(period, sorted_students):
+    """計画期間の分析データを GROUP BY で集計して返す
+
+    sorted_students は表示順に並べた生徒のリスト。
+    レポートごとの行は1回の走査で組み立てる。
+    """
+    period_range = Assignment.date.between(period.start_date, period.end_date)
+
+    # --- 講師別: シフト数とコマ数 ---
+    shift_counts = dict(
+        db.session.query(Shift.teacher_id, func.count(Shift.id)).filter(
+            Shift.is_available,
+            Shift.date.between(period.start_date, period.end_date)).group_by(
+                Shift.teacher_id).all())
+    assignment_counts = dict(
+        db.session.query(Assignment.teacher_id,
+                         func.count(Assignment.id)).filter(period_range).
+        group_by(Assignment.teacher_id).all())
+
+    # --- 生徒×科目別: リクエスト数と消化数 ---
+    requested = {}
+    request_rows = db.session.query(
+        StudentRequest.student_id, StudentRequest.subject_id,
+        StudentRequest.requested_lessons).filter(
+            StudentRequest.planning_period_id == period.id).order_by(
+                StudentRequest.id).all()
+    for student_id, subject_id, count in request_rows:
+        requested[(student_id, subject_id)] = requested.get(
+            (student_id, subject_id), 0) + count
+
+    fulfilled = {(student_id, subject_id): count
+                 for student_id, subject_id, count in db.session.query(
+                     Lesson.student_id, Lesson.subject_id,
+                     func.count(Lesson.id)).join(Assignment).filter(
+                         period_range).group_by(Lesson.student_id,
+                                                Lesson.subject_id).all()}
+
+    # --- 時限別・曜日別のレッスン数 ---
+    time_slot_distribution = {ts_id: 0 for (ts_id, ) in
+                              db.session.query(TimeSlot.id).all()}
+    weekday_distribution = {i: 0 for i in range(7)}
+    for lesson_date, time_slot_id, count in db.session.query(
+            Assignment.date, Assignment.time_slot_id,
+            func.count(Lesson.id)).join(Lesson).filter(period_range).group_by(
+                Assignment.date, Assignment.time_slot_id).all():
+        time_slot_distribution[time_slot_id] += count
+        weekday_distribution[lesson_date.weekday()] += count
+
+    subjects = db.session.query(Subject.id,
+                                Subject.name).order_by(Subject.id).all()
+    subject_names = dict(subjects)
+
+    # --- サマリー ---
+    total_shifts = sum(shift_counts.values())
+    total_assignments = sum(assignment_counts.values())
+    total_requests_count = sum(requested.values())
+    total_assigned_lessons = sum(fulfilled.values())
+    summary = {
+        'total_shifts': total_shifts,
+        'total_requests': total_requests_count,
+        'shift_assignment_rate': _rate(total_assignments, total_shifts),
+        'lesson_fulfillment_rate': _rate(total_assigned_lessons,
+                                         total_requests_count)
+    }
+
+    teacher_report = []
+    for teacher_id, name in db.session.query(
+            Teacher.id, Teacher.name).order_by(Teacher.id).all():
+        shift_count = shift_counts.get(teacher_id, 0)
+        assignment_count = assignment_counts.get(teacher_id, 0)
+        teacher_report.append({
+            'name': name,
+            'shift_count': shift_count,
+            'assignment_count': assignment_count,
+            'assignment_rate': _rate(assignment_count, shift_count)
+        })
+
+    # 生徒ごとにリクエスト・消化数をまとめる
+    student_requests = {}
+    for student_id, subject_id, count in request_rows:
+        student_requests.setdefault(student_id, []).append((subject_id, count))
+    student_fulfilled = {}
+    for (student_id, subject_id), count in fulfilled.items():
+        student_fulfilled[student_id] = student_fulfilled.get(student_id,
+                                                              0) + count
+
+    unfulfilled_report = []
+    student_fulfillment_report = []
+    for student in sorted_students:
+        reqs = student_requests.get(student.id, [])
+        for subject_id, count in reqs:
+            unfulfilled_count = count - fulfilled.get(
+                (student.id, subject_id), 0)
+            if unfulfilled_count > 0:
+                unfulfilled_report.append({
+                    'student_name': student.name,
+                    'subject_name': subject_names.get(subject_id),
+                    'unfulfilled_count': unfulfilled_count
+                })
+
+        total_requested = sum(count for _, count in reqs)
+        if total_requested == 0:
+            continue  # リクエストがない生徒はレポートに含めない
+        total_fulfilled = student_fulfilled.get(student.id, 0)
+
+        subject_details = []
+        for subject_id, subject_name in subjects:
+            requested_count = requested.get((student.id, subject_id), 0)
+            # リクエストがあった科目のみ詳細に含める
+            if requested_count > 0:
+                fulfilled_count = fulfilled.get((student.id, subject_id), 0)
+                subject_details.append({
+                    'subject_name': subject_name,
+                    'requested': requested_count,
+                    'fulfilled': fulfilled_count,
+                    'is_unfulfilled': fulfilled_count < requested_count
+                })
+
+        student_fulfillment_report.append({
+            'student_name': student.name,
+            'total_requested': total_requested,
+            'total_fulfilled': total_fulfilled,
+            'fulfillment_rate': _rate(total_fulfilled, total_requested),
+            'subject_details': subject_details
+        })
+
+    subject_requested = {}
+    subject_fulfilled = {}
+    for (_, subject_id), count in requested.items():
+        subject_requested[subject_id] = subject_requested.get(subject_id,
+                                                              0) + count
+    for (_, subject_id), count in fulfilled.items():
+        subject_fulfilled[subject_id] = subject_fulfilled.get(subject_id,
+                                                              0) + count
+    subject_fulfillment = {
+        subject_name: _rate(subject_fulfilled.get(subject_id, 0),
+                            subject_requested.get(subject_id, 0), 100)
+        for subject_id, subject_name in subjects
+    }
+
+    return {
+        'summary':
+        summary,
+        'teacher_report':
+        sorted(teacher_report, key=lambda x: x['assignment_rate'],
+               reverse=True),
+        'unfulfilled_report':
+        sorted(unfulfilled_report, key=lambda x: x['student_name']),
+        'student_fulfillment_report':
+        student_fulfillment_report,
+        'time_slot_distribution':
+        time_slot_distribution,
+        'weekday_distribution':
+        weekday_distribution,
+        'subject_fulfillment':
+        subject_fulfillment
+    }
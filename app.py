@@ -1,23 +1,61 @@
 # app.py (レッスンロックAPI対応・期間指定ルーティング対応版)
 
-from flask import Flask, render_template, jsonify, request, redirect, url_for
+from flask import Flask, Response, render_template, jsonify, request, redirect, url_for
+import json
 import os
 from datetime import datetime, date, timedelta
 
 from extensions import db
+import availability
+import compression
+import db_profile
+import precheck
+import revisions
+import shifts
+import student_requests
+import suggestions
 
 
 def create_app():
     basedir = os.path.abspath(os.path.dirname(__file__))
     app = Flask(__name__)
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(
-        basedir, 'schedule.db')
+    app.config['SQLALCHEMY_DATABASE_URI'] = db_profile.database_uri(basedir)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db_profile.configure(app)
 
     db.init_app(app)
+    db_profile.install(app, db)
+    with app.app_context():
+        revisions.ensure_table()
+        # migrate.py を実行していない DB では、シフトの保存に ON CONFLICT を使えない
+        app.config['SHIFT_UPSERT'] = shifts.has_upsert_index()
+        if not app.config['SHIFT_UPSERT']:
+            app.logger.warning(
+                f"インデックス {shifts.UPSERT_INDEX} がありません。"
+                "シフトは DELETE と INSERT で保存します (python migrate.py で作成できます)。")
 
     from models import Teacher, Shift, TimeSlot, Assignment, Subject, Student, Lesson, StudentRequest, PlanningPeriod
-    from scheduler import ScheduleGenerator
+    from jobs import JobQueue, FINISHED_STATUSES
+    from analysis import get_cached_analysis_data
+    import planner_data
+
+    # 自動配置はバックグラウンドのワーカースレッドで実行する
+    job_queue = JobQueue(app)
+
+    def not_modified(etag):
+        """If-None-Match が現在の ETag と一致すれば 304 のレスポンスを返す"""
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return None
+
+    def with_etag(response, etag):
+        response.set_etag(etag)
+        # キャッシュしてよいが、使う前に必ず ETag で再検証させる
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
 
     @app.route('/')
     def index():
@@ -50,190 +88,8 @@ def create_app():
             if not period:
                 return "指定された計画期間が見つかりません。", 404
 
-            start_date = period.start_date
-            end_date = period.end_date
-
-            # --- ここから get_analysis_data のロジックを移動 ---
-            all_shifts = Shift.query.filter(
-                Shift.date.between(start_date, end_date)).all()
-            all_assignments = Assignment.query.filter(
-                Assignment.date.between(start_date, end_date)).all()
-
-            # StudentRequestも期間で絞り込むように修正
-            all_requests = StudentRequest.query.filter_by(
-                planning_period_id=period_id).all()
-
-            assigned_lessons = Lesson.query.join(Assignment).filter(
-                Assignment.date.between(start_date, end_date)).all()
-
-            total_shifts = len(all_shifts)
-            total_requests_count = db.session.query(
-                db.func.sum(StudentRequest.requested_lessons)).filter_by(
-                    planning_period_id=period_id).scalar() or 0
-            total_assigned_lessons = len(assigned_lessons)
-            shift_assignment_rate = (len(all_assignments) / total_shifts *
-                                     100) if total_shifts > 0 else 0
-            lesson_fulfillment_rate = (total_assigned_lessons /
-                                       total_requests_count *
-                                       100) if total_requests_count > 0 else 0
-
-            summary = {
-                'total_shifts': total_shifts,
-                'total_requests': total_requests_count,
-                'shift_assignment_rate': round(shift_assignment_rate, 1),
-                'lesson_fulfillment_rate': round(lesson_fulfillment_rate, 1)
-            }
-
-            teacher_report = []
-            teachers = Teacher.query.all()
-            for teacher in teachers:
-                teacher_shifts = [
-                    s for s in all_shifts if s.teacher_id == teacher.id
-                ]
-                teacher_assignments = [
-                    a for a in all_assignments if a.teacher_id == teacher.id
-                ]
-                shift_count = len(teacher_shifts)
-                assignment_count = len(teacher_assignments)
-                assignment_rate = (assignment_count / shift_count *
-                                   100) if shift_count > 0 else 0
-                teacher_report.append({
-                    'name':
-                    teacher.name,
-                    'shift_count':
-                    shift_count,
-                    'assignment_count':
-                    assignment_count,
-                    'assignment_rate':
-                    round(assignment_rate, 1)
-                })
-
-            unfulfilled_report = []
-            students = get_sorted_students()
-            for student in students:
-                student_requests = [
-                    r for r in all_requests if r.student_id == student.id
-                ]
-                student_lessons = [
-                    l for l in assigned_lessons if l.student_id == student.id
-                ]
-                for req in student_requests:
-                    fulfilled_count = len([
-                        l for l in student_lessons
-                        if l.subject_id == req.subject_id
-                    ])
-                    unfulfilled_count = req.requested_lessons - fulfilled_count
-                    if unfulfilled_count > 0:
-                        subject = db.session.get(Subject, req.subject_id)
-                        unfulfilled_report.append({
-                            'student_name':
-                            student.name,
-                            'subject_name':
-                            subject.name,
-                            'unfulfilled_count':
-                            unfulfilled_count
-                        })
-
-            time_slot_distribution = {ts.id: 0 for ts in TimeSlot.query.all()}
-            weekday_distribution = {i: 0 for i in range(7)}
-            subject_fulfillment = {}
-
-            for assignment in all_assignments:
-                time_slot_distribution[assignment.time_slot_id] += len(
-                    assignment.lessons)
-                weekday = assignment.date.weekday()
-                weekday_distribution[weekday] += len(assignment.lessons)
-
-            for subject in Subject.query.all():
-                requested = sum(r.requested_lessons for r in all_requests
-                                if r.subject_id == subject.id)
-                fulfilled = len([
-                    l for l in assigned_lessons if l.subject_id == subject.id
-                ])
-                fulfillment_rate = (fulfilled / requested *
-                                    100) if requested > 0 else 100
-                subject_fulfillment[subject.name] = round(fulfillment_rate, 1)
-
-            student_fulfillment_report = []
-            all_subjects = Subject.query.all()  # 科目リストを取得
-            for student in students:
-                # 生徒ごとの総リクエスト数を集計
-                total_requested = sum(r.requested_lessons for r in all_requests
-                                      if r.student_id == student.id)
-                if total_requested == 0:
-                    continue  # リクエストがない生徒はレポートに含めない
-
-                # 生徒ごとの総消化数を集計
-                total_fulfilled = len([
-                    l for l in assigned_lessons if l.student_id == student.id
-                ])
-
-                # 消化率を計算
-                fulfillment_rate = (total_fulfilled / total_requested *
-                                    100) if total_requested > 0 else 0
-
-                subject_details = []
-                student_reqs_list = [
-                    r for r in all_requests if r.student_id == student.id
-                ]
-                student_lessons_list = [
-                    l for l in assigned_lessons if l.student_id == student.id
-                ]
-
-                for subject in all_subjects:
-                    requested_count = sum(r.requested_lessons
-                                          for r in student_reqs_list
-                                          if r.subject_id == subject.id)
-                    fulfilled_count = len([
-                        l for l in student_lessons_list
-                        if l.subject_id == subject.id
-                    ])
-
-                    # リクエストがあった科目のみ詳細に含める
-                    if requested_count > 0:
-                        subject_details.append({
-                            'subject_name':
-                            subject.name,
-                            'requested':
-                            requested_count,
-                            'fulfilled':
-                            fulfilled_count,
-                            'is_unfulfilled':
-                            fulfilled_count < requested_count
-                        })
-
-                student_fulfillment_report.append({
-                    'student_name':
-                    student.name,
-                    'total_requested':
-                    total_requested,
-                    'total_fulfilled':
-                    total_fulfilled,
-                    'fulfillment_rate':
-                    round(fulfillment_rate, 1),
-                    'subject_details':
-                    subject_details
-                })
-
-            analysis_data = {
-                'summary':
-                summary,
-                'teacher_report':
-                sorted(teacher_report,
-                       key=lambda x: x['assignment_rate'],
-                       reverse=True),
-                'unfulfilled_report':
-                sorted(unfulfilled_report, key=lambda x: x['student_name']),
-                'student_fulfillment_report':
-                student_fulfillment_report,
-                'time_slot_distribution':
-                time_slot_distribution,
-                'weekday_distribution':
-                weekday_distribution,
-                'subject_fulfillment':
-                subject_fulfillment
-            }
-            # --- ここまでが get_analysis_data のロジック ---
+            analysis_data = get_cached_analysis_data(period,
+                                                     get_sorted_students)
 
             return render_template('analysis.html',
                                    period=period,
@@ -245,6 +101,120 @@ def create_app():
             traceback.print_exc()
             return "分析データの生成中にエラーが発生しました。", 500
 
+    @app.route('/api/period/<int:period_id>/analysis', methods=['GET'])
+    def get_period_analysis(period_id):
+        try:
+            period = db.session.get(PlanningPeriod, period_id)
+            if not period:
+                return jsonify({'error': '指定された計画期間が見つかりません。'}), 404
+            return jsonify(
+                get_cached_analysis_data(period, get_sorted_students))
+        except Exception as e:
+            app.logger.error(f"Error in get_period_analysis: {e}")
+            import traceback
+            traceback.print_exc()
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/period/<int:period_id>/availability', methods=['GET'])
+    def get_period_availability(period_id):
+        """生徒が科目を受けられるコマと、そのコマで担当できる講師を返す"""
+        try:
+            student_id = request.args.get('student_id', type=int)
+            subject_id = request.args.get('subject_id', type=int)
+            if not student_id or not subject_id:
+                return jsonify({'error': '生徒IDと科目IDを指定してください。'}), 400
+
+            etag = revisions.make_etag('availability', period_id, student_id,
+                                       subject_id,
+                                       *revisions.period_version(period_id))
+            cached = not_modified(etag)
+            if cached:
+                return cached
+
+            period = db.session.get(PlanningPeriod, period_id)
+            if not period:
+                return jsonify({'error': '指定された計画期間が見つかりません。'}), 404
+
+            model = availability.get_cached_model(period)
+            cells = [{
+                'date': cell_date.strftime('%Y-%m-%d'),
+                'time_slot_id': time_slot_id,
+                'teacher_ids': teacher_ids
+            } for cell_date, time_slot_id, teacher_ids in
+                     model.feasible_cells(student_id, subject_id)]
+            return with_etag(
+                jsonify({
+                    'period_id': period_id,
+                    'student_id': student_id,
+                    'subject_id': subject_id,
+                    'cells': cells
+                }), etag)
+        except Exception as e:
+            app.logger.error(f"Error in get_period_availability: {e}")
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/period/<int:period_id>/suggestions', methods=['GET'])
+    def get_period_suggestions(period_id):
+        """1レッスン分の配置候補を、自動配置と同じ採点で上位 k 件返す"""
+        try:
+            student_id = request.args.get('student_id', type=int)
+            subject_id = request.args.get('subject_id', type=int)
+            if not student_id or not subject_id:
+                return jsonify({'error': '生徒IDと科目IDを指定してください。'}), 400
+            lesson_id = request.args.get('lesson_id', type=int)
+            k = request.args.get('k', suggestions.DEFAULT_K, type=int)
+
+            # ルールの指定は自動配置のオプションと同じ (指定の無いルールは OFF)
+            options = {}
+            interval_days = request.args.get('subject_interval_days',
+                                             type=int)
+            if interval_days is not None:
+                options['subject_interval_days'] = interval_days
+                options['interval_strength'] = request.args.get(
+                    'interval_strength', 'normal')
+            if request.args.get('preferred_strength'):
+                options['preferred_strength'] = request.args.get(
+                    'preferred_strength')
+
+            etag = revisions.make_etag('suggestions', period_id, student_id,
+                                       subject_id, lesson_id, k,
+                                       interval_days,
+                                       options.get('interval_strength'),
+                                       options.get('preferred_strength'),
+                                       *revisions.period_version(period_id))
+            cached = not_modified(etag)
+            if cached:
+                return cached
+
+            period = db.session.get(PlanningPeriod, period_id)
+            if not period:
+                return jsonify({'error': '指定された計画期間が見つかりません。'}), 404
+            result = suggestions.suggest_slots(period, student_id, subject_id,
+                                               options, k, lesson_id)
+            result['period_id'] = period_id
+            return with_etag(jsonify(result), etag)
+        except Exception as e:
+            app.logger.error(f"Error in get_period_suggestions: {e}")
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/api/period/<int:period_id>/precheck', methods=['GET'])
+    def get_period_precheck(period_id):
+        """自動配置の前に、リクエストがシフトに収まるかの上限とボトルネックを返す"""
+        try:
+            etag = revisions.make_etag('precheck', period_id,
+                                       *revisions.period_version(period_id))
+            cached = not_modified(etag)
+            if cached:
+                return cached
+
+            period = db.session.get(PlanningPeriod, period_id)
+            if not period:
+                return jsonify({'error': '指定された計画期間が見つかりません。'}), 404
+            return with_etag(jsonify(precheck.run_precheck(period)), etag)
+        except Exception as e:
+            app.logger.error(f"Error in get_period_precheck: {e}")
+            return jsonify({'error': str(e)}), 500
+
     @app.route('/planner/<int:period_id>')
     def planner(period_id):
         period = db.session.get(PlanningPeriod, period_id)
@@ -328,6 +298,13 @@ def create_app():
     @app.route('/api/teachers', methods=['GET'])
     def get_teachers():
         try:
+            etag = revisions.make_etag('teachers',
+                                       revisions.table_version('teacher'),
+                                       revisions.table_version('subject'))
+            cached = not_modified(etag)
+            if cached:
+                return cached
+
             teachers = Teacher.query.options(db.joinedload(
                 Teacher.subjects)).all()
             teacher_list = []
@@ -349,7 +326,7 @@ def create_app():
                         'display_name': s.display_name
                     } for s in t.subjects]
                 })
-            return jsonify(teacher_list)
+            return with_etag(jsonify(teacher_list), etag)
         except Exception as e:
             app.logger.error(f"Error in get_teachers: {e}")
             return jsonify({'error': str(e)}), 500
@@ -358,14 +335,21 @@ def create_app():
     def get_subjects():
         """全科目リストを取得する"""
         try:
+            etag = revisions.make_etag('subjects',
+                                       revisions.table_version('subject'))
+            cached = not_modified(etag)
+            if cached:
+                return cached
+
             subjects = Subject.query.order_by(Subject.id).all()
             # display_nameとlevelもレスポンスに含める
-            return jsonify([{
-                'id': s.id,
-                'name': s.name,
-                'display_name': s.display_name,
-                'level': s.level
-            } for s in subjects])
+            return with_etag(
+                jsonify([{
+                    'id': s.id,
+                    'name': s.name,
+                    'display_name': s.display_name,
+                    'level': s.level
+                } for s in subjects]), etag)
         except Exception as e:
             app.logger.error(f"Error in get_subjects: {e}")
             return jsonify({'error': str(e)}), 500
@@ -385,6 +369,7 @@ def create_app():
                                   level=data['level'])
             db.session.add(new_subject)
             db.session.commit()
+            revisions.bump_master('subject')
             return jsonify({'message': f'科目「{new_subject.name}」を追加しました。'}), 201
         except Exception as e:
             db.session.rollback()
@@ -406,6 +391,7 @@ def create_app():
             subject.level = data.get('level', subject.level)
 
             db.session.commit()
+            revisions.bump_master('subject')
             return jsonify({'message': '科目情報を更新しました。'})
         except Exception as e:
             db.session.rollback()
@@ -424,6 +410,7 @@ def create_app():
 
             db.session.delete(subject)
             db.session.commit()
+            revisions.bump_master('subject')
             return jsonify({'message': f'科目「{subject.name}」を削除しました。'})
         except Exception as e:
             db.session.rollback()
@@ -451,6 +438,7 @@ def create_app():
                 new_teacher.subjects.extend(subjects)
             db.session.add(new_teacher)
             db.session.commit()
+            revisions.bump_master('teacher')
             return jsonify({
                 'message': f'{new_teacher.name} を追加しました。',
                 'teacher_id': new_teacher.id
@@ -483,6 +471,7 @@ def create_app():
                 teacher.subjects.extend(subjects)
 
             db.session.commit()
+            revisions.bump_master('teacher')
             return jsonify({'message': '講師情報を更新しました。'})
         except Exception as e:
             db.session.rollback()
@@ -509,6 +498,7 @@ def create_app():
                 synchronize_session=False)
             db.session.delete(teacher)
             db.session.commit()
+            revisions.bump_master('teacher')
             return jsonify({'message': f'{teacher.name} を削除しました。'})
         except Exception as e:
             db.session.rollback()
@@ -520,6 +510,13 @@ def create_app():
     @app.route('/api/students', methods=['GET'])
     def get_students():
         try:
+            etag = revisions.make_etag('students',
+                                       revisions.table_version('student'),
+                                       revisions.table_version('teacher'))
+            cached = not_modified(etag)
+            if cached:
+                return cached
+
             students = get_sorted_students()
             student_list = []
             for s in students:
@@ -540,7 +537,7 @@ def create_app():
                         'display_name': t.display_name
                     } for t in s.preferred_teachers]
                 })
-            return jsonify(student_list)
+            return with_etag(jsonify(student_list), etag)
         except Exception as e:
             app.logger.error(f"Error in get_students: {e}")
             return jsonify({'error': str(e)}), 500
@@ -595,6 +592,7 @@ def create_app():
                 new_student.preferred_teachers.extend(teachers)
             db.session.add(new_student)
             db.session.commit()
+            revisions.bump_master('student')
             return jsonify({
                 'message': f'{new_student.name} を追加しました。',
                 'student_id': new_student.id
@@ -627,6 +625,7 @@ def create_app():
                 student.preferred_teachers.extend(teachers)
 
             db.session.commit()
+            revisions.bump_master('student')
             return jsonify({'message': '生徒情報を更新しました。'})
         except Exception as e:
             db.session.rollback()
@@ -641,6 +640,7 @@ def create_app():
                 return jsonify({'error': '指定された生徒が見つかりません。'}), 404
             db.session.delete(student)
             db.session.commit()
+            revisions.bump_master('student')
             return jsonify({'message': f'{student.name} を削除しました。'})
         except Exception as e:
             db.session.rollback()
@@ -654,13 +654,22 @@ def create_app():
             if not period_id:
                 return jsonify({'error': '計画期間IDを指定してください。'}), 400
 
-            requests = StudentRequest.query.filter_by(
-                planning_period_id=period_id).all()
+            etag = revisions.make_etag(
+                'requests', period_id,
+                revisions.table_version('request', period_id))
+            cached = not_modified(etag)
+            if cached:
+                return cached
+
+            # 回数0の行 (レッスンの紐付けのために残している行) は返さない
+            requests = StudentRequest.query.filter(
+                StudentRequest.planning_period_id == period_id,
+                StudentRequest.requested_lessons > 0).all()
             requests_map = {
                 f"{req.student_id}-{req.subject_id}": req.requested_lessons
                 for req in requests
             }
-            return jsonify(requests_map)
+            return with_etag(jsonify(requests_map), etag)
         except Exception as e:
             app.logger.error(f"Error in get_all_requests: {e}")
             return jsonify({'error': str(e)}), 500
@@ -675,21 +684,28 @@ def create_app():
             if not period_id:
                 return jsonify({'error': '計画期間IDを指定してください。'}), 400
 
-            StudentRequest.query.filter_by(
-                planning_period_id=period_id).delete()
-
-            for key, count in payload.items():
-                if int(count) > 0:
-                    student_id, subject_id = key.split('-')
-                    new_request = StudentRequest(student_id=int(student_id),
-                                                 subject_id=int(subject_id),
-                                                 requested_lessons=int(count),
-                                                 priority='MEDIUM',
-                                                 planning_period_id=period_id)
-                    db.session.add(new_request)
-
+            period_id = int(period_id)
+            desired, errors = student_requests.parse_payload(payload)
+            if errors:
+                return jsonify({
+                    'error': '保存できない行があります。',
+                    'results': errors
+                }), 400
+
+            # 既存の行との差分だけを書き込む (リクエストの id は変わらない)
+            results, changed_groups = student_requests.apply_requests(
+                period_id, desired)
             db.session.commit()
-            return jsonify({'message': 'レッスン数の設定を保存しました。'})
+            revisions.mark_changed(
+                'request', [(period_id, student_id, subject_id)
+                            for student_id, subject_id in changed_groups])
+            if changed_groups:
+                revisions.bump_periods([period_id])
+                revisions.bump_table('request', period_id)
+            return jsonify({
+                'message': 'レッスン数の設定を保存しました。',
+                'results': results
+            })
         except Exception as e:
             db.session.rollback()
             app.logger.error(f"Error in batch_update_requests: {e}")
@@ -702,20 +718,27 @@ def create_app():
             if not period_id:
                 return jsonify({'error': '計画期間IDを指定してください。'}), 400
 
+            etag = revisions.make_etag(
+                'shifts', teacher_id, period_id,
+                revisions.table_version('shift', teacher_id))
+            cached = not_modified(etag)
+            if cached:
+                return cached
+
             period = db.session.get(PlanningPeriod, period_id)
             if not period:
                 return jsonify({'error': '指定された計画期間が見つかりません。'}), 404
 
-            shifts = Shift.query.filter(
+            period_shifts = Shift.query.filter(
                 Shift.teacher_id == teacher_id,
                 Shift.date.between(period.start_date, period.end_date)).all()
             shift_map = {
                 f"{s.date.strftime('%Y-%m-%d')}-{s.time_slot_id}": {
                     'is_available': s.is_available
                 }
-                for s in shifts
+                for s in period_shifts
             }
-            return jsonify(shift_map)
+            return with_etag(jsonify(shift_map), etag)
         except Exception as e:
             return jsonify({'error': str(e)}), 500
 
@@ -733,28 +756,80 @@ def create_app():
             if not period:
                 return jsonify({'error': '指定された計画期間が見つかりません。'}), 404
 
-            # 期間内の既存シフトを削除
-            Shift.query.filter(
-                Shift.teacher_id == teacher_id,
-                Shift.date.between(period.start_date,
-                                   period.end_date)).delete()
-
-            # 新しいシフトを追加
+            desired = {}
             for key, value in shift_data.items():
                 date_str, time_slot_id_str = key.rsplit('-', 1)
                 date_obj = datetime.strptime(date_str, '%Y-%m-%d').date()
-                if value.get('is_available'):
-                    db.session.add(
-                        Shift(teacher_id=teacher_id,
-                              date=date_obj,
-                              time_slot_id=int(time_slot_id_str),
-                              is_available=True))
+                if period.start_date <= date_obj <= period.end_date:
+                    desired[(teacher_id, date_obj, int(time_slot_id_str))] = \
+                        bool(value.get('is_available'))
+
+            # 保存済みのシフトとの差分だけを書き込む
+            changed_cells = shifts.apply_shifts(period, desired, [teacher_id])
             db.session.commit()
+            record_shift_changes(changed_cells, [teacher_id])
             return jsonify({'message': 'シフトを保存しました。'})
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/api/shifts/import', methods=['POST'])
+    def import_shifts():
+        """複数講師のシフト表 (CSV または JSON) をまとめて取り込む
+
+        mode=replace (既定) なら、表に含まれる講師の期間内シフトを表の内容で置き換える。
+        mode=merge なら、表の行を追加・更新するだけで削除はしない。
+        """
+        try:
+            period_id = request.args.get('period_id', type=int)
+            mode = request.args.get('mode', 'replace')
+            if not period_id:
+                return jsonify({'error': '計画期間IDを指定してください。'}), 400
+            if mode not in ('replace', 'merge'):
+                return jsonify({'error': 'mode は replace か merge を指定してください。'}), 400
+
+            period = db.session.get(PlanningPeriod, period_id)
+            if not period:
+                return jsonify({'error': '指定された計画期間が見つかりません。'}), 404
+
+            rows = shifts.read_import_rows(request)
+            desired, teacher_ids, errors = shifts.build_import(period, rows)
+            if errors:
+                return jsonify({
+                    'error': 'シフト表に取り込めない行があります。',
+                    'errors': [{
+                        'row': line,
+                        'message': message
+                    } for line, message in errors]
+                }), 400
+            if not desired:
+                return jsonify({'error': '取り込むシフトがありません。'}), 400
+
+            changed_cells = shifts.apply_shifts(period,
+                                                desired,
+                                                sorted(teacher_ids),
+                                                replace=(mode == 'replace'))
+            db.session.commit()
+            record_shift_changes(changed_cells, teacher_ids)
+            return jsonify({
+                'message': f'{len(teacher_ids)}人分のシフトを取り込みました。',
+                'teachers': len(teacher_ids),
+                'rows': len(desired),
+                'changed': len(changed_cells)
+            })
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error in import_shifts: {e}")
+            return jsonify({'error': str(e)}), 500
+
+    def record_shift_changes(changed_cells, teacher_ids):
+        revisions.mark_changed('shift', changed_cells)
+        for teacher_id in teacher_ids:
+            revisions.bump_table('shift', teacher_id)
+        if changed_cells:
+            dates = [cell[1] for cell in changed_cells]
+            revisions.mark_schedule_changed(min(dates), max(dates))
+
     @app.route('/api/generate-schedule', methods=['POST'])
     def generate_schedule():
         return jsonify({"error":
@@ -791,7 +866,7 @@ def create_app():
                 assignments = query.all()
 
                 all_shifts = Shift.query.filter(
-                    Shift.teacher_id == teacher_id,
+                    Shift.teacher_id == teacher_id, Shift.is_available,
                     Shift.date.between(start_date, end_date)).all()
                 assigned_slots = {(a.date, a.time_slot_id)
                                   for a in assignments}
@@ -897,77 +972,23 @@ def create_app():
     @app.route('/api/planner-data/<int:period_id>', methods=['GET'])
     def get_planner_data(period_id):
         try:
+            # ?format=compact で列指向の形式を返す (planner.js で展開する)
+            compact = request.args.get('format') == 'compact'
+            encoding = compression.choose_encoding(request.accept_encodings)
+            # 組み立て前のバージョンを返すので、この間の変更は次回の差分取得に含まれる
+            version = revisions.period_version(period_id)
+            etag = revisions.make_etag('planner', period_id,
+                                       'compact' if compact else 'full',
+                                       encoding or 'identity', *version)
+            cached = not_modified(etag)
+            if cached:
+                cached.vary.add('Accept-Encoding')
+                return cached
+
             period = db.session.get(PlanningPeriod, period_id)
             if not period:
                 return jsonify({'error': '計画期間が見つかりません。'}), 404
 
-            assignments = Assignment.query.options(
-                db.joinedload(Assignment.lessons).joinedload(Lesson.student),
-                db.joinedload(Assignment.lessons).joinedload(Lesson.subject),
-                db.joinedload(Assignment.teacher)).filter(
-                    Assignment.date.between(period.start_date,
-                                            period.end_date)).all()
-
-            assignments_data = {}
-            for assign in assignments:
-                key = f"{assign.date.strftime('%Y-%m-%d')}-{assign.time_slot_id}"
-                if key not in assignments_data:
-                    assignments_data[key] = []
-
-                lessons_list = []
-                for lesson in assign.lessons:
-                    lessons_list.append({
-                        "id": lesson.id,
-                        "status": lesson.status,
-                        "student_id": lesson.student_id,
-                        "student_name": lesson.student.display_name,
-                        "subject_id": lesson.subject_id,
-                        "subject_name": lesson.subject.name
-                    })
-
-                assignments_data[key].append({
-                    "teacher_id": assign.teacher_id,
-                    "teacher_name": assign.teacher.display_name,
-                    "lessons": lessons_list
-                })
-
-            shifts = Shift.query.filter(
-                Shift.date.between(period.start_date, period.end_date)).all()
-            shifts_map = {
-                f"{s.date.strftime('%Y-%m-%d')}-{s.teacher_id}-{s.time_slot_id}":
-                True
-                for s in shifts
-            }
-
-            requests = StudentRequest.query.filter_by(
-                planning_period_id=period_id).all()
-            unassigned_map = {}
-            for req in requests:
-                key = f"{req.student_id}-{req.subject_id}"
-                if key not in unassigned_map:
-                    student = db.session.get(Student, req.student_id)
-                    subject = db.session.get(Subject, req.subject_id)
-                    unassigned_map[key] = {
-                        "count": 0,
-                        "student_id": req.student_id,
-                        "subject_id": req.subject_id,
-                        "student_name": student.name if student else "不明",
-                        "student_grade": student.grade if student else "不明",
-                        "subject_name": subject.name if subject else "不明"
-                    }
-                unassigned_map[key]["count"] += req.requested_lessons
-
-            for assignments_in_slot in assignments_data.values():
-                for assign in assignments_in_slot:
-                    for lesson in assign['lessons']:
-                        key = f"{lesson['student_id']}-{lesson['subject_id']}"
-                        if key in unassigned_map:
-                            unassigned_map[key]["count"] -= 1
-
-            unassigned_lessons = [
-                v for v in unassigned_map.values() if v['count'] > 0
-            ]
-
             teachers = Teacher.query.options(db.joinedload(
                 Teacher.subjects)).all()
             teachers_data = [{
@@ -977,18 +998,29 @@ def create_app():
                 'subject_ids': [s.id for s in t.subjects]
             } for t in teachers]
 
-            return jsonify({
+            payload = {
                 'period': {
                     'id': period.id,
                     'name': period.name,
                     'start_date': period.start_date.isoformat(),
                     'end_date': period.end_date.isoformat()
                 },
-                'assignments': assignments_data,
-                'shifts': shifts_map,
-                'unassigned_lessons': unassigned_lessons,
-                'teachers': teachers_data
-            })
+                'teachers': teachers_data,
+                'version': '.'.join(version)
+            }
+            if compact:
+                payload['format'] = 'compact'
+                payload.update(
+                    planner_data.build_compact(period,
+                                               [t.id for t in teachers]))
+            else:
+                payload['assignments'] = planner_data.build_assignments(period)
+                payload['shifts'] = planner_data.build_shifts(period)
+                payload['unassigned_lessons'] = planner_data.build_unassigned(
+                    period)
+
+            response = with_etag(jsonify(payload), etag)
+            return compression.compress_response(response, encoding)
 
         except Exception as e:
             app.logger.error(f"Error in get_planner_data: {e}")
@@ -996,6 +1028,76 @@ def create_app():
             traceback.print_exc()
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/api/planner-data/<int:period_id>/changes', methods=['GET'])
+    def get_planner_changes(period_id):
+        """version (前回取得したデータのバージョン) 以降に変わったコマ・シフト・未配置数だけを返す
+
+        バージョンは DB の data_version の値なので、どのプロセスが書き込んでも変わる。
+        差分はこのプロセスの変更履歴から作るため、他のプロセスの変更を挟む場合は全体を読み直させる。
+        """
+        try:
+            period = db.session.get(PlanningPeriod, period_id)
+            if not period:
+                return jsonify({'error': '計画期間が見つかりません。'}), 404
+
+            since_version = request.args.get('version')
+            if not since_version:
+                return jsonify({'error': 'version を指定してください。'}), 400
+
+            # 差分を作る前のバージョンを返すので、この間の変更は次回の差分取得に含まれる
+            master_token, period_token = revisions.period_version(period_id)
+            version = f'{master_token}.{period_token}'
+            if since_version == version:
+                return jsonify({
+                    'reset': False,
+                    'version': version,
+                    'assignments': {},
+                    'shifts': {},
+                    'unassigned_lessons': []
+                })
+
+            changes = None
+            since_master, _, since_period = since_version.partition('.')
+            if since_master == master_token:
+                since = revisions.synced_revision(f'period:{period_id}',
+                                                  since_period, period_token)
+                if since is not None:
+                    changes = revisions.changes_since(since)
+            # 差分が分からない場合やマスタが変わった場合は、全体の再取得を促す
+            if changes is None or any(kind == 'master'
+                                      for kind, _ in changes):
+                return jsonify({'reset': True, 'version': version})
+
+            slots = set()
+            shift_cells = set()
+            groups = set()
+            for kind, key in changes:
+                if kind == 'slot':
+                    teacher_id, date, time_slot_id = key
+                    slots.add((date, time_slot_id))
+                elif kind == 'shift':
+                    shift_cells.add(key)
+                elif kind == 'group':
+                    groups.add(key)
+                elif kind == 'request' and key[0] == period_id:
+                    groups.add(key[1:])
+
+            return jsonify({
+                'reset': False,
+                'version': version,
+                'assignments': planner_data.build_assignments(period, slots),
+                'shifts': planner_data.build_shifts(period, shift_cells),
+                'unassigned_lessons':
+                planner_data.build_unassigned(period, groups)
+                if groups else []
+            })
+
+        except Exception as e:
+            app.logger.error(f"Error in get_planner_changes: {e}")
+            import traceback
+            traceback.print_exc()
+            return jsonify({'error': str(e)}), 500
+
     @app.route('/api/planner/place-lesson', methods=['POST'])
     def place_lesson():
         try:
@@ -1008,12 +1110,21 @@ def create_app():
                 return jsonify({'error': 'リクエストに必要な情報が不足しています。'}), 400
 
             lesson_to_delete_id = data.get('lesson_to_delete_id')
+            changed_cells = []
+            changed_groups = []
             if lesson_to_delete_id:
                 lesson_to_delete = db.session.get(Lesson,
                                                   int(lesson_to_delete_id))
                 if lesson_to_delete:
                     # 追い出されるレッスンが所属していたコマを取得
                     original_assignment = lesson_to_delete.assignment
+                    changed_groups.append((lesson_to_delete.student_id,
+                                           lesson_to_delete.subject_id))
+                    if original_assignment:
+                        changed_cells.append(
+                            (original_assignment.teacher_id,
+                             original_assignment.date,
+                             original_assignment.time_slot_id))
 
                     db.session.delete(lesson_to_delete)
 
@@ -1051,6 +1162,10 @@ def create_app():
                                 memo='手動で配置')
             db.session.add(new_lesson)
             db.session.commit()
+            changed_cells.append((teacher_id, date_obj, time_slot_id))
+            changed_groups.append(
+                (int(data['student_id']), int(data['subject_id'])))
+            revisions.record_lesson_changes(changed_cells, changed_groups)
 
             return jsonify({'message': 'レッスンを配置しました。'})
 
@@ -1069,21 +1184,70 @@ def create_app():
             options = data.get('options', {})  # ▼▼▼ フロントからoptionsを受け取る ▼▼▼
             if not period_id:
                 return jsonify({'error': '計画期間IDが指定されていません。'}), 400
+            period_id = int(period_id)
+            if not db.session.get(PlanningPeriod, period_id):
+                return jsonify({'error': '指定された計画期間が見つかりません。'}), 404
 
-            with app.app_context():
-                # ▼▼▼ 受け取ったoptionsをスケジューラに渡す ▼▼▼
-                generator = ScheduleGenerator(period_id, options)
-                result = generator.generate()
+            # ▼▼▼ 受け取ったoptionsをスケジューラに渡し、ジョブとして登録する ▼▼▼
+            job = job_queue.submit(period_id, options)
+            if job is None:
+                active = job_queue.find_active(period_id)
+                return jsonify({
+                    'error': 'この計画期間の自動配置は既に実行中です。',
+                    'job_id': active.id if active else None
+                }), 409
 
-            return jsonify(result)
+            return jsonify(job.to_dict()), 202
 
         except Exception as e:
-            db.session.rollback()
             app.logger.error(f"Error in auto_assign_lessons: {e}")
             import traceback
             traceback.print_exc()
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/api/planner/jobs/<job_id>', methods=['GET'])
+    def get_auto_assign_job(job_id):
+        job = job_queue.get(job_id)
+        if not job:
+            return jsonify({'error': '指定されたジョブが見つかりません。'}), 404
+        return jsonify(job.to_dict())
+
+    @app.route('/api/planner/jobs/<job_id>/stream', methods=['GET'])
+    def stream_auto_assign_job(job_id):
+        job = job_queue.get(job_id)
+        if not job:
+            return jsonify({'error': '指定されたジョブが見つかりません。'}), 404
+
+        def events():
+            version = -1
+            while True:
+                new_version, state = job_queue.wait_for_update(
+                    job, version, timeout=15)
+                if new_version == version:
+                    # 接続維持のためのコメント行
+                    yield ': keep-alive\n\n'
+                    continue
+                version = new_version
+                finished = state['status'] in FINISHED_STATUSES
+                event = 'done' if finished else 'progress'
+                yield f"event: {event}\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
+                if finished:
+                    break
+
+        return Response(events(),
+                        mimetype='text/event-stream',
+                        headers={
+                            'Cache-Control': 'no-cache',
+                            'X-Accel-Buffering': 'no'
+                        })
+
+    @app.route('/api/planner/jobs/<job_id>/cancel', methods=['POST'])
+    def cancel_auto_assign_job(job_id):
+        job = job_queue.cancel(job_id)
+        if not job:
+            return jsonify({'error': '指定されたジョブが見つかりません。'}), 404
+        return jsonify(job.to_dict())
+
     @app.route('/api/planner/lessons/<int:lesson_id>', methods=['DELETE'])
     def delete_lesson(lesson_id):
         try:
@@ -1092,12 +1256,16 @@ def create_app():
                 return jsonify({'error': '指定されたレッスンが見つかりません。'}), 404
 
             assignment = lesson.assignment
+            changed_cells = [(assignment.teacher_id, assignment.date,
+                              assignment.time_slot_id)] if assignment else []
+            changed_groups = [(lesson.student_id, lesson.subject_id)]
             db.session.delete(lesson)
 
             if assignment and not assignment.lessons:
                 db.session.delete(assignment)
 
             db.session.commit()
+            revisions.record_lesson_changes(changed_cells, changed_groups)
             return jsonify({'message': 'レッスンを削除しました。'})
 
         except Exception as e:
@@ -1119,10 +1287,14 @@ def create_app():
             if not lesson_to_move:
                 return jsonify({'error': '指定されたレッスンが見つかりません。'}), 404
 
+            changed_groups = [(lesson_to_move.student_id,
+                               lesson_to_move.subject_id)]
             lesson_to_delete_id = data.get('lesson_to_delete_id')
             if lesson_to_delete_id:
                 lesson_to_delete = db.session.get(Lesson, lesson_to_delete_id)
                 if lesson_to_delete:
+                    changed_groups.append((lesson_to_delete.student_id,
+                                           lesson_to_delete.subject_id))
                     db.session.delete(lesson_to_delete)
 
             destination_date = datetime.strptime(data['date'],
@@ -1147,10 +1319,17 @@ def create_app():
             lesson_to_move.assignment = destination_assignment
             lesson_to_move.status = 'locked'
 
+            changed_cells = [(destination_teacher_id, destination_date,
+                              destination_ts_id)]
+            if original_assignment:
+                changed_cells.append(
+                    (original_assignment.teacher_id, original_assignment.date,
+                     original_assignment.time_slot_id))
             if original_assignment and not original_assignment.lessons:
                 db.session.delete(original_assignment)
 
             db.session.commit()
+            revisions.record_lesson_changes(changed_cells, changed_groups)
             return jsonify({'message': 'レッスンを移動しました。'})
 
         except Exception as e:
@@ -1173,7 +1352,11 @@ def create_app():
             else:
                 lesson.status = 'locked'
 
+            assignment = lesson.assignment
+            changed_cells = [(assignment.teacher_id, assignment.date,
+                              assignment.time_slot_id)] if assignment else []
             db.session.commit()
+            revisions.record_lesson_changes(changed_cells, [])
             return jsonify({
                 'message': f'レッスンの状態を「{lesson.status}」に変更しました。',
                 'new_status': lesson.status
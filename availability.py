@@ -0,0 +1,215 @@
+# availability.py (講師・生徒・コマの空き状況のビットセット)
+#
+# 計画期間の 日 x 時限 のグリッドをセル番号 (日 * 時限数 + 時限) で表し、
+# 講師ごとの「出勤可能かつ定員に空きがあるセル」と生徒ごとの「授業が入っているセル」を
+# Python の整数のビットセットで持つ。「この生徒がこの科目を担当できる講師と受けられるコマ」は
+# 担当可能な講師ごとに 講師の空き & ~生徒の予定 の AND 1回で求まる。
+# ScheduleGenerator (貪欲法の候補探索) と空き状況 API で共有する。
+
+import threading
+from datetime import timedelta
+
+from sqlalchemy import func
+
+from extensions import db
+import revisions
+from models import (Assignment, Lesson, Shift, Subject, Teacher, TimeSlot,
+                    teacher_subjects)
+
+# 1コマに入れられるレッスン数
+CAPACITY = 2
+
+# period_id -> (バージョン, AvailabilityModel)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def iter_bits(bits):
+    """ビットセットの立っているビットの位置を昇順に返す"""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def get_cached_model(period):
+    """期間のバージョンが変わっていなければ、読み込み済みの空き状況を返す (API 用。変更しないこと)"""
+    version = revisions.period_version(period.id)
+    with _cache_lock:
+        cached = _cache.get(period.id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    model = AvailabilityModel.load(period)
+    with _cache_lock:
+        _cache[period.id] = (version, model)
+    return model
+
+
+class AvailabilityModel:
+    """計画期間の空き状況
+
+    shift_cells は出勤可能な (teacher_id, date, time_slot_id)、fill は
+    (teacher_id, date, time_slot_id) -> レッスン数、busy は授業が入っている
+    (date, time_slot_id, student_id) で、いずれも ScheduleGenerator と同じ形で渡す。
+    """
+
+    def __init__(self, start_date, end_date, time_slot_ids, shift_cells,
+                 teacher_subject_ids, subject_levels, fill=None, busy=None):
+        self.start_date = start_date
+        self.time_slot_ids = sorted(time_slot_ids)
+        self.n_days = (end_date - start_date).days + 1
+        self.slot_index = {ts_id: i for i, ts_id in enumerate(self.time_slot_ids)}
+        self.n_cells = self.n_days * len(self.time_slot_ids)
+        self.all_cells = (1 << self.n_cells) - 1
+        self.cell_keys = [(start_date + timedelta(days=day), ts_id)
+                          for day in range(self.n_days)
+                          for ts_id in self.time_slot_ids]
+        self.subject_levels = subject_levels
+        self.teacher_subject_ids = teacher_subject_ids
+
+        # 講師ごと: 出勤可能なセル / 定員に達したセル / セルごとのレッスン数
+        self.shifts = {}
+        self.full = {}
+        self.fill = {}
+        for teacher_id, date, time_slot_id in shift_cells:
+            cell = self.cell_of(date, time_slot_id)
+            if cell is not None:
+                self.shifts[teacher_id] = self.shifts.get(teacher_id,
+                                                          0) | (1 << cell)
+        for (teacher_id, date, time_slot_id), count in (fill or {}).items():
+            cell = self.cell_of(date, time_slot_id)
+            if cell is not None and count:
+                self.fill[(teacher_id, cell)] = count
+                if count >= CAPACITY:
+                    self.full[teacher_id] = self.full.get(teacher_id,
+                                                          0) | (1 << cell)
+        # 生徒ごと: 授業が入っているセル
+        self.busy = {}
+        for date, time_slot_id, student_id in busy or ():
+            cell = self.cell_of(date, time_slot_id)
+            if cell is not None:
+                self.busy[student_id] = self.busy.get(student_id,
+                                                      0) | (1 << cell)
+        self._qualified = {}
+
+    @classmethod
+    def from_generator(cls, generator):
+        """ScheduleGenerator のメモリ上のインデックスから作る (候補は shift_keys のコマのみ)"""
+        return cls(generator.start_date, generator.end_date,
+                   {key[2] for key in generator.shift_keys},
+                   generator.shift_keys, generator.teacher_subject_ids,
+                   generator.subject_levels, generator.assignment_fill,
+                   generator.student_busy)
+
+    @classmethod
+    def load(cls, period, statuses=None):
+        """DB から期間の現在の空き状況を読み込む
+
+        statuses を指定すると、その状態 (例: ('locked',)) のレッスンだけが枠を使っているとみなす。
+        """
+        in_period = Assignment.date.between(period.start_date, period.end_date)
+        if statuses:
+            in_period = in_period & Lesson.status.in_(statuses)
+        teacher_subject_ids = {
+            t_id: set()
+            for (t_id, ) in db.session.query(Teacher.id)
+        }
+        for t_id, s_id in db.session.query(teacher_subjects.c.teacher_id,
+                                           teacher_subjects.c.subject_id):
+            teacher_subject_ids[t_id].add(s_id)
+        shift_cells = db.session.query(
+            Shift.teacher_id, Shift.date, Shift.time_slot_id).filter(
+                Shift.is_available,
+                Shift.date.between(period.start_date,
+                                   period.end_date)).tuples().all()
+        fill = {(teacher_id, date, time_slot_id): count
+                for teacher_id, date, time_slot_id, count in db.session.query(
+                    Assignment.teacher_id, Assignment.date,
+                    Assignment.time_slot_id, func.count(Lesson.id)).join(
+                        Lesson, Lesson.assignment_id == Assignment.id).filter(
+                            in_period).group_by(Assignment.teacher_id,
+                                                Assignment.date,
+                                                Assignment.time_slot_id)}
+        busy = db.session.query(Assignment.date, Assignment.time_slot_id,
+                                Lesson.student_id).join(
+                                    Lesson, Lesson.assignment_id ==
+                                    Assignment.id).filter(in_period).tuples()
+        return cls(period.start_date, period.end_date,
+                   [ts_id for (ts_id, ) in db.session.query(TimeSlot.id)],
+                   shift_cells, teacher_subject_ids,
+                   dict(db.session.query(Subject.id, Subject.level)), fill,
+                   busy)
+
+    def cell_of(self, date, time_slot_id):
+        """(date, time_slot_id) のセル番号。期間外なら None"""
+        day = (date - self.start_date).days
+        slot = self.slot_index.get(time_slot_id)
+        if slot is None or not 0 <= day < self.n_days:
+            return None
+        return day * len(self.time_slot_ids) + slot
+
+    def cell_key(self, cell):
+        """セル番号を (date, time_slot_id) に戻す"""
+        return self.cell_keys[cell]
+
+    def teacher_free(self, teacher_id):
+        """講師が出勤可能で、定員に空きのあるセル"""
+        return self.shifts.get(teacher_id, 0) & ~self.full.get(teacher_id, 0)
+
+    def student_free(self, student_id):
+        return self.all_cells & ~self.busy.get(student_id, 0)
+
+    def qualified_teachers(self, subject_id):
+        """科目を担当できる講師 (高校科目以外は出勤のある全講師) の ID を昇順で返す"""
+        teachers = self._qualified.get(subject_id)
+        if teachers is None:
+            if self.subject_levels.get(subject_id) == '高校':
+                teachers = sorted(
+                    t_id for t_id in self.shifts
+                    if subject_id in self.teacher_subject_ids.get(t_id, ()))
+            else:
+                teachers = sorted(self.shifts)
+            self._qualified[subject_id] = teachers
+        return teachers
+
+    def feasible(self, student_id, subject_id):
+        """{teacher_id: 配置できるセルのビットセット} を返す (空の講師は含めない)"""
+        student_free = self.student_free(student_id)
+        result = {}
+        for teacher_id in self.qualified_teachers(subject_id):
+            bits = self.teacher_free(teacher_id) & student_free
+            if bits:
+                result[teacher_id] = bits
+        return result
+
+    def feasible_cells(self, student_id, subject_id):
+        """配置できるコマを [(date, time_slot_id, [teacher_id, ...]), ...] で日付・時限順に返す"""
+        teachers_by_cell = {}
+        for teacher_id, bits in self.feasible(student_id, subject_id).items():
+            for cell in iter_bits(bits):
+                teachers_by_cell.setdefault(cell, []).append(teacher_id)
+        return [self.cell_key(cell) + (teachers_by_cell[cell], )
+                for cell in sorted(teachers_by_cell)]
+
+    def mark_placed(self, key, student_id):
+        teacher_id, date, time_slot_id = key
+        cell = self.cell_of(date, time_slot_id)
+        if cell is None:
+            return
+        count = self.fill.get((teacher_id, cell), 0) + 1
+        self.fill[(teacher_id, cell)] = count
+        if count >= CAPACITY:
+            self.full[teacher_id] = self.full.get(teacher_id, 0) | (1 << cell)
+        self.busy[student_id] = self.busy.get(student_id, 0) | (1 << cell)
+
+    def mark_released(self, key, student_id):
+        teacher_id, date, time_slot_id = key
+        cell = self.cell_of(date, time_slot_id)
+        if cell is None:
+            return
+        count = self.fill.get((teacher_id, cell), 0) - 1
+        self.fill[(teacher_id, cell)] = count
+        if count < CAPACITY:
+            self.full[teacher_id] = self.full.get(teacher_id, 0) & ~(1 << cell)
+        self.busy[student_id] = self.busy.get(student_id, 0) & ~(1 << cell)
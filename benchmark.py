@@ -0,0 +1,280 @@
+# benchmark.py (スケジューラと主要 API の性能計測)
+#
+# synthetic_data.py の合成データ (サイズ別) を一時的な SQLite ファイルに作り、
+# ScheduleGenerator.generate() の実行時間・発行クエリ数・ピークメモリと、
+# プランナー・分析・時間割 API のレイテンシを計測して JSON で出力する。
+#
+# 使い方:
+#   python benchmark.py --output baseline.json              基準値を保存する
+#   python benchmark.py --compare baseline.json             基準値と比べて劣化を検出する
+#   python benchmark.py --sizes small,medium --repeat 10    サイズ・回数を指定する
+#
+# --compare で劣化 (基準値より threshold 以上悪化) があれば終了コード 1 を返す。
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import sqlalchemy
+from sqlalchemy import event
+
+# データセットのサイズ (synthetic_data.generate のオプション)
+SIZES = {
+    'small': {
+        'teachers': 20,
+        'students': 200,
+        'periods': 1
+    },
+    'medium': {
+        'teachers': 50,
+        'students': 600,
+        'periods': 1
+    },
+    'large': {
+        'teachers': 100,
+        'students': 1500,
+        'periods': 1
+    },
+}
+DEFAULT_SIZES = ['small', 'medium']
+
+# 計測する generate() のオプション (科目間隔・優先講師ルールも有効にする)
+GENERATE_OPTIONS = {
+    'seed': 0,
+    'subject_interval_days': 3,
+    'interval_strength': 'normal',
+    'preferred_strength': 'normal'
+}
+
+# 比較時に「小さいほど良い」とみなす指標
+COMPARED_METRICS = ('seconds', 'queries', 'peak_mb', 'median_ms')
+DEFAULT_THRESHOLD = 0.2
+# 誤差が大きい短時間の計測は、この値未満の差なら劣化とみなさない
+MIN_DIFFERENCE = {'seconds': 0.05, 'median_ms': 2.0, 'peak_mb': 1.0}
+
+
+class QueryCounter:
+    """エンジンが実行した SQL の数を数える (executemany は1回と数える)"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def _quiet(function, *args, **kwargs):
+    """スケジューラの進捗表示を抑えて function を呼ぶ"""
+    import contextlib
+    import io
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def benchmark_generate(app, period_id, options):
+    """generate() を計測する。時間・クエリ数を測る実行と、メモリを測る実行は分ける"""
+    from extensions import db
+    from scheduler import ScheduleGenerator
+
+    with app.app_context():
+        with QueryCounter(db.engine) as counter:
+            started = time.perf_counter()
+            result = _quiet(
+                lambda: ScheduleGenerator(period_id, options).generate())
+            seconds = time.perf_counter() - started
+        db.session.remove()
+
+    # tracemalloc は実行を遅くするので、メモリは別の実行で測る
+    with app.app_context():
+        tracemalloc.start()
+        _quiet(lambda: ScheduleGenerator(period_id, options).generate())
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        db.session.remove()
+
+    return {
+        'seconds': round(seconds, 3),
+        'queries': counter.count,
+        'peak_mb': round(peak / 1024 / 1024, 1),
+        'placed': result['placed'],
+        'unplaced': result['unplaced']
+    }
+
+
+def benchmark_endpoint(client, url, repeat):
+    """url を repeat 回呼び、初回と中央値のレイテンシ (ミリ秒) を返す"""
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} が {response.status_code} を返しました")
+        size = len(response.data)
+    return {
+        'first_ms': round(timings[0], 2),
+        'median_ms': round(statistics.median(timings), 2),
+        'bytes': size
+    }
+
+
+def run_size(name, dataset_options, repeat, workdir):
+    # create_app は DATABASE_URL を見るので、データセットごとに切り替える
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+        workdir, f'{name}.db')
+    from app import create_app
+    from extensions import db
+    from models import PlanningPeriod, Teacher
+    import synthetic_data
+
+    app = create_app()
+    with app.app_context():
+        counts = _quiet(synthetic_data.generate, dict(dataset_options, seed=0))
+        period_id = db.session.query(PlanningPeriod.id).order_by(
+            PlanningPeriod.id).limit(1).scalar()
+        teacher_id = db.session.query(Teacher.id).order_by(
+            Teacher.id).limit(1).scalar()
+        db.session.remove()
+
+    print(f"[{name}] 講師 {counts['teacher']}人 / 生徒 {counts['student']}人 / "
+          f"リクエスト {counts['requested_lessons']}コマ")
+    result = {'dataset': counts}
+    result['generate'] = benchmark_generate(app, period_id, GENERATE_OPTIONS)
+    print(f"  generate: {result['generate']['seconds']}秒, "
+          f"{result['generate']['queries']}クエリ, "
+          f"{result['generate']['peak_mb']}MB")
+
+    client = app.test_client()
+    endpoints = {
+        'planner_data': f'/api/planner-data/{period_id}',
+        'planner_data_compact': f'/api/planner-data/{period_id}?format=compact',
+        'analysis': f'/api/period/{period_id}/analysis',
+        'schedule_teacher':
+        f'/api/schedule?period_id={period_id}&teacher_id={teacher_id}',
+    }
+    result['api'] = {}
+    for key, url in endpoints.items():
+        result['api'][key] = benchmark_endpoint(client, url, repeat)
+        print(f"  {key}: 初回 {result['api'][key]['first_ms']}ms, "
+              f"中央値 {result['api'][key]['median_ms']}ms")
+    return result
+
+
+def _flatten(results):
+    """{サイズ: {...}} を {'サイズ.区分.指標': 値} の形にする (比較対象の指標のみ)"""
+    flat = {}
+    for size, result in results.items():
+        flat.update({
+            f'{size}.generate.{metric}': value
+            for metric, value in result['generate'].items()
+            if metric in COMPARED_METRICS
+        })
+        for endpoint, values in result['api'].items():
+            flat.update({
+                f'{size}.api.{endpoint}.{metric}': value
+                for metric, value in values.items()
+                if metric in COMPARED_METRICS
+            })
+    return flat
+
+
+def compare(current, baseline, threshold):
+    """基準値より threshold (割合) 以上悪化した指標のリストを返す"""
+    current_flat = _flatten(current['results'])
+    baseline_flat = _flatten(baseline['results'])
+    regressions = []
+    for key, value in sorted(current_flat.items()):
+        base = baseline_flat.get(key)
+        if base is None:
+            continue
+        metric = key.rsplit('.', 1)[1]
+        if (value > base * (1 + threshold)
+                and value - base >= MIN_DIFFERENCE.get(metric, 0)):
+            regressions.append({
+                'metric': key,
+                'baseline': base,
+                'current': value,
+                'change': round((value - base) / base, 3) if base else None
+            })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='スケジューラと API の性能を計測する')
+    parser.add_argument('--sizes',
+                        default=','.join(DEFAULT_SIZES),
+                        help=f"計測するサイズ ({', '.join(SIZES)})")
+    parser.add_argument('--repeat', type=int, default=5, help='API を呼ぶ回数')
+    parser.add_argument('--output', help='結果を書き出す JSON ファイル')
+    parser.add_argument('--compare', help='比較する基準値の JSON ファイル')
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=DEFAULT_THRESHOLD,
+                        help='劣化とみなす悪化の割合 (既定 0.2 = 20%%)')
+    args = parser.parse_args()
+
+    sizes = [size.strip() for size in args.sizes.split(',') if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"不明なサイズです: {', '.join(unknown)}")
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'platform': platform.platform(),
+            'repeat': args.repeat
+        },
+        'results': {}
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            report['results'][size] = run_size(size, SIZES[size], args.repeat,
+                                               workdir)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        report['comparison'] = {
+            'baseline': args.compare,
+            'threshold': args.threshold,
+            'regressions': regressions
+        }
+        if regressions:
+            print(f"\n❌ {len(regressions)}件の劣化があります:")
+            for item in regressions:
+                print(f"  {item['metric']}: {item['baseline']} → {item['current']}")
+        else:
+            print("\n✅ 基準値からの劣化はありません。")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果を {args.output} に書き出しました。")
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.compare and report['comparison']['regressions']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
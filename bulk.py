@@ -0,0 +1,80 @@
+# bulk.py (大量の行をまとめて追加・更新する)
+#
+# PostgreSQL (psycopg) では COPY FROM STDIN で、それ以外では executemany の
+# INSERT で書き込む。どちらも呼び出し側のセッションのトランザクション内で実行する。
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+from extensions import db
+
+# ON CONFLICT 句を持つ INSERT を作れる方言
+_UPSERT_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def insert_rows(table, rows):
+    """table (Core の Table) に rows (dict のリスト) を追加する
+
+    rows に無い列は、Python 側の既定値 (default=...) があればそれで埋める。
+    追加した行の id が必要な場合は使わないこと (COPY は id を返さない)。
+    """
+    if not rows:
+        return
+    connection = db.session.connection()
+    if connection.dialect.driver == 'psycopg':
+        _copy_rows(connection, table, rows)
+    else:
+        connection.execute(insert(table), rows)
+
+
+def upsert_rows(table, rows, index_elements, update_columns):
+    """INSERT ... ON CONFLICT DO UPDATE で rows を追加・更新する
+
+    index_elements は一意インデックスの列名、update_columns は衝突時に
+    上書きする列名。
+    """
+    if not rows:
+        return
+    connection = db.session.connection()
+    statement = _UPSERT_INSERTS[connection.dialect.name](table)
+    statement = statement.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={name: statement.excluded[name]
+              for name in update_columns})
+    connection.execute(statement, rows)
+
+
+def insert_missing_rows(table, rows, index_elements):
+    """INSERT ... ON CONFLICT DO NOTHING で、まだ無い rows だけを追加し、追加した行数を返す"""
+    if not rows:
+        return 0
+    connection = db.session.connection()
+    statement = _UPSERT_INSERTS[connection.dialect.name](table)
+    statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+    return connection.execute(statement, rows).rowcount
+
+
+def _copy_rows(connection, table, rows):
+    columns = list(rows[0].keys())
+    defaults = {
+        column.key: column.default.arg
+        for column in table.columns
+        if column.key not in columns and column.default is not None
+        and column.default.is_scalar
+    }
+    columns += list(defaults)
+
+    quote = connection.dialect.identifier_preparer.quote
+    sql = (f"COPY {quote(table.name)} "
+           f"({', '.join(quote(table.columns[key].name) for key in columns)})"
+           " FROM STDIN")
+    cursor = connection.connection.driver_connection.cursor()
+    try:
+        with cursor.copy(sql) as copy:
+            for row in rows:
+                copy.write_row([
+                    row[key] if key in row else defaults[key]
+                    for key in columns
+                ])
+    finally:
+        cursor.close()
@@ -0,0 +1,39 @@
+# compression.py (JSON レスポンスの圧縮)
+
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli が無い環境では gzip のみ使う
+    brotli = None
+
+# これより小さいレスポンスは圧縮しない
+MIN_SIZE = 1024
+
+
+def is_available():
+    return brotli is not None
+
+
+def choose_encoding(accept_encodings):
+    """Accept-Encoding から使う圧縮方式 ('br' / 'gzip') を選ぶ。使わない場合は None"""
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return accept_encodings.best_match(candidates)
+
+
+def compress_response(response, encoding):
+    """Flask のレスポンス本文を encoding で圧縮し、ヘッダーを設定する"""
+    response.vary.add('Accept-Encoding')
+    if not encoding or response.status_code != 200 or response.direct_passthrough:
+        return response
+    data = response.get_data()
+    if len(data) < MIN_SIZE:
+        return response
+
+    if encoding == 'br':
+        data = brotli.compress(data, quality=5)
+    else:
+        data = gzip.compress(data, compresslevel=6)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
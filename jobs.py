@@ -0,0 +1,182 @@
+# jobs.py (自動配置のバックグラウンド実行と進捗管理)
+
+import itertools
+import queue
+import threading
+import time
+import traceback
+
+from extensions import db
+
+# 完了したジョブをメモリ上に残しておく件数
+MAX_FINISHED_JOBS = 50
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+class Job:
+    """1回分の自動配置ジョブ (状態は JobQueue のロックの下で更新する)"""
+
+    def __init__(self, job_id, period_id, options):
+        self.id = job_id
+        self.period_id = period_id
+        self.options = options
+        self.status = 'queued'
+        self.phase = None
+        self.processed = 0
+        self.total = 0
+        self.placed = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self):
+        if self.started_at is None:
+            elapsed = 0
+        else:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            'job_id': self.id,
+            'period_id': self.period_id,
+            'status': self.status,
+            'phase': self.phase,
+            'processed': self.processed,
+            'total': self.total,
+            'placed': self.placed,
+            'elapsed': round(elapsed, 1),
+            'result': self.result,
+            'error': self.error
+        }
+
+
+class JobQueue:
+    """自動配置ジョブを1本のワーカースレッドで順番に実行する"""
+
+    def __init__(self, app):
+        self.app = app
+        self.jobs = {}
+        self.queue = queue.Queue()
+        self.condition = threading.Condition()
+        self._ids = itertools.count(1)
+        self._worker = None
+
+    def submit(self, period_id, options):
+        """ジョブを登録する。同じ期間のジョブが実行待ち・実行中なら None を返す"""
+        with self.condition:
+            for job in self.jobs.values():
+                if job.period_id == period_id and not job.finished:
+                    return None
+            job = Job(str(next(self._ids)), period_id, options)
+            self.jobs[job.id] = job
+            self._prune()
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run,
+                                                name='auto-assign-worker',
+                                                daemon=True)
+                self._worker.start()
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def find_active(self, period_id):
+        with self.condition:
+            for job in self.jobs.values():
+                if job.period_id == period_id and not job.finished:
+                    return job
+        return None
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        with self.condition:
+            if job.status == 'queued':
+                self._finish(job, 'cancelled')
+        return job
+
+    def wait_for_update(self, job, version, timeout):
+        """job.version が version より進むか、timeout 秒経つまで待つ"""
+        with self.condition:
+            self.condition.wait_for(lambda: job.version > version, timeout)
+            return job.version, job.to_dict()
+
+    def _update(self, job, **fields):
+        with self.condition:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.version += 1
+            self.condition.notify_all()
+
+    def _finish(self, job, status, **fields):
+        # self.condition を保持した状態で呼ぶ
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job.status = status
+        job.finished_at = time.time()
+        job.version += 1
+        self.condition.notify_all()
+
+    def _prune(self):
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            del self.jobs[job.id]
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job.finished:  # 実行前にキャンセルされたジョブ
+                continue
+            self._execute(job)
+
+    def _execute(self, job):
+        from scheduler import ScheduleGenerator, GenerationCancelled
+
+        def report(phase, processed, total, placed):
+            self._update(job,
+                         phase=phase,
+                         processed=processed,
+                         total=total,
+                         placed=placed)
+
+        with self.condition:
+            # キューから取り出した後に cancel() が来ていれば実行しない
+            # (終了したジョブが 'running' に戻らないよう、状態の確認と変更を同じロックの下で行う)
+            if job.finished or job.cancel_event.is_set():
+                if not job.finished:
+                    self._finish(job, 'cancelled')
+                return
+            job.status = 'running'
+            job.started_at = time.time()
+            job.version += 1
+            self.condition.notify_all()
+
+        with self.app.app_context():
+            try:
+                generator = ScheduleGenerator(job.period_id, job.options)
+                result = generator.generate(
+                    progress_callback=report,
+                    should_cancel=job.cancel_event.is_set)
+                with self.condition:
+                    self._finish(job, 'completed', result=result)
+            except GenerationCancelled:
+                db.session.rollback()
+                with self.condition:
+                    self._finish(job, 'cancelled')
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f"Error in auto-assign job {job.id}: {e}")
+                traceback.print_exc()
+                with self.condition:
+                    self._finish(job, 'failed', error=str(e))
+            finally:
+                db.session.remove()
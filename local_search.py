@@ -0,0 +1,279 @@
+# local_search.py (配置後の局所探索による改善フェーズ)
+
+import math
+import random
+import time
+
+from scoring import INTERVAL_PENALTIES, PREFERRED_BONUSES, REJECT_SCORE
+
+# 追い出し連鎖の深さと、1レッスンあたりに試す追い出し先の数
+EJECT_DEPTH = 2
+EJECT_CANDIDATES = 30
+
+
+class LocalSearch:
+    """ScheduleGenerator のメモリ上の配置結果を、コミット前に改善する
+
+    - 未配置レッスンは「直接配置 → 追い出し連鎖 (eject chain)」で挿入を試みる
+    - 配置済みレッスンは移動・交換の近傍を焼きなまし法で探索し、
+      科目間隔・優先講師のソフト制約の点数を改善する
+    動かすのは今回の自動配置で置いたレッスンだけなので、
+    ロック済み (status='locked') のレッスンと既存コマの定員は維持される。
+    """
+
+    def __init__(self, generator, unplaced, time_budget, seed=None):
+        self.gen = generator
+        self.unplaced = list(unplaced)
+        self.time_budget = float(time_budget)
+        self.random = random.Random(seed)
+
+        self.interval_penalty = 0
+        if generator.subject_interval_rule_active:
+            self.interval_penalty = INTERVAL_PENALTIES.get(
+                generator.interval_strength, 0)
+        self.preferred_bonus = 0
+        if generator.preferred_teacher_rule_active:
+            self.preferred_bonus = PREFERRED_BONUSES.get(
+                generator.preferred_strength, 0)
+
+        # 逆引き用インデックス (今回配置したレッスンのみ)
+        self.by_key = {}
+        self.by_student_cell = {}
+        self.by_group = {}
+        # 乱択用の配置済みレッスン一覧と、その位置
+        self.placed_list = []
+        self.placed_pos = {}
+        for lesson, key in generator.placements.items():
+            self._index(lesson, key)
+
+    # --- インデックス管理 ---
+    def _index(self, lesson, key):
+        teacher_id, date, time_slot_id = key
+        self.by_key.setdefault(key, []).append(lesson)
+        self.by_student_cell[(lesson.student_id, date, time_slot_id)] = lesson
+        self.by_group.setdefault((lesson.student_id, lesson.subject_id),
+                                 []).append(lesson)
+        self.placed_pos[lesson] = len(self.placed_list)
+        self.placed_list.append(lesson)
+
+    def _unindex(self, lesson, key):
+        teacher_id, date, time_slot_id = key
+        self.by_key[key].remove(lesson)
+        self.by_student_cell.pop((lesson.student_id, date, time_slot_id),
+                                 None)
+        self.by_group[(lesson.student_id, lesson.subject_id)].remove(lesson)
+        # 末尾の要素と入れ替えて O(1) で取り除く
+        pos = self.placed_pos.pop(lesson)
+        last = self.placed_list.pop()
+        if last is not lesson:
+            self.placed_list[pos] = last
+            self.placed_pos[last] = pos
+
+    def _place(self, lesson, key):
+        teacher_id, date, time_slot_id = key
+        self.gen._assign_lesson_to_slot(lesson, {
+            "teacher_id": teacher_id,
+            "date": date,
+            "time_slot_id": time_slot_id
+        })
+        self._index(lesson, key)
+
+    def _release(self, lesson):
+        key = self.gen.placements[lesson]
+        self.gen._release_lesson(lesson)
+        self._unindex(lesson, key)
+        return key
+
+    def _can_place(self, lesson, key):
+        """key が空いていて、貪欲法が拒否する点数 (REJECT_SCORE 以下) でなければ True
+
+        「strong」の科目間隔ルールに反するコマなどへ、移動・交換・追い出しで置かないため。
+        """
+        if not self.gen._is_slot_assignable(lesson, *key):
+            return False
+        return self.gen._calculate_slot_score(lesson, key[0],
+                                              key[1]) > REJECT_SCORE
+
+    def _qualified(self, lesson, teacher_id):
+        if self.gen.subject_levels.get(lesson.subject_id) != '高校':
+            return True
+        return lesson.subject_id in self.gen.teacher_subject_ids.get(
+            teacher_id, ())
+
+    # --- 目的関数 (ソフト制約) ---
+    def _group_score(self, group_key, extra_dates=()):
+        """同じ生徒・科目のレッスン日の並びに対する科目間隔ペナルティ (負の値)"""
+        if not self.interval_penalty:
+            return 0
+        dates = [
+            self.gen.placements[l][1] for l in self.by_group.get(group_key, ())
+        ]
+        dates.extend(extra_dates)
+        dates.extend(self.gen.db_lesson_dates.get(group_key, ()))
+        dates.sort()
+        days = self.gen.subject_interval_days
+        penalty = 0
+        for prev, curr in zip(dates, dates[1:]):
+            gap = (curr - prev).days
+            if gap < days:
+                penalty += self.interval_penalty * (days - gap)
+        return -penalty
+
+    def _teacher_score(self, lesson, teacher_id):
+        if teacher_id in self.gen.preferred_teacher_ids.get(
+                lesson.student_id, ()):
+            return self.preferred_bonus
+        return 0
+
+    def _lesson_score(self, lesson, key):
+        return self._teacher_score(lesson, key[0]) + self._group_score(
+            (lesson.student_id, lesson.subject_id))
+
+    def total_score(self):
+        """配置全体のソフト制約スコア (結果どうしの比較用)"""
+        score = sum(
+            self._teacher_score(lesson, key[0])
+            for lesson, key in self.gen.placements.items())
+        score += sum(self._group_score(group) for group in self.by_group)
+        return score
+
+    # --- 未配置レッスンの挿入 ---
+    def _insert(self, lesson, depth, tabu):
+        slot = self.gen._find_best_slot_for_lesson(lesson)
+        if slot:
+            self._place(lesson, (slot['teacher_id'], slot['date'],
+                                 slot['time_slot_id']))
+            return True
+        if depth <= 0 or self._timed_out():
+            return False
+
+        candidates = [
+            key for key in self.gen.shift_keys
+            if key not in tabu and self._qualified(lesson, key[0])
+        ]
+        self.random.shuffle(candidates)
+        for key in candidates[:EJECT_CANDIDATES]:
+            if self._eject_and_insert(lesson, key, depth, tabu):
+                return True
+        return False
+
+    def _eject_and_insert(self, lesson, key, depth, tabu):
+        """key を塞いでいる今回配置分のレッスンを1つ追い出して lesson を入れる"""
+        teacher_id, date, time_slot_id = key
+        blockers = []
+        same_cell = self.by_student_cell.get(
+            (lesson.student_id, date, time_slot_id))
+        if same_cell is not None:
+            blockers.append(same_cell)
+        elif (date, time_slot_id, lesson.student_id) in self.gen.student_busy:
+            return False  # ロック済みなど動かせないレッスンと重なっている
+        if self.gen.assignment_fill.get(key, 0) >= 2:
+            if same_cell is not None and same_cell not in self.by_key.get(
+                    key, ()):
+                return False  # 生徒の重複と満席を同時に解消できない
+            blockers.extend(l for l in self.by_key.get(key, ())
+                            if l not in blockers)
+        if not blockers:
+            return False
+
+        for blocker in blockers:
+            original_key = self._release(blocker)
+            if self._can_place(lesson, key):
+                self._place(lesson, key)
+                if self._insert(blocker, depth - 1, tabu | {key}):
+                    return True
+                self._release(lesson)
+            self._place(blocker, original_key)
+        return False
+
+    def _repair(self):
+        still_unplaced = []
+        for lesson in self.unplaced:
+            if self._timed_out() or not self._insert(lesson, EJECT_DEPTH,
+                                                     frozenset()):
+                still_unplaced.append(lesson)
+        repaired = len(self.unplaced) - len(still_unplaced)
+        self.unplaced = still_unplaced
+        return repaired
+
+    # --- 焼きなまし法 ---
+    def _try_move(self, temperature):
+        lesson = self.random.choice(self.placed_list)
+        new_key = self.random.choice(self.gen.shift_keys)
+        old_key = self.gen.placements[lesson]
+        if new_key == old_key or not self._qualified(lesson, new_key[0]):
+            return
+        before = self._lesson_score(lesson, old_key)
+        self._release(lesson)
+        if not self._can_place(lesson, new_key):
+            self._place(lesson, old_key)
+            return
+        self._place(lesson, new_key)
+        delta = self._lesson_score(lesson, new_key) - before
+        if not self._accept(delta, temperature):
+            self._release(lesson)
+            self._place(lesson, old_key)
+
+    def _try_swap(self, temperature):
+        if len(self.placed_list) < 2:
+            return
+        a, b = self.random.sample(self.placed_list, 2)
+        key_a, key_b = self.gen.placements[a], self.gen.placements[b]
+        if key_a == key_b or not (self._qualified(a, key_b[0])
+                                  and self._qualified(b, key_a[0])):
+            return
+        before = self._lesson_score(a, key_a) + self._lesson_score(b, key_b)
+        self._release(a)
+        self._release(b)
+        if self._can_place(a, key_b):
+            self._place(a, key_b)
+            if self._can_place(b, key_a):
+                self._place(b, key_a)
+                delta = (self._lesson_score(a, key_b) +
+                         self._lesson_score(b, key_a)) - before
+                if self._accept(delta, temperature):
+                    return
+                self._release(b)
+            self._release(a)
+        self._place(a, key_a)
+        self._place(b, key_b)
+
+    def _accept(self, delta, temperature):
+        if delta >= 0:
+            return True
+        return self.random.random() < math.exp(delta / temperature)
+
+    def _timed_out(self):
+        # ジョブのキャンセル要求も打ち切り条件として扱う
+        return (time.monotonic() >= self.deadline
+                or self.gen.cancel_requested())
+
+    def run(self):
+        self.started = time.monotonic()
+        self.deadline = self.started + self.time_budget
+        initial_unplaced = len(self.unplaced)
+        print(f"★ 局所探索を開始します (制限 {self.time_budget:.0f} 秒, "
+              f"未配置 {initial_unplaced}コマ)")
+
+        self._repair()
+        has_soft_rules = bool(self.interval_penalty or self.preferred_bonus)
+        start_temp, end_temp = 100.0, 1.0
+        iterations = 0
+        while not self._timed_out() and self.gen.placements:
+            if not has_soft_rules and not self.unplaced:
+                break
+            progress = (time.monotonic() - self.started) / self.time_budget
+            temperature = start_temp * (end_temp / start_temp)**progress
+            # ソフト制約が無い場合も、移動・交換は空きを作るための摂動になる
+            if self.random.random() < 0.5:
+                self._try_move(temperature)
+            else:
+                self._try_swap(temperature)
+            iterations += 1
+            # 配置が動いて空きができたら、未配置レッスンの挿入を再度試す
+            if self.unplaced and iterations % 200 == 0:
+                self._repair()
+
+        print(f"★ 局所探索完了: {initial_unplaced - len(self.unplaced)}コマを追加配置 "
+              f"(反復 {iterations} 回, 残り未配置 {len(self.unplaced)}コマ)")
+        return self.unplaced
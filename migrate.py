@@ -0,0 +1,191 @@
+# migrate.py (既存の schedule.db にインデックス・一意制約を追加する)
+#
+# 使い方:
+#   python migrate.py          重複データを整理してインデックスを作成し、実行計画を確認する
+#   python migrate.py --check  実行計画の確認だけを行う
+
+import sys
+from datetime import date
+from types import SimpleNamespace
+
+from sqlalchemy import func
+
+from app import create_app
+from extensions import db
+import planner_data
+import revisions
+import scheduler
+import shifts
+from models import Shift, Assignment, Lesson, StudentRequest, PlanningPeriod
+
+
+def _duplicate_groups(model, columns):
+    """columns が同じ行のグループごとに、id のリスト (小さい順) を返す"""
+    rows = db.session.query(model.id, *columns).order_by(*columns,
+                                                          model.id).all()
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[1:]), []).append(row[0])
+    return [ids for ids in groups.values() if len(ids) > 1]
+
+
+def dedupe():
+    """一意制約に反する重複行を、id が最小の行にまとめる"""
+    # シフト: 同じ講師・コマの重複は1件だけ残す
+    removed = 0
+    for ids in _duplicate_groups(
+            Shift, [Shift.teacher_id, Shift.date, Shift.time_slot_id]):
+        removed += Shift.query.filter(Shift.id.in_(ids[1:])).delete(
+            synchronize_session=False)
+    print(f"重複したシフトを{removed}件削除しました。")
+
+    # Assignment: レッスンを残す方のコマに移してから削除する
+    removed = 0
+    for ids in _duplicate_groups(Assignment, [
+            Assignment.teacher_id, Assignment.date, Assignment.time_slot_id
+    ]):
+        Lesson.query.filter(Lesson.assignment_id.in_(ids[1:])).update(
+            {Lesson.assignment_id: ids[0]}, synchronize_session=False)
+        removed += Assignment.query.filter(
+            Assignment.id.in_(ids[1:])).delete(synchronize_session=False)
+        lesson_count = Lesson.query.filter_by(assignment_id=ids[0]).count()
+        if lesson_count > 2:
+            print(f"  ⚠ Assignment {ids[0]} のレッスンが{lesson_count}件になりました。"
+                  "プランナーで確認してください。")
+    print(f"重複したコマ (Assignment) を{removed}件統合しました。")
+
+    # リクエスト: レッスン数を合計し、レッスンの紐付けを残す方に付け替える
+    removed = 0
+    for ids in _duplicate_groups(StudentRequest, [
+            StudentRequest.planning_period_id, StudentRequest.student_id,
+            StudentRequest.subject_id
+    ]):
+        total = db.session.query(func.sum(
+            StudentRequest.requested_lessons)).filter(
+                StudentRequest.id.in_(ids)).scalar()
+        StudentRequest.query.filter_by(id=ids[0]).update(
+            {StudentRequest.requested_lessons: total},
+            synchronize_session=False)
+        Lesson.query.filter(Lesson.request_id.in_(ids[1:])).update(
+            {Lesson.request_id: ids[0]}, synchronize_session=False)
+        removed += StudentRequest.query.filter(
+            StudentRequest.id.in_(ids[1:])).delete(synchronize_session=False)
+    print(f"重複したリクエストを{removed}件統合しました。")
+
+
+def create_indexes():
+    """models.py の __table_args__ で定義したインデックスのうち、未作成のものを作る"""
+    created = []
+    for model in (Shift, StudentRequest, Assignment, Lesson):
+        for index in model.__table__.indexes:
+            if index.name not in _existing_indexes(model.__tablename__):
+                index.create(db.session.connection())
+                created.append(index.name)
+    print(f"インデックスを{len(created)}件作成しました: {', '.join(created) or 'なし'}")
+
+
+def _existing_indexes(table_name):
+    return {
+        index['name']
+        for index in db.inspect(db.session.connection()).get_indexes(
+            table_name)
+    }
+
+
+def _sample_period():
+    """実行計画の確認に使う計画期間 (DB に無ければ仮の期間)"""
+    period = PlanningPeriod.query.order_by(PlanningPeriod.id).first()
+    if period is None:
+        period = SimpleNamespace(id=1,
+                                 start_date=date(2025, 7, 1),
+                                 end_date=date(2025, 8, 31))
+    return period
+
+
+def hot_queries(period):
+    """スケジューラ・プランナーが頻繁に実行するクエリと、使うべきインデックス
+
+    クエリは scheduler.py / planner_data.py / shifts.py が実際に使う関数から作る。
+    """
+    start, end = period.start_date, period.end_date
+    return [
+        ('期間内の出勤可能なコマ (スケジューラ)',
+         scheduler.period_shifts_query(start, end), ['ix_shift_date_slot']),
+        ('期間内のコマとレッスン (スケジューラ)',
+         scheduler.period_lessons_query(start, end),
+         ['ix_assignment_date_slot', 'ix_lesson_assignment']),
+        ('生徒・科目の期間前の最後のレッスン日 (スケジューラ)',
+         scheduler.outside_lesson_dates_query(func.max,
+                                              Assignment.date < start),
+         ['ix_lesson_student_subject']),
+        ('期間内のコマとレッスン (プランナー)',
+         planner_data.assignments_query(period),
+         ['ix_assignment_date_slot', 'ix_lesson_assignment']),
+        ('期間内のシフト (プランナー)', planner_data.shifts_query(period),
+         ['ix_shift_date_slot']),
+        ('生徒・科目ごとの配置数 (プランナー)',
+         planner_data.placed_counts_query(period),
+         ['ix_assignment_date_slot', 'ix_lesson_assignment']),
+        ('講師の期間内のシフト (シフト保存)',
+         shifts.period_shifts_query(period, [1]),
+         ['uq_shift_teacher_date_slot']),
+    ]
+
+
+def check_query_plans():
+    """EXPLAIN QUERY PLAN で各クエリがインデックスを使っているか確認する。全て使っていれば True"""
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        explain = 'EXPLAIN QUERY PLAN '
+    else:
+        # PostgreSQL は小さなテーブルでは全件走査を選ぶので、インデックスが
+        # 使える形のクエリかどうかだけを確認する (このトランザクション内のみ)
+        explain = 'EXPLAIN '
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    all_ok = True
+    for name, query, expected in hot_queries(_sample_period()):
+        sql = str(
+            query.statement.compile(dialect=connection.dialect,
+                                    compile_kwargs={'literal_binds': True}))
+        plan = [row[-1] for row in connection.exec_driver_sql(explain + sql)]
+        missing = [
+            index for index in expected
+            if not any(index in detail for detail in plan)
+        ]
+        all_ok = all_ok and not missing
+        print(f"{'✅' if not missing else '❌'} {name}")
+        for detail in plan:
+            print(f"    {detail}")
+        if missing:
+            print(f"    使われていないインデックス: {', '.join(missing)}")
+    return all_ok
+
+
+def migrate():
+    app = create_app()
+    with app.app_context():
+        try:
+            dedupe()
+            create_indexes()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        # 重複の整理で変わったデータのキャッシュを、起動中のサーバーでも無効にする
+        revisions.bump_all()
+        # ANALYZE の統計があると、データベースがインデックスを選びやすくなる
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+        print("\n実行計画を確認します...")
+        return check_query_plans()
+
+
+def check():
+    app = create_app()
+    with app.app_context():
+        return check_query_plans()
+
+
+if __name__ == '__main__':
+    ok = check() if '--check' in sys.argv[1:] else migrate()
+    sys.exit(0 if ok else 1)
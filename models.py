@@ -98,6 +98,16 @@ class TimeSlot(db.Model):
 
 class Shift(db.Model):
     __tablename__ = 'shift'
+    __table_args__ = (
+        # 1人の講師の同じコマにシフトは1件だけ (講師・期間での絞り込みにも使う)
+        db.Index('uq_shift_teacher_date_slot',
+                 'teacher_id',
+                 'date',
+                 'time_slot_id',
+                 unique=True),
+        # 期間内の全講師のシフト取得用
+        db.Index('ix_shift_date_slot', 'date', 'time_slot_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False)
     is_available = db.Column(db.Boolean, nullable=False)
@@ -112,6 +122,14 @@ class Shift(db.Model):
 # --- 2. StudentRequest モデルを修正 ---
 class StudentRequest(db.Model):
     __tablename__ = 'student_request'
+    __table_args__ = (
+        # 1つの期間で生徒・科目ごとのリクエストは1件だけ
+        db.Index('uq_student_request_period_student_subject',
+                 'planning_period_id',
+                 'student_id',
+                 'subject_id',
+                 unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     priority = db.Column(db.String(10), nullable=False)
     requested_lessons = db.Column(db.Integer, default=1, nullable=False)
@@ -132,6 +150,16 @@ class StudentRequest(db.Model):
 # --- 3. Assignment モデルを修正 ---
 class Assignment(db.Model):
     __tablename__ = 'assignment'
+    __table_args__ = (
+        # 1人の講師の同じコマに Assignment は1件だけ
+        db.Index('uq_assignment_teacher_date_slot',
+                 'teacher_id',
+                 'date',
+                 'time_slot_id',
+                 unique=True),
+        # 期間 (日付の範囲) での取得用
+        db.Index('ix_assignment_date_slot', 'date', 'time_slot_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, nullable=False)
     time_slot_id = db.Column(db.Integer,
@@ -148,6 +176,11 @@ class Assignment(db.Model):
 
 class Lesson(db.Model):
     __tablename__ = 'lesson'
+    __table_args__ = (
+        db.Index('ix_lesson_assignment', 'assignment_id'),
+        # 生徒・科目ごとの配置数の集計用
+        db.Index('ix_lesson_student_subject', 'student_id', 'subject_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer,
                            db.ForeignKey('student.id'),
@@ -169,3 +202,13 @@ class Lesson(db.Model):
     status = db.Column(db.String(20), default='auto',
                        nullable=False)  # 'auto' vs 'locked'
     memo = db.Column(db.Text, nullable=True)
+
+
+class DataVersion(db.Model):
+    """キャッシュ・ETag の無効化に使うデータのバージョン (revisions.py が更新する)
+
+    複数のワーカープロセスやスクリプトから同じ値が見えるよう、DB に保存する。
+    """
+    __tablename__ = 'data_version'
+    key = db.Column(db.String(100), primary_key=True)  # 例: 'master', 'period:1'
+    token = db.Column(db.String(32), nullable=False)
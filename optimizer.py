@@ -0,0 +1,195 @@
+# optimizer.py (CP-SAT による一括最適配置)
+
+import os
+import threading
+
+try:
+    from ortools.sat.python import cp_model
+except ImportError:  # OR-Tools が無い環境では貪欲法にフォールバックする
+    cp_model = None
+
+from availability import iter_bits
+from scoring import INTERVAL_PENALTIES, REJECT_SCORE
+
+# 配置できたレッスン1コマあたりの基礎点 (ソフト制約の点数より十分大きくする)
+PRIORITY_WEIGHTS = {'HIGH': 30000, 'MEDIUM': 20000, 'LOW': 10000}
+
+# 探索スレッド数の下限 (CP-SAT は複数の探索戦略を並行して試すので、CPU が少なくても一定数使う)
+MIN_WORKERS = 8
+
+
+def is_available():
+    return cp_model is not None
+
+
+def solve_cpsat(generator, lessons_to_create, time_limit=30, num_workers=None):
+    """期間全体を1つのモデルとして解き、(lesson_data, slot_info) のリストを返す
+
+    解が得られなかった場合は None を返す (呼び出し側で貪欲法に切り替える)。
+    num_workers は探索スレッド数 (未指定なら CPU 数、どちらも MIN_WORKERS 以上にする)。
+    貪欲法の配置を全変数のヒント (そのまま実行可能な解) として与えるので、
+    最適解まで届かなくても貪欲法以上の解がすぐに得られる。
+    制約:
+      - 講師コマ (teacher, date, time_slot) ごとの定員 2
+      - 生徒は同じ日時に1コマまで
+      - 高校科目は担当講師のみ
+    目的関数:
+      - 優先度ごとの基礎点 + スカラー版と同じスロットスコア
+      - 科目間隔ルールは「N日間の窓に2コマ以上入った分」へのペナルティで近似
+    """
+    if cp_model is None:
+        return None
+
+    # 同じリクエストのレッスンはまとめて1つの変数群で扱う
+    groups = {}
+    for lesson_data in lessons_to_create:
+        groups.setdefault(lesson_data['request_id'], []).append(lesson_data)
+
+    hint = _greedy_hint(generator, lessons_to_create)
+    availability = generator.availability
+
+    model = cp_model.CpModel()
+    objective = []
+    x = {}
+    by_shift = {}
+    by_student_cell = {}
+
+    for request_id, items in groups.items():
+        first = items[0]
+        lesson = generator._new_lesson(first)
+        base = PRIORITY_WEIGHTS.get(first['priority'], 0)
+        request_vars = []
+        # 講師・生徒がともに空いているセルだけに変数を作る (日付・時限・講師の順)
+        cells = sorted(
+            (cell, teacher_id) for teacher_id, bits in availability.feasible(
+                first['student_id'], first['subject_id']).items()
+            for cell in iter_bits(bits))
+        for cell, teacher_id in cells:
+            date, time_slot_id = availability.cell_key(cell)
+            key = (teacher_id, date, time_slot_id)
+            score = generator._calculate_slot_score(lesson, teacher_id, date)
+            # 貪欲法と同様、スコアが -1 以下の候補は使わない
+            if score <= REJECT_SCORE:
+                continue
+            var = model.NewBoolVar(f"x_{request_id}_{len(x)}")
+            x[(request_id, key)] = var
+            hinted = (request_id, key) in hint
+            model.AddHint(var, hinted)
+            request_vars.append((date, var, hinted))
+            objective.append((base + score) * var)
+            by_shift.setdefault(key, []).append(var)
+            by_student_cell.setdefault(
+                (first['student_id'], date, time_slot_id), []).append(var)
+
+        if not request_vars:
+            continue
+        model.Add(sum(v for _, v, _ in request_vars) <= len(items))
+
+        if generator.subject_interval_rule_active and len(items) > 1:
+            _add_interval_windows(model, generator, request_vars, len(items),
+                                  objective)
+
+    for key, variables in by_shift.items():
+        capacity = 2 - generator.assignment_fill.get(key, 0)
+        model.Add(sum(variables) <= capacity)
+
+    for variables in by_student_cell.values():
+        if len(variables) > 1:
+            model.AddAtMostOne(variables)
+
+    model.Maximize(sum(objective))
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = float(time_limit)
+    solver.parameters.num_workers = max(
+        int(num_workers or os.cpu_count() or 1), MIN_WORKERS)
+    # 変数は配置できるセルだけに絞ってあり、前処理ではほとんど小さくならない。
+    # CPU の少ない環境では前処理だけで制限時間を使い切るので行わない
+    solver.parameters.cp_model_presolve = False
+    # 求解中もジョブのキャンセル要求を監視し、要求があれば探索を打ち切る
+    solved = threading.Event()
+    watcher = threading.Thread(target=_watch_cancel,
+                               args=(generator, solver, solved),
+                               daemon=True)
+    watcher.start()
+    try:
+        status = solver.Solve(model)
+    finally:
+        solved.set()
+    print(f"★ CP-SAT: {solver.StatusName(status)} "
+          f"(変数 {len(x)} 個, {solver.WallTime():.1f} 秒)")
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+
+    placements = []
+    for (request_id, key), var in x.items():
+        if solver.Value(var):
+            lesson_data = groups[request_id].pop()
+            teacher_id, date, time_slot_id = key
+            placements.append((lesson_data, {
+                "teacher_id": teacher_id,
+                "date": date,
+                "time_slot_id": time_slot_id
+            }))
+    return placements
+
+
+def _greedy_hint(generator, lessons_to_create):
+    """貪欲法で配置した (request_id, key) の集合を返す (メモリ上の配置は元に戻す)"""
+    generator._place_greedily(generator._sort_lessons(lessons_to_create))
+    hint = {(lesson.request_id, key)
+            for lesson, key in generator.placements.items()}
+    for lesson in list(generator.placements):
+        generator._release_lesson(lesson)
+    return hint
+
+
+def _watch_cancel(generator, solver, solved):
+    while not solved.wait(0.5):
+        if generator.cancel_requested():
+            solver.StopSearch()
+            return
+
+
+def _add_interval_windows(model, generator, request_vars, max_count,
+                          objective):
+    days = generator.subject_interval_days
+    penalty = INTERVAL_PENALTIES.get(generator.interval_strength, 0)
+    start = generator.start_date
+    by_offset = {}
+    for date, var, hinted in request_vars:
+        by_offset.setdefault((date - start).days, []).append((var, hinted))
+
+    # 日ごとのコマ数を1つの変数にまとめ、窓の制約は日数分の項だけで書く
+    # (窓ごとに全候補の変数を並べると、項の数が窓の日数倍になり前処理が遅くなる)
+    # offset -> (その日のコマ数, ヒントでのコマ数, 候補の変数の数)
+    day_counts = {}
+    for offset, items in by_offset.items():
+        count = sum(hinted for _, hinted in items)
+        if len(items) == 1:
+            day_counts[offset] = (items[0][0], count, 1)
+            continue
+        day_var = model.NewIntVar(0, min(len(items), max_count), '')
+        model.Add(day_var == sum(var for var, _ in items))
+        model.AddHint(day_var, count)
+        day_counts[offset] = (day_var, count, len(items))
+
+    last_offset = max(by_offset)
+    for window_start in range(0, last_offset + 1):
+        window = [
+            day_counts[offset]
+            for offset in range(window_start, window_start + days)
+            if offset in day_counts
+        ]
+        if sum(size for _, _, size in window) < 2:
+            continue
+        window_vars = [var for var, _, _ in window]
+        if generator.interval_strength == 'strong':
+            model.Add(sum(window_vars) <= 1)
+        else:
+            excess = model.NewIntVar(0, max_count, '')
+            model.Add(sum(window_vars) <= 1 + excess)
+            objective.append(-penalty * excess)
+            # ヒントが全変数にそろっていると、CP-SAT は最初にそのまま解として使える
+            model.AddHint(excess,
+                          max(sum(count for _, count, _ in window) - 1, 0))
@@ -0,0 +1,267 @@
+# planner_data.py (プランナー画面に渡すデータの組み立て)
+
+from sqlalchemy import func
+
+from extensions import db
+from models import Shift, Assignment, Subject, Student, Lesson, StudentRequest
+
+
+def slot_key(date, time_slot_id):
+    return f"{date.strftime('%Y-%m-%d')}-{time_slot_id}"
+
+
+def shift_key(date, teacher_id, time_slot_id):
+    return f"{date.strftime('%Y-%m-%d')}-{teacher_id}-{time_slot_id}"
+
+
+def assignments_query(period):
+    """期間内の Assignment をレッスン・生徒・科目・講師とまとめて読むクエリ"""
+    return Assignment.query.options(
+        db.joinedload(Assignment.lessons).joinedload(Lesson.student),
+        db.joinedload(Assignment.lessons).joinedload(Lesson.subject),
+        db.joinedload(Assignment.teacher)).filter(
+            Assignment.date.between(period.start_date, period.end_date))
+
+
+def build_assignments(period, slots=None):
+    """コマ (日付-時限) ごとの Assignment とレッスンを返す
+
+    slots に (date, time_slot_id) の集合を渡すと、そのコマだけを返す。
+    該当する Assignment が無くなったコマは空のリストになる。
+    """
+    query = assignments_query(period)
+    assignments_data = {}
+    if slots is not None:
+        slots = {(date, time_slot_id)
+                 for date, time_slot_id in slots
+                 if period.start_date <= date <= period.end_date}
+        if not slots:
+            return assignments_data
+        query = query.filter(
+            Assignment.date.in_({date
+                                 for date, _ in slots}))
+        for date, time_slot_id in slots:
+            assignments_data[slot_key(date, time_slot_id)] = []
+
+    for assign in query.all():
+        if slots is not None and (assign.date,
+                                  assign.time_slot_id) not in slots:
+            continue
+        key = slot_key(assign.date, assign.time_slot_id)
+        if key not in assignments_data:
+            assignments_data[key] = []
+
+        lessons_list = []
+        for lesson in assign.lessons:
+            lessons_list.append({
+                "id": lesson.id,
+                "status": lesson.status,
+                "student_id": lesson.student_id,
+                "student_name": lesson.student.display_name,
+                "subject_id": lesson.subject_id,
+                "subject_name": lesson.subject.name
+            })
+
+        assignments_data[key].append({
+            "teacher_id": assign.teacher_id,
+            "teacher_name": assign.teacher.display_name,
+            "lessons": lessons_list
+        })
+    return assignments_data
+
+
+def shifts_query(period):
+    """期間内の出勤可能なシフト (date, teacher_id, time_slot_id) を読むクエリ"""
+    return db.session.query(Shift.date, Shift.teacher_id,
+                            Shift.time_slot_id).filter(
+                                Shift.is_available,
+                                Shift.date.between(period.start_date,
+                                                   period.end_date))
+
+
+def build_shifts(period, cells=None):
+    """講師のシフトを {日付-講師-時限: True} で返す
+
+    cells に (teacher_id, date, time_slot_id) の集合を渡すと、そのセルだけを
+    返す (シフトが無くなったセルは False)。
+    """
+    query = shifts_query(period)
+    if cells is None:
+        return {
+            shift_key(date, teacher_id, time_slot_id): True
+            for date, teacher_id, time_slot_id in query.all()
+        }
+
+    cells = {(teacher_id, date, time_slot_id)
+             for teacher_id, date, time_slot_id in cells
+             if period.start_date <= date <= period.end_date}
+    if not cells:
+        return {}
+    shifts_map = {
+        shift_key(date, teacher_id, time_slot_id): False
+        for teacher_id, date, time_slot_id in cells
+    }
+    for date, teacher_id, time_slot_id in query.filter(
+            Shift.teacher_id.in_({cell[0]
+                                  for cell in cells})).all():
+        if (teacher_id, date, time_slot_id) in cells:
+            shifts_map[shift_key(date, teacher_id, time_slot_id)] = True
+    return shifts_map
+
+
+def placed_counts_query(period):
+    """期間内に配置済みのレッスン数を生徒・科目ごとに数えるクエリ"""
+    return db.session.query(
+        Lesson.student_id, Lesson.subject_id,
+        func.count(Lesson.id)).join(Assignment).filter(
+            Assignment.date.between(period.start_date,
+                                    period.end_date)).group_by(
+                                        Lesson.student_id, Lesson.subject_id)
+
+
+def build_unassigned(period, groups=None):
+    """生徒・科目ごとの未配置レッスン数を返す
+
+    groups を指定しない場合は未配置が残っているものだけを返す。
+    (student_id, subject_id) の集合を渡すと、その組だけを残数 0 以下も含めて返す。
+    """
+    requests = db.session.query(
+        StudentRequest.student_id, StudentRequest.subject_id,
+        StudentRequest.requested_lessons, Student.name, Student.grade,
+        Subject.name).outerjoin(
+            Student, Student.id == StudentRequest.student_id).outerjoin(
+                Subject, Subject.id == StudentRequest.subject_id).filter(
+                    StudentRequest.planning_period_id == period.id).order_by(
+                        StudentRequest.id).all()
+
+    unassigned_map = {}
+    for (student_id, subject_id, requested_lessons, student_name,
+         student_grade, subject_name) in requests:
+        if groups is not None and (student_id, subject_id) not in groups:
+            continue
+        key = f"{student_id}-{subject_id}"
+        if key not in unassigned_map:
+            unassigned_map[key] = {
+                "count": 0,
+                "student_id": student_id,
+                "subject_id": subject_id,
+                "student_name": student_name or "不明",
+                "student_grade": student_grade or "不明",
+                "subject_name": subject_name or "不明"
+            }
+        unassigned_map[key]["count"] += requested_lessons
+
+    placed_counts = placed_counts_query(period).all()
+    for student_id, subject_id, count in placed_counts:
+        key = f"{student_id}-{subject_id}"
+        if key in unassigned_map:
+            unassigned_map[key]["count"] -= count
+
+    if groups is None:
+        return [v for v in unassigned_map.values() if v['count'] > 0]
+
+    # リクエストが無くなった組も、クライアント側で消せるように残数 0 で返す
+    for student_id, subject_id in groups:
+        key = f"{student_id}-{subject_id}"
+        if key not in unassigned_map:
+            unassigned_map[key] = {
+                "count": 0,
+                "student_id": student_id,
+                "subject_id": subject_id
+            }
+    return list(unassigned_map.values())
+
+
+def build_compact(period, teacher_ids):
+    """プランナーのデータを列指向のコンパクト形式で返す
+
+    生徒・科目・講師・レッスン状態は一度だけ送り、コマ・レッスン・シフトは
+    それらへの添字を並べた整数の配列にする。日付は period.start_date からの日数。
+    """
+    start = period.start_date.toordinal()
+    teacher_index = {t_id: i for i, t_id in enumerate(teacher_ids)}
+
+    students = db.session.query(Student.id, Student.name,
+                                Student.display_name,
+                                Student.grade).order_by(Student.id).all()
+    student_index = {row.id: i for i, row in enumerate(students)}
+    subjects = db.session.query(Subject.id,
+                                Subject.name).order_by(Subject.id).all()
+    subject_index = {row.id: i for i, row in enumerate(subjects)}
+    statuses = ['auto', 'locked']
+    status_index = {status: i for i, status in enumerate(statuses)}
+
+    assignments = {'day': [], 'slot': [], 'teacher': []}
+    lessons = {
+        'id': [],
+        'assignment': [],
+        'student': [],
+        'subject': [],
+        'status': []
+    }
+    assignment_positions = {}
+    rows = db.session.query(
+        Assignment.id, Assignment.date, Assignment.time_slot_id,
+        Assignment.teacher_id, Lesson.id, Lesson.student_id,
+        Lesson.subject_id, Lesson.status).outerjoin(
+            Lesson, Lesson.assignment_id == Assignment.id).filter(
+                Assignment.date.between(period.start_date,
+                                        period.end_date)).order_by(
+                                            Assignment.id, Lesson.id).all()
+    for (assignment_id, date, time_slot_id, teacher_id, lesson_id,
+         student_id, subject_id, status) in rows:
+        position = assignment_positions.get(assignment_id)
+        if position is None:
+            position = len(assignments['day'])
+            assignment_positions[assignment_id] = position
+            assignments['day'].append(date.toordinal() - start)
+            assignments['slot'].append(time_slot_id)
+            assignments['teacher'].append(teacher_index.get(teacher_id, -1))
+        if lesson_id is None:
+            continue
+        if status not in status_index:
+            status_index[status] = len(statuses)
+            statuses.append(status)
+        lessons['id'].append(lesson_id)
+        lessons['assignment'].append(position)
+        lessons['student'].append(student_index.get(student_id, -1))
+        lessons['subject'].append(subject_index.get(subject_id, -1))
+        lessons['status'].append(status_index[status])
+
+    shifts = {'day': [], 'slot': [], 'teacher': []}
+    for date, teacher_id, time_slot_id in db.session.query(
+            Shift.date, Shift.teacher_id, Shift.time_slot_id).filter(
+                Shift.is_available,
+                Shift.date.between(period.start_date,
+                                   period.end_date)).order_by(
+                                       Shift.date, Shift.time_slot_id,
+                                       Shift.teacher_id).all():
+        shifts['day'].append(date.toordinal() - start)
+        shifts['slot'].append(time_slot_id)
+        shifts['teacher'].append(teacher_index.get(teacher_id, -1))
+
+    unassigned = {'student': [], 'subject': [], 'count': []}
+    for entry in build_unassigned(period):
+        unassigned['student'].append(
+            student_index.get(entry['student_id'], -1))
+        unassigned['subject'].append(
+            subject_index.get(entry['subject_id'], -1))
+        unassigned['count'].append(entry['count'])
+
+    return {
+        'students': {
+            'id': [row.id for row in students],
+            'name': [row.name for row in students],
+            'display_name': [row.display_name for row in students],
+            'grade': [row.grade for row in students]
+        },
+        'subjects': {
+            'id': [row.id for row in subjects],
+            'name': [row.name for row in subjects]
+        },
+        'statuses': statuses,
+        'assignments': assignments,
+        'lessons': lessons,
+        'shifts': shifts,
+        'unassigned': unassigned
+    }
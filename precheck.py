@@ -0,0 +1,337 @@
+# precheck.py (自動配置前の需要・供給の事前チェック)
+#
+# 自動配置 (全体を再配置) を実行する前に、リクエストのコマ数 (需要) が提出済みのシフト
+# (供給: 出勤コマ x 定員2) に収まるかを調べる。ロック済みのレッスンは枠を使ったまま残し、
+# 'auto' のレッスンは再配置される前提で空きとして扱う。
+#
+# 配置できるレッスン数の上限は次の二部グラフの最大流で求める:
+#   始点 → 生徒 (生徒が空いていて、担当できる講師が出勤しているコマ数)
+#        → リクエスト (生徒, 科目) (残りのコマ数)
+#        → 担当できる講師 (生徒と講師がともに空いているコマ数)
+#        → 終点 (講師の空き席数)
+# 実際の配置はこの流量を超えないので、流量が需要に届かなければ全部は配置できない
+# (届いても配置できるとは限らない)。科目・生徒ごとの内訳は最大流の1つの例である。
+# OR-Tools があれば最大流を C++ の実装で解き、無ければ Python の Dinic 法で解く。
+
+import time
+from datetime import timedelta
+
+from sqlalchemy import func
+
+from availability import CAPACITY, AvailabilityModel, iter_bits
+from extensions import db
+from models import Assignment, Lesson, Student, StudentRequest, Subject
+
+try:
+    from ortools.graph.python import max_flow as ortools_max_flow
+except ImportError:  # OR-Tools が無い環境では Python の実装で解く
+    ortools_max_flow = None
+
+# 結果に含めるボトルネックの生徒数の上限
+MAX_STUDENTS = 50
+
+
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count
+else:  # Python 3.9 以前
+
+    def _popcount(bits):
+        return bin(bits).count('1')
+
+
+def solve_max_flow(node_count, tails, heads, capacities, source, sink):
+    """辺の配列で与えたグラフの最大流を解き、(流量, 辺ごとの流量のリスト) を返す"""
+    if ortools_max_flow is not None:
+        solver = ortools_max_flow.SimpleMaxFlow()
+        arcs = solver.add_arcs_with_capacity(tails, heads, capacities)
+        if solver.solve(source, sink) != solver.OPTIMAL:
+            raise RuntimeError('最大流を解けませんでした')
+        return solver.optimal_flow(), solver.flows(arcs).tolist()
+
+    graph = MaxFlow(node_count)
+    for tail, head, capacity in zip(tails, heads, capacities):
+        graph.add_edge(tail, head, capacity)
+    total = graph.max_flow(source, sink)
+    return total, [
+        graph.capacity[index * 2 + 1] for index in range(len(tails))
+    ]
+
+
+class MaxFlow:
+    """Dinic 法の最大流 (辺は配列で持ち、i ^ 1 が逆辺)"""
+
+    def __init__(self, node_count):
+        self.edges = [[] for _ in range(node_count)]
+        self.to = []
+        self.capacity = []
+
+    def add_edge(self, source, target, capacity):
+        index = len(self.to)
+        self.to += [target, source]
+        self.capacity += [capacity, 0]
+        self.edges[source].append(index)
+        self.edges[target].append(index + 1)
+
+    def _levels(self, source):
+        level = [-1] * len(self.edges)
+        level[source] = 0
+        queue = [source]
+        for node in queue:
+            for index in self.edges[node]:
+                target = self.to[index]
+                if self.capacity[index] > 0 and level[target] < 0:
+                    level[target] = level[node] + 1
+                    queue.append(target)
+        return level
+
+    def _augment(self, source, sink, level, next_edge):
+        """レベルグラフ上で増加路を1本見つけて流し、流した量を返す (無ければ 0)"""
+        path = []
+        node = source
+        while node != sink:
+            edges = self.edges[node]
+            while next_edge[node] < len(edges):
+                index = edges[next_edge[node]]
+                if (self.capacity[index] > 0
+                        and level[self.to[index]] == level[node] + 1):
+                    break
+                next_edge[node] += 1
+            else:
+                # 行き止まり: 1つ戻って次の辺を試す
+                if node == source:
+                    return 0
+                index = path.pop()
+                node = self.to[index ^ 1]
+                next_edge[node] += 1
+                continue
+            path.append(index)
+            node = self.to[index]
+
+        pushed = min(self.capacity[index] for index in path)
+        for index in path:
+            self.capacity[index] -= pushed
+            self.capacity[index ^ 1] += pushed
+        return pushed
+
+    def max_flow(self, source, sink):
+        total = 0
+        while True:
+            level = self._levels(source)
+            if level[sink] < 0:
+                return total
+            next_edge = [0] * len(self.edges)
+            while True:
+                pushed = self._augment(source, sink, level, next_edge)
+                if not pushed:
+                    break
+                total += pushed
+
+
+def run_precheck(period):
+    """期間の需要・供給と、配置できるレッスン数の上限・ボトルネックを返す"""
+    started = time.perf_counter()
+    model = AvailabilityModel.load(period, statuses=('locked', ))
+
+    requests = db.session.query(StudentRequest.student_id,
+                                StudentRequest.subject_id,
+                                StudentRequest.requested_lessons).filter(
+                                    StudentRequest.planning_period_id ==
+                                    period.id,
+                                    StudentRequest.requested_lessons > 0).all()
+    locked_counts = {
+        (student_id, subject_id): count
+        for student_id, subject_id, count in db.session.query(
+            Lesson.student_id, Lesson.subject_id, func.count(Lesson.id)).join(
+                Assignment, Lesson.assignment_id == Assignment.id).filter(
+                    Lesson.status == 'locked',
+                    Assignment.date.between(period.start_date,
+                                            period.end_date)).group_by(
+                                                Lesson.student_id,
+                                                Lesson.subject_id)
+    }
+    groups = {}
+    requested_total = 0
+    for student_id, subject_id, requested in requests:
+        requested_total += requested
+        remaining = requested - locked_counts.get((student_id, subject_id), 0)
+        if remaining > 0:
+            groups[(student_id, subject_id)] = remaining
+
+    # 講師ごとの空きコマと空き席数 (出勤コマ x 定員 - ロック済みのレッスン数)
+    teacher_free = {t_id: model.teacher_free(t_id) for t_id in model.shifts}
+    seats = {}
+    seats_by_date = {}
+    for teacher_id, free_cells in teacher_free.items():
+        total = 0
+        for cell in iter_bits(free_cells):
+            free = CAPACITY - model.fill.get((teacher_id, cell), 0)
+            total += free
+            cell_date = model.cell_key(cell)[0]
+            seats_by_date[cell_date] = seats_by_date.get(cell_date, 0) + free
+        seats[teacher_id] = total
+
+    # 科目ごとに、担当できる講師の空きコマの和集合
+    subject_cells = {}
+    for _, subject_id in groups:
+        if subject_id not in subject_cells:
+            cells = 0
+            for teacher_id in model.qualified_teachers(subject_id):
+                cells |= teacher_free[teacher_id]
+            subject_cells[subject_id] = cells
+
+    # 担当できる講師が同じ (高校科目以外、または同じ高校科目) 生徒のリクエストは
+    # 1つのノードにまとめる。講師との重なりのコマ数は生徒と講師だけで決まるので、
+    # まとめても上限は緩くならない (辺の数が減り、むしろ締まる)
+    bundles = {}
+    for group in sorted(groups):
+        student_id, subject_id = group
+        key = subject_id if model.subject_levels.get(
+            subject_id) == '高校' else None
+        bundles.setdefault((student_id, key), []).append(group)
+
+    # --- グラフを作る (0: 始点, 1: 終点, 以降 講師・生徒・リクエスト) ---
+    teacher_node = {t_id: 2 + i for i, t_id in enumerate(seats)}
+    student_ids = sorted({student_id for student_id, _ in groups})
+    student_node = {
+        s_id: 2 + len(teacher_node) + i
+        for i, s_id in enumerate(student_ids)
+    }
+    node_count = 2 + len(teacher_node) + len(student_node) + len(bundles)
+    source, sink = 0, 1
+    tails, heads, capacities = [], [], []
+
+    for teacher_id, node in teacher_node.items():
+        tails.append(node)
+        heads.append(sink)
+        capacities.append(seats[teacher_id])
+
+    student_subjects = {}
+    for student_id, subject_id in groups:
+        student_subjects.setdefault(student_id, []).append(subject_id)
+    student_edges = {}
+    for student_id, subject_ids in student_subjects.items():
+        reachable = 0
+        for subject_id in subject_ids:
+            reachable |= subject_cells[subject_id]
+        student_edges[student_id] = len(tails)
+        tails.append(source)
+        heads.append(student_node[student_id])
+        capacities.append(
+            _popcount(reachable & model.student_free(student_id)))
+
+    bundle_edges = {}
+    has_teacher = set()
+    for node, ((student_id, _), bundle) in enumerate(
+            bundles.items(), start=node_count - len(bundles)):
+        demand = sum(groups[group] for group in bundle)
+        bundle_edges[bundle[0]] = len(tails)
+        tails.append(student_node[student_id])
+        heads.append(node)
+        capacities.append(demand)
+        student_free = model.student_free(student_id)
+        edge_count = len(tails)
+        for teacher_id in model.qualified_teachers(bundle[0][1]):
+            # 生徒と講師がともに空いているコマ数 (リクエスト数を超える分は流量に影響しない)
+            overlap = _popcount(teacher_free[teacher_id] & student_free)
+            if overlap:
+                tails.append(node)
+                heads.append(teacher_node[teacher_id])
+                capacities.append(overlap if overlap < demand else demand)
+        if len(tails) > edge_count:
+            has_teacher.add(bundle[0])
+
+    upper_bound, flows = solve_max_flow(node_count, tails, heads, capacities,
+                                        source, sink)
+
+    # --- 結果をまとめる (まとめたノードの流量は科目順にリクエストへ割り振る) ---
+    demand = sum(groups.values())
+    subject_rows = {}
+    shortages = []
+    for (student_id, _), bundle in bundles.items():
+        remaining = flows[bundle_edges[bundle[0]]]
+        for group in bundle:
+            subject_id = group[1]
+            placeable = min(remaining, groups[group])
+            remaining -= placeable
+            row = subject_rows.get(subject_id)
+            if row is None:
+                row = subject_rows[subject_id] = {
+                    'subject_id': subject_id,
+                    'demand': 0,
+                    'upper_bound': 0,
+                    'seats': sum(seats[t_id] for t_id in
+                                 model.qualified_teachers(subject_id))
+                }
+            row['demand'] += groups[group]
+            row['upper_bound'] += placeable
+            if placeable >= groups[group]:
+                continue
+            if bundle[0] not in has_teacher:
+                reason = 'no_slot'
+            elif (flows[student_edges[student_id]] ==
+                  capacities[student_edges[student_id]]):
+                reason = 'student_availability'
+            else:
+                reason = 'teacher_capacity'
+            shortages.append({
+                'student_id': student_id,
+                'subject_id': subject_id,
+                'demand': groups[group],
+                'upper_bound': placeable,
+                'shortfall': groups[group] - placeable,
+                'reason': reason
+            })
+
+    subject_info = {
+        s_id: (name, level)
+        for s_id, name, level in db.session.query(Subject.id, Subject.name,
+                                                  Subject.level)
+    }
+    subjects = []
+    for row in subject_rows.values():
+        name, level = subject_info.get(row['subject_id'], ('', ''))
+        row.update(name=name,
+                   level=level,
+                   shortfall=row['demand'] - row['upper_bound'])
+        subjects.append(row)
+    subjects.sort(key=lambda r: (-r['shortfall'], -r['demand'] /
+                                 (r['seats'] or 1)))
+
+    shortages.sort(key=lambda r: (-r['shortfall'], r['student_id'],
+                                  r['subject_id']))
+    shortages = shortages[:MAX_STUDENTS]
+    student_names = dict(
+        db.session.query(Student.id, Student.name).filter(
+            Student.id.in_({r['student_id'] for r in shortages})))
+    for row in shortages:
+        row['student_name'] = student_names.get(row['student_id'], '')
+        row['subject_name'] = subject_info.get(row['subject_id'], ('', ''))[0]
+
+    # 需要を出勤のある日に均等に割り振ったときに、席が足りない日
+    working_dates = [d for d, count in seats_by_date.items() if count > 0]
+    per_day = demand / len(working_dates) if working_dates else 0
+    dates = []
+    for offset in range(model.n_days):
+        cell_date = period.start_date + timedelta(days=offset)
+        day_seats = seats_by_date.get(cell_date, 0)
+        if day_seats and day_seats < per_day:
+            dates.append({
+                'date': cell_date.strftime('%Y-%m-%d'),
+                'seats': day_seats,
+                'average_demand': round(per_day, 1)
+            })
+    dates.sort(key=lambda r: r['seats'])
+
+    return {
+        'period_id': period.id,
+        'requested_lessons': requested_total,
+        'locked_lessons': sum(locked_counts.values()),
+        'demand': demand,
+        'seats': sum(seats.values()),
+        'upper_bound': upper_bound,
+        'shortfall': demand - upper_bound,
+        'subjects': subjects,
+        'students': shortages,
+        'dates': dates,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
@@ -0,0 +1,364 @@
+# problem.py (配置問題のコンパイル済みスナップショット)
+#
+# ScheduleGenerator が DB から読み込んだ計画期間の状態を、ORM オブジェクトを含まない
+# 変更不可の ScheduleProblem にまとめる。講師・生徒・科目・時限は ID の配列上の位置
+# (インデックス) で、コマ (日付, 時限) は 日 * 時限数 + 時限 のセル番号で表し、
+# 中身は array / bytes / frozenset だけで持つ。
+# そのままワーカープロセスへ渡せ、.npz (numpy が必要) または pickle で保存できる。
+#
+# 使い方 (計画期間1をファイルに書き出す):
+#   python problem.py --period 1 --output period1.npz
+
+import argparse
+import pickle
+from array import array
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:  # numpy が無い環境では pickle でのみ保存できる
+    np = None
+
+PRIORITIES = ('HIGH', 'MEDIUM', 'LOW')
+# 1コマに入れられるレッスン数
+CAPACITY = 2
+
+# to_arrays() で配列として書き出す項目と array の型コード
+ARRAY_FIELDS = {
+    'teacher_ids': 'q',
+    'student_ids': 'q',
+    'subject_ids': 'q',
+    'time_slot_ids': 'q',
+    'availability': 'B',
+    'fill': 'B',
+    'busy': 'q',
+    'date_groups': 'q',
+    'date_ordinals': 'q',
+    'lesson_students': 'l',
+    'lesson_subjects': 'l',
+    'lesson_request_ids': 'q',
+    'lesson_priorities': 'B',
+    'qualification_pairs': 'l',
+    'preferred_pairs': 'l',
+}
+SCALAR_FIELDS = ('period_id', 'start_ordinal', 'n_days')
+
+
+def is_available():
+    """.npz 形式で保存・読み込みできるか"""
+    return np is not None
+
+
+class ScheduleProblem:
+    """計画期間1つ分の配置問題 (変更不可)
+
+    availability と fill は 講師 * セル数 + セル の位置に、出勤可否 (0/1) と
+    既に入っているレッスン数を持つ。busy は 生徒 * セル数 + セル の昇順の配列、
+    date_groups / date_ordinals は 生徒 * 科目数 + 科目 と、その既存のレッスン日 (序数) の組を
+    昇順に並べたもの (科目間隔ルール用)。
+    lesson_* は配置するレッスンを1コマずつ並べた配列。
+    """
+
+    __slots__ = ('period_id', 'start_ordinal', 'n_days', 'teacher_ids',
+                 'student_ids', 'subject_ids', 'time_slot_ids',
+                 'subject_levels', 'qualifications', 'preferred_teachers',
+                 'availability', 'fill', 'busy', 'date_groups',
+                 'date_ordinals', 'lesson_students', 'lesson_subjects',
+                 'lesson_request_ids', 'lesson_priorities')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ScheduleProblem は変更できません')
+
+    def __reduce__(self):
+        return (ScheduleProblem.from_arrays, (self.to_arrays(), ))
+
+    # --- 大きさ・インデックス ---
+    @property
+    def n_slots(self):
+        return len(self.time_slot_ids)
+
+    @property
+    def n_cells(self):
+        return self.n_days * self.n_slots
+
+    @property
+    def start_date(self):
+        return date.fromordinal(self.start_ordinal)
+
+    @property
+    def end_date(self):
+        return date.fromordinal(self.start_ordinal + self.n_days - 1)
+
+    def cell_of(self, day, slot):
+        return day * self.n_slots + slot
+
+    def cell_key(self, cell):
+        """セル番号を (date, time_slot_id) に戻す"""
+        day, slot = divmod(cell, self.n_slots)
+        return (date.fromordinal(self.start_ordinal + day),
+                self.time_slot_ids[slot])
+
+    def is_teacher_available(self, teacher, cell):
+        return bool(self.availability[teacher * self.n_cells + cell])
+
+    # --- 作成 ---
+    @classmethod
+    def compile(cls, generator, lessons_to_create):
+        """ScheduleGenerator のメモリ上の状態と配置するレッスンから問題を作る"""
+        start = generator.start_date
+        n_days = (generator.end_date - start).days + 1
+
+        teacher_set = set(generator.teacher_subject_ids)
+        teacher_set.update(key[0] for key in generator.shift_keys)
+        teacher_set.update(key[0] for key in generator.assignment_fill)
+        student_set = set(generator.preferred_teacher_ids)
+        student_set.update(l_data['student_id'] for l_data in lessons_to_create)
+        student_set.update(key[2] for key in generator.student_busy)
+        student_set.update(key[0] for key in generator.db_lesson_dates)
+        subject_set = set(generator.subject_levels)
+        subject_set.update(l_data['subject_id'] for l_data in lessons_to_create)
+        subject_set.update(key[1] for key in generator.db_lesson_dates)
+        slot_set = {key[2] for key in generator.shift_keys}
+        slot_set.update(key[2] for key in generator.assignment_fill)
+        slot_set.update(key[1] for key in generator.student_busy)
+
+        teacher_ids = sorted(teacher_set)
+        student_ids = sorted(student_set)
+        subject_ids = sorted(subject_set)
+        time_slot_ids = sorted(slot_set)
+        teacher_index = {t_id: i for i, t_id in enumerate(teacher_ids)}
+        student_index = {s_id: i for i, s_id in enumerate(student_ids)}
+        subject_index = {s_id: i for i, s_id in enumerate(subject_ids)}
+        slot_index = {ts_id: i for i, ts_id in enumerate(time_slot_ids)}
+        n_cells = n_days * len(time_slot_ids)
+
+        def cell(lesson_date, time_slot_id):
+            return ((lesson_date - start).days * len(time_slot_ids) +
+                    slot_index[time_slot_id])
+
+        availability = bytearray(len(teacher_ids) * n_cells)
+        for teacher_id, lesson_date, time_slot_id in generator.shift_keys:
+            availability[teacher_index[teacher_id] * n_cells +
+                         cell(lesson_date, time_slot_id)] = 1
+        fill = bytearray(len(teacher_ids) * n_cells)
+        for (teacher_id, lesson_date,
+             time_slot_id), count in generator.assignment_fill.items():
+            if count:
+                fill[teacher_index[teacher_id] * n_cells +
+                     cell(lesson_date, time_slot_id)] = min(count, 255)
+        busy = sorted(student_index[student_id] * n_cells +
+                      cell(lesson_date, time_slot_id)
+                      for lesson_date, time_slot_id, student_id in
+                      generator.student_busy)
+        lesson_dates = sorted(
+            (student_index[student_id] * len(subject_ids) +
+             subject_index[subject_id], lesson_date.toordinal())
+            for (student_id, subject_id), dates in
+            generator.db_lesson_dates.items() for lesson_date in dates)
+
+        return cls(
+            period_id=generator.period_id,
+            start_ordinal=start.toordinal(),
+            n_days=n_days,
+            teacher_ids=array('q', teacher_ids),
+            student_ids=array('q', student_ids),
+            subject_ids=array('q', subject_ids),
+            time_slot_ids=array('q', time_slot_ids),
+            subject_levels=tuple(
+                generator.subject_levels.get(s_id) or ''
+                for s_id in subject_ids),
+            qualifications=tuple(
+                frozenset(subject_index[s_id] for s_id in
+                          generator.teacher_subject_ids.get(t_id, ()))
+                for t_id in teacher_ids),
+            preferred_teachers=tuple(
+                frozenset(teacher_index[t_id] for t_id in
+                          generator.preferred_teacher_ids.get(s_id, ())
+                          if t_id in teacher_index)
+                for s_id in student_ids),
+            availability=bytes(availability),
+            fill=bytes(fill),
+            busy=array('q', busy),
+            date_groups=array('q', [group for group, _ in lesson_dates]),
+            date_ordinals=array('q',
+                                [ordinal for _, ordinal in lesson_dates]),
+            lesson_students=array(
+                'l', [student_index[l['student_id']]
+                      for l in lessons_to_create]),
+            lesson_subjects=array(
+                'l', [subject_index[l['subject_id']]
+                      for l in lessons_to_create]),
+            lesson_request_ids=array(
+                'q', [l['request_id'] for l in lessons_to_create]),
+            lesson_priorities=array(
+                'B', [PRIORITIES.index(l['priority'])
+                      if l['priority'] in PRIORITIES else len(PRIORITIES)
+                      for l in lessons_to_create]))
+
+    # --- ScheduleGenerator が使う ID ベースの形に戻す ---
+    def shift_keys(self):
+        """出勤可能な (teacher_id, date, time_slot_id) を日付・時限順に返す"""
+        n_cells = self.n_cells
+        keys = []
+        for cell in range(n_cells):
+            lesson_date, time_slot_id = self.cell_key(cell)
+            for teacher, teacher_id in enumerate(self.teacher_ids):
+                if self.availability[teacher * n_cells + cell]:
+                    keys.append((teacher_id, lesson_date, time_slot_id))
+        return keys
+
+    def assignment_fill(self):
+        n_cells = self.n_cells
+        return {(self.teacher_ids[position // n_cells], ) +
+                self.cell_key(position % n_cells): count
+                for position, count in enumerate(self.fill) if count}
+
+    def student_busy(self):
+        n_cells = self.n_cells
+        return {self.cell_key(code % n_cells) +
+                (self.student_ids[code // n_cells], )
+                for code in self.busy}
+
+    def lesson_dates(self):
+        """(student_id, subject_id) -> 既存のレッスン日の昇順のリスト"""
+        n_subjects = len(self.subject_ids)
+        dates = {}
+        for group, ordinal in zip(self.date_groups, self.date_ordinals):
+            dates.setdefault((self.student_ids[group // n_subjects],
+                              self.subject_ids[group % n_subjects]),
+                             []).append(date.fromordinal(ordinal))
+        return dates
+
+    def teacher_subject_ids(self):
+        return {t_id: {self.subject_ids[s] for s in self.qualifications[t]}
+                for t, t_id in enumerate(self.teacher_ids)}
+
+    def preferred_teacher_ids(self):
+        return {s_id: {self.teacher_ids[t] for t in self.preferred_teachers[s]}
+                for s, s_id in enumerate(self.student_ids)}
+
+    def subject_level_map(self):
+        return dict(zip(self.subject_ids, self.subject_levels))
+
+    def lessons(self):
+        """配置するレッスンを _prepare_lessons_to_create と同じ dict のリストで返す"""
+        priorities = PRIORITIES + (None, )
+        return [{
+            'student_id': self.student_ids[student],
+            'subject_id': self.subject_ids[subject],
+            'request_id': request_id,
+            'priority': priorities[priority]
+        } for student, subject, request_id, priority in zip(
+            self.lesson_students, self.lesson_subjects,
+            self.lesson_request_ids, self.lesson_priorities)]
+
+    # --- 保存・読み込み ---
+    def to_arrays(self):
+        """集合や文字列も含め、すべてを数値の配列とスカラーに平らにする"""
+        arrays = {name: getattr(self, name) for name in SCALAR_FIELDS}
+        for name, typecode in ARRAY_FIELDS.items():
+            if name in self.__slots__:
+                value = getattr(self, name)
+                arrays[name] = (value if isinstance(value, array) else array(
+                    typecode, value))
+        arrays['qualification_pairs'] = array(
+            'l', [n for t, subjects in enumerate(self.qualifications)
+                  for s in sorted(subjects) for n in (t, s)])
+        arrays['preferred_pairs'] = array(
+            'l', [n for s, teachers in enumerate(self.preferred_teachers)
+                  for t in sorted(teachers) for n in (s, t)])
+        arrays['subject_levels'] = list(self.subject_levels)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        fields = {name: int(arrays[name]) for name in SCALAR_FIELDS}
+        for name, typecode in ARRAY_FIELDS.items():
+            values = arrays[name]
+            if np is not None and isinstance(values, np.ndarray):
+                values = values.tolist()
+            values = array(typecode, values)
+            fields[name] = values
+        fields['availability'] = fields['availability'].tobytes()
+        fields['fill'] = fields['fill'].tobytes()
+
+        qualifications = [set() for _ in fields['teacher_ids']]
+        pairs = fields.pop('qualification_pairs')
+        for t, s in zip(pairs[::2], pairs[1::2]):
+            qualifications[t].add(s)
+        preferred = [set() for _ in fields['student_ids']]
+        pairs = fields.pop('preferred_pairs')
+        for s, t in zip(pairs[::2], pairs[1::2]):
+            preferred[s].add(t)
+        fields['qualifications'] = tuple(map(frozenset, qualifications))
+        fields['preferred_teachers'] = tuple(map(frozenset, preferred))
+        fields['subject_levels'] = tuple(
+            str(level) for level in arrays['subject_levels'])
+        return cls(**fields)
+
+    def save(self, path):
+        """path の拡張子が .npz なら numpy の圧縮形式、それ以外は pickle で保存する"""
+        if str(path).endswith('.npz'):
+            if np is None:
+                raise RuntimeError('.npz で保存するには numpy が必要です')
+            np.savez_compressed(path, **{
+                name: np.asarray(value)
+                for name, value in self.to_arrays().items()
+            })
+        else:
+            with open(path, 'wb') as f:
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        if str(path).endswith('.npz'):
+            if np is None:
+                raise RuntimeError('.npz を読み込むには numpy が必要です')
+            with np.load(path, allow_pickle=False) as data:
+                return cls.from_arrays({name: data[name] for name in data.files})
+        with open(path, 'rb') as f:
+            problem = pickle.load(f)
+        if not isinstance(problem, cls):
+            raise ValueError(f"{path} は ScheduleProblem ではありません")
+        return problem
+
+
+def compile_period(period_id, options=None):
+    """計画期間を読み込んで問題を作る (アプリケーションコンテキスト内で呼ぶ)
+
+    options は ScheduleGenerator と同じ。'mode': 'incremental' なら差分モードで
+    解放されるレッスンだけを配置対象にする。
+    """
+    from scheduler import ScheduleGenerator
+    generator = ScheduleGenerator(period_id, dict(options or {}))
+    return generator.compile_problem()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='計画期間の配置問題をファイルに書き出す')
+    parser.add_argument('--period', type=int, required=True, help='計画期間のID')
+    parser.add_argument('--output',
+                        required=True,
+                        help='書き出すファイル (.npz または .pkl)')
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help='差分モードで解放されるレッスンだけを対象にする')
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        options = {'mode': 'incremental'} if args.incremental else {}
+        problem = compile_period(args.period, options)
+    problem.save(args.output)
+    print(f"✅ {args.output} に書き出しました: 講師 {len(problem.teacher_ids)}人, "
+          f"生徒 {len(problem.student_ids)}人, {problem.n_days}日 x "
+          f"{problem.n_slots}時限, レッスン {len(problem.lesson_students)}コマ")
+
+
+if __name__ == '__main__':
+    main()
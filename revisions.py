@@ -0,0 +1,226 @@
+# revisions.py (データ変更の記録)
+
+import collections
+import threading
+import uuid
+
+from sqlalchemy import update
+
+import bulk
+from extensions import db
+from models import DataVersion, PlanningPeriod
+
+# 保持する変更履歴の件数 (これより古い差分は「不明」として扱う)
+MAX_CHANGES = 10000
+
+_lock = threading.Lock()
+_revision = 0
+# (revision, kind, key) の履歴
+_changes = collections.deque(maxlen=MAX_CHANGES)
+# バージョンのキー -> {このプロセスが書いた token: 書いた時点の revision}
+# 他のプロセスに書き換えられずに続いている分だけを持つ (差分同期の起点に使う)
+_written_tokens = {}
+# period_id -> 前回の自動配置を開始した時点の revision
+_last_auto_assign = {}
+
+
+def mark_changed(kind, keys):
+    """変更されたデータを記録し、新しい revision を返す
+
+    kind ごとの key:
+      'shift'   (teacher_id, date, time_slot_id)  シフトの追加・削除
+      'request' (period_id, student_id, subject_id)  リクエスト数の変更
+      'slot'    (teacher_id, date, time_slot_id)  コマ内のレッスンの変更
+      'group'   (student_id, subject_id)  生徒・科目の配置数の変更
+      'master'  None  講師・生徒・科目マスタの変更
+    """
+    global _revision
+    keys = list(keys)
+    with _lock:
+        if not keys:
+            return _revision
+        _revision += 1
+        for key in keys:
+            _changes.append((_revision, kind, key))
+        return _revision
+
+
+def current_revision():
+    with _lock:
+        return _revision
+
+
+def changes_since(revision):
+    """revision より後の (kind, key) のリストを返す
+
+    履歴が既に切り捨てられていて差分が分からない場合は None を返す。
+    """
+    with _lock:
+        if _changes and _changes[0][0] > revision + 1:
+            return None
+        return [(kind, key) for rev, kind, key in _changes if rev > revision]
+
+
+def record_auto_assign(period_id, revision):
+    with _lock:
+        _last_auto_assign[period_id] = revision
+
+
+def last_auto_assign(period_id):
+    """前回の自動配置時点の revision (サーバー起動後に未実行なら None)"""
+    with _lock:
+        return _last_auto_assign.get(period_id)
+
+
+# --- 計画期間ごとのバージョン (分析キャッシュ・ETag などの無効化に使う) ---
+#
+# バージョンは data_version テーブルにランダムな値 (token) で保存する。
+# 複数のワーカープロセスで動かしても、別のプロセスやスクリプト (seed.py など) が
+# DB を書き換えても、全プロセスが同じ値を読むので古いキャッシュを返し続けない。
+# 差分同期 (/api/planner-data/<id>/changes) もこの値を版として使う。上の revision /
+# 変更履歴はプロセスごとなので、クライアントの値から今の値までをこのプロセスが
+# 書いた場合 (synced_revision) だけ差分を返し、それ以外は全体を読み直させる。
+#
+# キー:
+#   'master'            講師・生徒・科目マスタ (全期間・全テーブルに影響する)
+#   'period:<id>'       計画期間内のシフト・リクエスト・レッスン
+#   'table:<名前>:<key>' API ごとの ETag 用
+
+# 行がまだ無いキーの値
+INITIAL_TOKEN = '0'
+
+
+def ensure_table():
+    """data_version テーブルが無ければ作る (既存の DB 向け。アプリケーションコンテキスト内で呼ぶ)"""
+    DataVersion.__table__.create(db.engine, checkfirst=True)
+
+
+def _tokens(keys):
+    rows = dict(
+        db.session.query(DataVersion.key,
+                         DataVersion.token).filter(DataVersion.key.in_(keys)))
+    return tuple(rows.get(key, INITIAL_TOKEN) for key in keys)
+
+
+def _bump(keys):
+    """keys のバージョンを新しい値にしてコミットする (データのコミットの後に呼ぶ)
+
+    DB の値がこのプロセスが前回書いた値のままなら、その間に他のプロセスの変更は無いので、
+    前回の値からの変更はこのプロセスの履歴 (_changes) に全て残っている。
+    """
+    token = uuid.uuid4().hex
+    keys = set(keys)
+    with _lock:
+        # この時点より後にコミットされたデータの変更は、この revision より後に記録される
+        revision = _revision
+        expected = {
+            key: next(reversed(_written_tokens[key]))
+            for key in keys if _written_tokens.get(key)
+        }
+    continued = set()
+    for key, previous in expected.items():
+        result = db.session.execute(
+            update(DataVersion).where(DataVersion.key == key,
+                                      DataVersion.token == previous).values(
+                                          token=token))
+        if result.rowcount == 1:
+            continued.add(key)
+    # 行がまだ無かったキーは、どのプロセスもまだ変更していない (INITIAL_TOKEN から続く)
+    created = {
+        key
+        for key in keys - continued if bulk.insert_missing_rows(
+            DataVersion.__table__, [{
+                'key': key,
+                'token': token
+            }], ['key'])
+    }
+    bulk.upsert_rows(DataVersion.__table__, [{
+        'key': key,
+        'token': token
+    } for key in keys - continued - created], ['key'], ['token'])
+    db.session.commit()
+
+    with _lock:
+        for key in keys:
+            written = _written_tokens.get(key)
+            if key in created:
+                # 初期値のデータからの差分は、このプロセスの履歴の全体を使う
+                written = _written_tokens[key] = {INITIAL_TOKEN: 0}
+            elif (key not in continued or not written
+                  or next(reversed(written)) != expected[key]):
+                # 他のプロセス (または同時に書いた別スレッド) の変更が間にあるので、ここから数え直す
+                written = _written_tokens[key] = {}
+            written[token] = revision
+            if len(written) > MAX_CHANGES:
+                del written[next(iter(written))]
+
+
+def synced_revision(key, token, current):
+    """クライアントが持つ token から DB の今の値 current までの変更が、全てこのプロセスの
+    履歴にあれば、差分の起点の revision を返す (無ければ None。全体を読み直す)
+    """
+    with _lock:
+        written = _written_tokens.get(key)
+        if not written or next(reversed(written)) != current:
+            return None
+        return written.get(token)
+
+
+def bump_periods(period_ids):
+    keys = [f'period:{period_id}' for period_id in period_ids]
+    if keys:
+        _bump(keys)
+
+
+def bump_table(name, key=None):
+    _bump([f'table:{name}:{key}'])
+
+
+def table_version(name, key=None):
+    return '.'.join(_tokens(['master', f'table:{name}:{key}']))
+
+
+def bump_master(name):
+    """マスタ (name は 'teacher' / 'student' / 'subject') の変更を記録する"""
+    _bump(['master', f'table:{name}:None'])
+    mark_changed('master', [None])
+
+
+def bump_all():
+    """アプリを通さずに DB を書き換えたスクリプト (seed.py など) の最後に呼び、全てのキャッシュを無効にする"""
+    _bump(['master'])
+
+
+def make_etag(*parts):
+    """バージョンなどから ETag を作る (バージョンは DB にあるので、再起動・プロセスをまたいでも使える)"""
+    return '-'.join(str(part) for part in parts)
+
+
+def period_version(period_id):
+    """期間のデータのバージョン。値が変わっていれば計算済みの結果は古い"""
+    return _tokens(['master', f'period:{period_id}'])
+
+
+def mark_schedule_changed(start_date, end_date=None):
+    """日付 (または期間) を含む計画期間すべてのバージョンを進める"""
+    end_date = end_date or start_date
+    period_ids = [
+        period_id for (period_id, ) in db.session.query(
+            PlanningPeriod.id).filter(PlanningPeriod.start_date <= end_date,
+                                      PlanningPeriod.end_date >= start_date)
+    ]
+    bump_periods(period_ids)
+
+
+def record_lesson_changes(cells, groups):
+    """レッスンの追加・移動・削除・状態変更を記録する
+
+    cells は変更のあった (teacher_id, date, time_slot_id)、
+    groups は配置数が変わった (student_id, subject_id)。
+    """
+    cells = set(cells)
+    mark_changed('slot', cells)
+    mark_changed('group', set(groups))
+    if cells:
+        dates = [cell[1] for cell in cells]
+        mark_schedule_changed(min(dates), max(dates))
@@ -1,13 +1,74 @@
 # scheduler.py (レッスン単位ロック対応版)
 
-from models import Teacher, Student, StudentRequest, Shift, Subject, TimeSlot, Assignment, Lesson, PlanningPeriod
+from models import (StudentRequest, Shift, Subject, Teacher, Assignment,
+                    Lesson, PlanningPeriod, teacher_subjects,
+                    student_preferred_teachers)
 from extensions import db
 from datetime import timedelta, datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import bisect
+import contextlib
+import io
+import os
 import random
-from sqlalchemy import func, and_
+from sqlalchemy import bindparam, delete, exists, func, insert, select, update
+import scoring
+import optimizer
+import local_search
+import revisions
+import bulk
+from availability import AvailabilityModel, iter_bits
+from problem import ScheduleProblem
+
+
+def period_shifts_query(start_date, end_date):
+    """期間内の出勤可能なコマ (teacher_id, date, time_slot_id) を読むクエリ"""
+    return db.session.query(Shift.teacher_id, Shift.date,
+                            Shift.time_slot_id).filter(
+                                Shift.is_available,
+                                Shift.date.between(start_date, end_date))
+
+
+def period_lessons_query(start_date, end_date):
+    """期間内のコマとレッスンを、ORMオブジェクトを作らずに1回で読むクエリ"""
+    return db.session.query(
+        Assignment.id.label('assignment_id'), Assignment.teacher_id,
+        Assignment.date, Assignment.time_slot_id,
+        Lesson.id.label('lesson_id'), Lesson.student_id, Lesson.subject_id,
+        Lesson.request_id, Lesson.status).outerjoin(
+            Lesson, Lesson.assignment_id == Assignment.id).filter(
+                Assignment.date.between(start_date, end_date)).order_by(
+                    Assignment.date, Assignment.time_slot_id, Lesson.id)
+
+
+def outside_lesson_dates_query(aggregate, outside):
+    """期間外 (outside は Assignment.date の条件) の生徒・科目ごとのレッスン日を集計するクエリ"""
+    return db.session.query(Lesson.student_id, Lesson.subject_id,
+                            aggregate(Assignment.date)).join(Assignment).filter(
+                                outside).group_by(Lesson.student_id,
+                                                  Lesson.subject_id)
+
+
+class PlannedLesson:
+    """DBへ書き込む前の、配置計算中のレッスン"""
+    __slots__ = ('student_id', 'subject_id', 'request_id', 'priority')
+
+    def __init__(self, student_id, subject_id, request_id, priority):
+        self.student_id = student_id
+        self.subject_id = subject_id
+        self.request_id = request_id
+        self.priority = priority
+
+
+class GenerationCancelled(Exception):
+    """自動配置ジョブがキャンセルされた"""
 
 
 class ScheduleGenerator:
+    # generate() の呼び出し元 (ジョブキュー) から渡される進捗通知・中止判定
+    progress_callback = None
+    should_cancel = None
 
     def __init__(self, period_id, options):
         self.options = options
@@ -21,6 +82,38 @@ class ScheduleGenerator:
         self.start_date = self.period.start_date
         self.end_date = self.period.end_date
 
+        self._configure_rules()
+
+        print("スケジューラを初期化中...")
+        # 配置判定で参照するマスタを、ORMオブジェクトを作らずにID同士の対応で保持する
+        self.subject_levels = dict(
+            db.session.query(Subject.id, Subject.level))
+        self.teacher_subject_ids = {
+            t_id: set()
+            for (t_id, ) in db.session.query(Teacher.id)
+        }
+        for t_id, s_id in db.session.query(teacher_subjects.c.teacher_id,
+                                           teacher_subjects.c.subject_id):
+            self.teacher_subject_ids[t_id].add(s_id)
+        self.preferred_teacher_ids = {}
+        for s_id, t_id in db.session.query(
+                student_preferred_teachers.c.student_id,
+                student_preferred_teachers.c.teacher_id):
+            self.preferred_teacher_ids.setdefault(s_id, set()).add(t_id)
+
+        self.shifts_map = self._load_shifts()
+        print(f"期間内のシフトを {len(self.shifts_map)} 件読み込みました。")
+        # 候補コマは日付・時限・講師順に一度だけ並べておく
+        self.shift_keys = sorted(self.shifts_map,
+                                 key=lambda x: (x[1], x[2], x[0]))
+
+        self.period_rows = self._load_period_lessons()
+        # 書き込み時に削除するレッスンID と、紐付けを直すレッスン {lesson_id: request_id}
+        self.released_ids = set()
+        self.relinks = {}
+        self._load_occupancy(self.period_rows)
+
+    def _configure_rules(self):
         self.subject_interval_rule_active = 'subject_interval_days' in self.options
         if self.subject_interval_rule_active:
             self.subject_interval_days = self.options.get(
@@ -41,112 +134,418 @@ class ScheduleGenerator:
         else:
             print("★ 優先講師ルールOFF")
 
-        print("スケジューラを初期化中...")
-        self.teachers = Teacher.query.all()
-        self.students = Student.query.all()
-        self.time_slots = TimeSlot.query.all()
+        # 'vectorized' を指定すると候補コマを numpy でまとめて採点する
+        self.vectorized_scoring = self.options.get('scoring') == 'vectorized'
+        if self.vectorized_scoring and not scoring.is_available():
+            print("★ numpy が見つからないため、通常の採点処理を使用します")
+            self.vectorized_scoring = False
 
-        # 自動配置中のレッスン配置日を記録するための辞書
-        self.lesson_placement_dates = {}
+        # 'cpsat' を指定すると期間全体を一括最適化する (失敗時は貪欲法)
+        self.solver = self.options.get('solver', 'greedy')
+        if self.solver == 'cpsat' and not optimizer.is_available():
+            print("★ OR-Tools が見つからないため、貪欲法で配置します")
+            self.solver = 'greedy'
 
-        self.shifts_map = self._load_shifts()
-        print(f"期間内のシフトを {len(self.shifts_map)} 件読み込みました。")
+        # 配置後に局所探索で改善する秒数 (0 なら改善フェーズを行わない)
+        self.improve_seconds = self.options.get('improve_seconds', 0)
+
+        # 乱数 (同じ優先度内の並び順) は seed で再現できる
+        self.random = random.Random(self.options.get('seed'))
+
+        # 2以上を指定すると、seed を変えた貪欲法を並列に複数回実行する
+        self.multi_start = int(self.options.get('multi_start', 1))
+
+        # 'incremental' を指定すると、変更の影響を受けたレッスンだけを配置し直す
+        self.incremental = self.options.get('mode') == 'incremental'
 
     def _load_shifts(self):
-        shifts = Shift.query.filter(
-            Shift.date.between(self.start_date, self.end_date)).all()
-        shifts_map = {}
-        for shift in shifts:
-            key = (shift.teacher_id, shift.date, shift.time_slot_id)
-            shifts_map[key] = shift
-        return shifts_map
+        """期間内の出勤可能なコマ (teacher_id, date, time_slot_id) の集合を返す"""
+        return set(
+            period_shifts_query(self.start_date, self.end_date).tuples())
+
+    def _load_period_lessons(self):
+        """期間内のコマとレッスンを、ORMオブジェクトを作らずに1回のクエリで読み込む"""
+        return period_lessons_query(self.start_date, self.end_date).all()
+
+    def _load_occupancy(self, rows, released_ids=frozenset()):
+        """期間内のコマ・生徒の埋まり具合をメモリ上のインデックスに読み込む
+
+        released_ids のレッスンは、書き込み時に削除される前提で空きとして扱う。
+        """
+        # (teacher_id, date, time_slot_id) -> 既存の Assignment の id
+        self.assignments_map = {}
+        # (teacher_id, date, time_slot_id) -> コマ内のレッスン数
+        self.assignment_fill = {}
+        # (date, time_slot_id, student_id) の集合
+        self.student_busy = set()
+        # (student_id, subject_id) -> 期間内に残るレッスン数
+        self.kept_counts = {}
+        # 科目間隔ルール用: (student_id, subject_id) -> 既存のレッスン日の昇順のリスト
+        # 期間内の候補日に最も近いのは期間内の日か期間の直前・直後の日なので、
+        # 期間外の分は期間より前の最終日と後の最初の日だけをDBで集計する
+        self.db_lesson_dates = {}
+        for aggregate, outside in ((func.max, Assignment.date
+                                    < self.start_date),
+                                   (func.min, Assignment.date
+                                    > self.end_date)):
+            for student_id, subject_id, lesson_date in (
+                    outside_lesson_dates_query(aggregate, outside)):
+                self.db_lesson_dates.setdefault((student_id, subject_id),
+                                                []).append(lesson_date)
+
+        for row in rows:
+            key = (row.teacher_id, row.date, row.time_slot_id)
+            self.assignments_map[key] = row.assignment_id
+            if row.lesson_id is None or row.lesson_id in released_ids:
+                continue
+            group = (row.student_id, row.subject_id)
+            self.assignment_fill[key] = self.assignment_fill.get(key, 0) + 1
+            self.student_busy.add((row.date, row.time_slot_id,
+                                   row.student_id))
+            self.kept_counts[group] = self.kept_counts.get(group, 0) + 1
+            self.db_lesson_dates.setdefault(group, []).append(row.date)
+        for dates in self.db_lesson_dates.values():
+            dates.sort()
+
+        self._reset_run_state()
+
+    def _reset_run_state(self):
+        # 今回の配置結果: PlannedLesson -> (teacher_id, date, time_slot_id)
+        self.placements = {}
+        # (student_id, subject_id) -> 既存と今回配置した分を合わせたレッスン日の昇順のリスト
+        self.lesson_dates = {
+            group: list(dates)
+            for group, dates in self.db_lesson_dates.items()
+        }
+
+        self.scorer = scoring.BatchSlotScorer(
+            self) if self.vectorized_scoring else None
+        # 候補探索用の空き状況のビットセット (配置・解放のたびに更新する)
+        self.availability = AvailabilityModel.from_generator(self)
+
+    def compile_problem(self):
+        """今回配置する対象を決め、DBに依存しない ScheduleProblem にまとめる"""
+        return ScheduleProblem.compile(self, self._prepare_run())
+
+    @classmethod
+    def from_problem(cls, problem, options, seed=None):
+        """ScheduleProblem から、DBに触れずに生成器を復元する"""
+        self = cls.__new__(cls)
+        self.options = dict(options)
+        if seed is not None:
+            self.options['seed'] = seed
+        self.period_id = problem.period_id
+        self.start_date = problem.start_date
+        self.end_date = problem.end_date
+        self._configure_rules()
+        self.subject_levels = problem.subject_level_map()
+        self.teacher_subject_ids = problem.teacher_subject_ids()
+        self.preferred_teacher_ids = problem.preferred_teacher_ids()
+        self.shift_keys = problem.shift_keys()
+        self.shifts_map = set(self.shift_keys)
+        self.assignment_fill = problem.assignment_fill()
+        self.student_busy = problem.student_busy()
+        self.db_lesson_dates = problem.lesson_dates()
+        self.assignments_map = {}
+        self._reset_run_state()
+        return self
 
     # ▼▼▼ 修正点1: クリーンアップ処理の変更 ▼▼▼
-    def _cleanup_existing_schedule(self):
+    def _release_existing_schedule(self):
+        """既存の自動生成レッスンを解放する (ロックされたレッスンは維持)
+
+        実際の削除は _write_placements で配置結果と同じトランザクションで行う。
+        """
         print("既存の自動生成レッスンをクリーンアップします (ロックされたレッスンは維持)...")
+        self.released_ids = {
+            row.lesson_id
+            for row in self.period_rows if row.status == 'auto'
+        }
 
-        # 期間内で 'auto' ステータスのレッスンIDを取得
-        auto_lessons_ids = [
-            id_tuple[0]
-            for id_tuple in db.session.query(Lesson.id).join(Assignment).
-            filter(Assignment.date.between(self.start_date, self.end_date),
-                   Lesson.status == 'auto').all()
-        ]
-
-        if auto_lessons_ids:
-            # 'auto' のレッスンを削除
-            Lesson.query.filter(Lesson.id.in_(auto_lessons_ids)).delete(
-                synchronize_session=False)
-
-            # レッスンが空になったAssignmentを検索して削除
-            empty_assignments = Assignment.query.filter(
-                Assignment.date.between(
-                    self.start_date,
-                    self.end_date)).filter(~Assignment.lessons.any()).all()
-
-            if empty_assignments:
-                print(f"{len(empty_assignments)}個の空になったコマを削除します。")
-                for assign in empty_assignments:
-                    db.session.delete(assign)
+    def _release_affected_lessons(self):
+        """差分モード: 前回の自動配置以降の変更で配置し直しが必要な 'auto' レッスンだけを解放する
+
+        次のレッスンを解放する (ロック済みのレッスンは動かさない):
+          - シフトが無くなったコマ、または変更されたシフトのコマにあるもの
+          - 高校科目で担当外の講師になっているもの
+          - リクエストが削除・変更された生徒・科目のもの
+          - リクエスト数を超えている分、生徒の重複・定員超過になっている分
+        """
+        last_revision = revisions.last_auto_assign(self.period_id)
+        changes = None
+        if last_revision is not None:
+            changes = revisions.changes_since(last_revision)
+        if changes is None:
+            print("★ 前回の自動配置以降の変更履歴が無いため、配置の整合性のみ確認します")
+            changes = []
+        changed_cells = {key for kind, key in changes if kind == 'shift'}
+        changed_groups = {
+            (student_id, subject_id)
+            for kind, (period_id, student_id, subject_id) in (
+                (kind, key) for kind, key in changes if kind == 'request')
+            if period_id == self.period_id
+        }
 
+        requests = {(req.student_id, req.subject_id): req
+                    for req in StudentRequest.query.filter_by(
+                        planning_period_id=self.period_id).all()}
+        rows = [row for row in self.period_rows if row.lesson_id is not None]
+
+        # ロック済みのレッスンが先に枠を確保する
+        kept_count = {}
+        fill = {}
+        busy = set()
+        for row in rows:
+            if row.status == 'locked':
+                group = (row.student_id, row.subject_id)
+                key = (row.teacher_id, row.date, row.time_slot_id)
+                kept_count[group] = kept_count.get(group, 0) + 1
+                fill[key] = fill.get(key, 0) + 1
+                busy.add((row.date, row.time_slot_id, row.student_id))
+
+        self.released_ids = set()
+        self.relinks = {}
+        for row in rows:
+            if row.status == 'locked':
+                continue
+            group = (row.student_id, row.subject_id)
+            key = (row.teacher_id, row.date, row.time_slot_id)
+            req = requests.get(group)
+            if (key not in self.shifts_map or key in changed_cells
+                    or group in changed_groups or req is None
+                    or kept_count.get(group, 0) >= req.requested_lessons
+                    or fill.get(key, 0) >= 2
+                    or (row.date, row.time_slot_id, row.student_id) in busy
+                    or not self._is_teacher_qualified(row.subject_id,
+                                                      row.teacher_id)):
+                self.released_ids.add(row.lesson_id)
+                continue
+            kept_count[group] = kept_count.get(group, 0) + 1
+            fill[key] = fill.get(key, 0) + 1
+            busy.add((row.date, row.time_slot_id, row.student_id))
+            # リクエストが作り直されていれば、残すレッスンの紐付けを更新する
+            if row.request_id != req.id:
+                self.relinks[row.lesson_id] = req.id
+
+        print(f"★ 差分モード: {len(self.released_ids)}コマを再配置の対象にします "
+              f"(維持 {sum(kept_count.values())}コマ)")
+
+    def generate(self, progress_callback=None, should_cancel=None):
+        self.progress_callback = progress_callback
+        self.should_cancel = should_cancel
+        # この時点より後の変更は、次回の差分モードで扱う
+        started_revision = revisions.current_revision()
+
+        self._report_progress('cleanup', 0, 0)
+        lessons_to_create = self._prepare_run()
+        self._check_cancelled()
+
+        solver_used = 'greedy'
+        placements = None
+        if self.solver == 'cpsat':
+            self._report_progress('solving', 0, len(lessons_to_create))
+            placements = optimizer.solve_cpsat(
+                self, lessons_to_create,
+                self.options.get('solver_time_limit', 30),
+                self.options.get('solver_workers'))
+            self._check_cancelled()
+            if placements is None:
+                print("★ 最適化ソルバーで解が得られなかったため、貪欲法で配置します")
+
+        if placements is not None:
+            solver_used = 'cpsat'
+            placed_ids = set()
+            for lesson_data, slot_info in placements:
+                placed_ids.add(id(lesson_data))
+                self._assign_lesson_to_slot(self._new_lesson(lesson_data),
+                                            slot_info)
+            self._report_progress('solving', len(lessons_to_create),
+                                  len(lessons_to_create))
+            unplaced = [
+                self._new_lesson(l_data) for l_data in lessons_to_create
+                if id(l_data) not in placed_ids
+            ]
+            self._improve(unplaced, len(lessons_to_create))
+        elif self.multi_start > 1:
+            solver_used = 'multi_start'
+            self._place_multi_start(lessons_to_create)
+        else:
+            unplaced = self._place_greedily(
+                self._sort_lessons(lessons_to_create))
+            self._improve(unplaced, len(lessons_to_create))
+
+        self._check_cancelled()
+        self._report_progress('writing', len(lessons_to_create),
+                              len(lessons_to_create))
+        try:
+            self._write_placements()
             db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        self._record_changes()
+
+        print("\n--- 自動配置完了 ---")
+        print(f"割り当て完了: {len(self.placements)}コマ "
+              f"(解放 {len(self.released_ids)}コマ)")
+        print(f"未配置: {len(lessons_to_create) - len(self.placements)}コマ")
+        revisions.record_auto_assign(self.period_id, started_revision)
+        return {
+            "status": "completed",
+            "solver": solver_used,
+            "mode": 'incremental' if self.incremental else 'full',
+            "placed": len(self.placements),
+            "unplaced": len(lessons_to_create) - len(self.placements)
+        }
 
-    def generate(self):
-        self._cleanup_existing_schedule()
+    def _prepare_run(self):
+        """解放するレッスンを決めて空き状況を読み直し、配置するレッスンのリストを返す"""
+        if self.incremental:
+            self._release_affected_lessons()
+        else:
+            self._release_existing_schedule()
+        self._load_occupancy(self.period_rows, self.released_ids)
 
         print("生徒のリクエストから未配置のレッスンを準備します...")
         lessons_to_create = self._prepare_lessons_to_create()
-
-        lessons_to_create.sort(key=lambda l_data: (
-            l_data['request'].priority != 'HIGH', l_data['request'].priority !=
-            'MEDIUM', l_data['request'].priority != 'LOW', random.random()))
-
         print(f"合計 {len(lessons_to_create)} 個のレッスンを割り当てます。")
-
-        newly_created_assignments = {}
-
+        return lessons_to_create
+
+    def _record_changes(self):
+        """書き込んだ差分を、プランナーの差分同期・キャッシュ無効化用に記録する"""
+        cells = set(self.placements.values())
+        groups = {(lesson.student_id, lesson.subject_id)
+                  for lesson in self.placements}
+        for row in self.period_rows:
+            if row.lesson_id in self.released_ids:
+                cells.add((row.teacher_id, row.date, row.time_slot_id))
+                groups.add((row.student_id, row.subject_id))
+        revisions.record_lesson_changes(cells, groups)
+
+    def _improve(self, unplaced, total):
+        if not self.improve_seconds:
+            return
+        self._report_progress('improving', total, total)
+        local_search.LocalSearch(self, unplaced, self.improve_seconds).run()
+        self._check_cancelled()
+
+    def _report_progress(self, phase, processed, total):
+        if self.progress_callback:
+            self.progress_callback(phase, processed, total,
+                                   len(self.placements))
+
+    def cancel_requested(self):
+        return bool(self.should_cancel and self.should_cancel())
+
+    def _check_cancelled(self):
+        if self.cancel_requested():
+            print("★ 自動配置がキャンセルされました")
+            raise GenerationCancelled()
+
+    def _new_lesson(self, lesson_data):
+        return PlannedLesson(lesson_data['student_id'],
+                             lesson_data['subject_id'],
+                             lesson_data['request_id'],
+                             lesson_data['priority'])
+
+    def _sort_lessons(self, lessons_to_create):
+        return sorted(lessons_to_create,
+                      key=lambda l_data:
+                      (l_data['priority'] != 'HIGH', l_data['priority'] !=
+                       'MEDIUM', l_data['priority'] != 'LOW',
+                       self.random.random()))
+
+    def _place_multi_start(self, lessons_to_create):
+        """seed を変えた貪欲法を複数プロセスで実行し、最良の結果を採用する"""
+        # ワーカーには配列だけでできた問題を渡す (ORMオブジェクトや大きな dict を送らない)
+        problem = ScheduleProblem.compile(self, lessons_to_create)
+        base_seed = self.options.get('seed')
+        if base_seed is None:
+            base_seed = self.random.randrange(2**31)
+        seeds = [base_seed + i for i in range(self.multi_start)]
+        print(f"★ {len(seeds)}通りの seed で並列に配置します...")
+
+        self._report_progress('multi_start', 0, len(seeds))
+        try:
+            results = self._run_attempts_in_pool(problem, seeds)
+        except (OSError, BrokenProcessPool) as e:
+            print(f"★ 並列実行できなかったため、順番に実行します ({e})")
+            results = []
+            for seed in seeds:
+                self._check_cancelled()
+                results.append(_run_attempt(problem, self.options, seed))
+                self._report_progress('multi_start', len(results), len(seeds))
+
+        for result in results:
+            print(f"  seed={result['seed']}: 配置 {result['placed']}コマ, "
+                  f"ソフト制約スコア {result['soft_score']}")
+        best = max(results, key=lambda r: (r['placed'], r['soft_score']))
+        print(f"★ seed={best['seed']} の結果を採用します")
+
+        for student_id, subject_id, request_id, priority, key in best[
+                'placements']:
+            teacher_id, date, time_slot_id = key
+            self._assign_lesson_to_slot(
+                PlannedLesson(student_id, subject_id, request_id, priority), {
+                    "teacher_id": teacher_id,
+                    "date": date,
+                    "time_slot_id": time_slot_id
+                })
+
+    def _run_attempts_in_pool(self, problem, seeds):
+        max_workers = min(len(seeds), os.cpu_count() or 1)
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        try:
+            pending = {
+                executor.submit(_run_attempt, problem, self.options, seed)
+                for seed in seeds
+            }
+            results = []
+            # 完了を待つ間もキャンセル要求を確認する
+            while pending:
+                done, pending = wait(pending,
+                                     timeout=0.5,
+                                     return_when=FIRST_COMPLETED)
+                results.extend(future.result() for future in done)
+                if done:
+                    self._report_progress('multi_start', len(results),
+                                          len(seeds))
+                self._check_cancelled()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return sorted(results, key=lambda r: r['seed'])
+
+    def _place_greedily(self, lessons_to_create):
+        """優先度順に1コマずつ配置し、配置できなかったレッスンを返す"""
+        unplaced = []
         for i, lesson_data in enumerate(lessons_to_create):
             if (i + 1) % 10 == 0:
                 print(f"  ... {i + 1}/{len(lessons_to_create)} レッスン処理中")
+                self._check_cancelled()
+                self._report_progress('placing', i + 1, len(lessons_to_create))
 
-            # Lessonインスタンスのstatusはデフォルトで 'auto' になる
-            lesson = Lesson(student_id=lesson_data['student_id'],
-                            subject_id=lesson_data['subject_id'],
-                            request_id=lesson_data['request_id'])
-
+            lesson = self._new_lesson(lesson_data)
             best_slot = self._find_best_slot_for_lesson(lesson)
 
             if best_slot:
-                self._assign_lesson_to_slot(lesson, best_slot,
-                                            newly_created_assignments)
-
-        db.session.commit()
-
-        print("\n--- 自動配置完了 ---")
-        assigned_count = db.session.query(Lesson).join(Assignment).filter(
-            Assignment.date.between(self.start_date, self.end_date),
-            Lesson.status == 'auto').count()
-        print(f"割り当て完了: {assigned_count}コマ")
-        print(f"未配置: {len(lessons_to_create) - assigned_count}コマ")
-        return {"status": "completed"}
+                self._assign_lesson_to_slot(lesson, best_slot)
+            else:
+                unplaced.append(lesson)
+        self._report_progress('placing', len(lessons_to_create),
+                              len(lessons_to_create))
+        return unplaced
 
     # ▼▼▼ 修正点2: 未配置レッスンの計算方法を変更 ▼▼▼
     def _prepare_lessons_to_create(self):
-        # 期間内で 'locked' ステータスのレッスンを生徒・科目ごとに集計
-        locked_lessons_count = db.session.query(
-            Lesson.student_id, Lesson.subject_id,
-            func.count(Lesson.id)).join(Assignment).filter(
-                Assignment.date.between(self.start_date, self.end_date),
-                Lesson.status == 'locked').group_by(Lesson.student_id,
-                                                    Lesson.subject_id).all()
+        # 期間内に残るレッスン (ロック済み + 差分モードで維持した 'auto') の数
+        locked_map = self.kept_counts
 
-        locked_map = {
-            (student_id, subject_id): count
-            for student_id, subject_id, count in locked_lessons_count
-        }
-
-        requests = StudentRequest.query.filter_by(
-            planning_period_id=self.period_id).all()
+        requests = db.session.query(
+            StudentRequest.id, StudentRequest.student_id,
+            StudentRequest.subject_id, StudentRequest.requested_lessons,
+            StudentRequest.priority).filter(
+                StudentRequest.planning_period_id == self.period_id).order_by(
+                    StudentRequest.id).all()
 
         lessons_to_create_list = []
         for req in requests:
@@ -159,127 +558,201 @@ class ScheduleGenerator:
                         'student_id': req.student_id,
                         'subject_id': req.subject_id,
                         'request_id': req.id,
-                        'request': req
+                        'priority': req.priority
                     })
         return lessons_to_create_list
 
     def _find_best_slot_for_lesson(self, lesson):
-        best_slot = None
-        highest_score = -1
-        possible_shifts = list(self.shifts_map.keys())
-        #random.shuffle(possible_shifts)
-        possible_shifts.sort(key=lambda x: (x[1], x[2]))
-        for key in possible_shifts:
-            teacher_id, date, time_slot_id = key
-            if not self._is_slot_assignable(lesson, teacher_id, date,
-                                            time_slot_id):
-                continue
-            score = self._calculate_slot_score(lesson, teacher_id, date)
-            if score > highest_score:
-                highest_score = score
-                best_slot = {
-                    "teacher_id": teacher_id,
-                    "date": date,
-                    "time_slot_id": time_slot_id
-                }
-        return best_slot
+        if self.scorer:
+            return self.scorer.best_slot(lesson)
+
+        # 配置できる (講師, セル) だけを空き状況のビットセットから取り出して採点する。
+        # 同点なら日付・時限・講師の順で最初の候補を選ぶ (shift_keys を順に見た場合と同じ)
+        best = None
+        best_rank = None
+        for teacher_id, bits in self.availability.feasible(
+                lesson.student_id, lesson.subject_id).items():
+            for cell in iter_bits(bits):
+                date = self.availability.cell_key(cell)[0]
+                score = self._calculate_slot_score(lesson, teacher_id, date)
+                rank = (score, -cell, -teacher_id)
+                if score > scoring.REJECT_SCORE and (best_rank is None
+                                                     or rank > best_rank):
+                    best_rank = rank
+                    best = (teacher_id, cell)
+        if best is None:
+            return None
+        teacher_id, cell = best
+        date, time_slot_id = self.availability.cell_key(cell)
+        return {
+            "teacher_id": teacher_id,
+            "date": date,
+            "time_slot_id": time_slot_id
+        }
 
-    def _is_slot_assignable(self, lesson, teacher_id, date, time_slot_id):
-        teacher = db.session.get(Teacher, teacher_id)
-        subject = db.session.get(Subject, lesson.subject_id)
+    def _is_teacher_qualified(self, subject_id, teacher_id):
+        if self.subject_levels.get(subject_id) == '高校':
+            return subject_id in self.teacher_subject_ids.get(teacher_id, ())
+        return True
 
-        if subject.level == '高校':
-            if subject not in teacher.subjects:
-                return False
+    def _is_slot_assignable(self, lesson, teacher_id, date, time_slot_id):
+        if not self._is_teacher_qualified(lesson.subject_id, teacher_id):
+            return False
 
-        student_is_busy = db.session.query(Lesson.id).join(Assignment).filter(
-            Assignment.date == date, Assignment.time_slot_id == time_slot_id,
-            Lesson.student_id == lesson.student_id).first()
-        if student_is_busy:
+        if (date, time_slot_id, lesson.student_id) in self.student_busy:
             return False
 
-        existing_assignment = Assignment.query.filter_by(
-            teacher_id=teacher.id, date=date,
-            time_slot_id=time_slot_id).first()
-        if existing_assignment and len(existing_assignment.lessons) >= 2:
+        if self.assignment_fill.get((teacher_id, date, time_slot_id), 0) >= 2:
             return False
 
         return True
 
     def _calculate_slot_score(self, lesson, teacher_id, candidate_date):
-        score = 100
+        score = scoring.BASE_SCORE
         if self.subject_interval_rule_active:
-            # 1. データベースから最後に配置された日を取得
-            db_last_lesson_date = db.session.query(db.func.max(
-                Assignment.date)).join(Lesson).filter(
-                    Lesson.student_id == lesson.student_id,
-                    Lesson.subject_id == lesson.subject_id).scalar()
-
-            # 2. 今回の自動配置中に置かれた最後のレッスン日を取得
-            student_subject_key = (lesson.student_id, lesson.subject_id)
-            runtime_last_lesson_date = self.lesson_placement_dates.get(
-                student_subject_key)
-
-            # 3. DBと実行中の履歴の両方を比較して、より新しい日付を最終日とする
-            last_lesson_date = None
-            if db_last_lesson_date and runtime_last_lesson_date:
-                last_lesson_date = max(db_last_lesson_date,
-                                       runtime_last_lesson_date)
-            else:
-                last_lesson_date = db_last_lesson_date or runtime_last_lesson_date
-
-            if last_lesson_date:
-                interval = (candidate_date - last_lesson_date).days
-                if interval >= self.subject_interval_days:
-                    score += 50
-                else:
-                    penalty_base = 0
-                    if self.interval_strength == 'weak': penalty_base = 10
-                    elif self.interval_strength == 'normal': penalty_base = 60
-                    elif self.interval_strength == 'strong':
-                        penalty_base = 1000
-                    score -= penalty_base * (self.subject_interval_days -
-                                             interval)
+            # DBの既存レッスンと今回の自動配置分のうち、前後で最も近いレッスンとの間隔
+            score += scoring.interval_score(
+                self.lesson_dates.get((lesson.student_id, lesson.subject_id)),
+                candidate_date, self.subject_interval_days,
+                self.interval_strength)
         if self.preferred_teacher_rule_active:
-            student = db.session.get(Student, lesson.student_id)
-            preferred_teacher_ids = [t.id for t in student.preferred_teachers]
+            preferred_teacher_ids = self.preferred_teacher_ids.get(
+                lesson.student_id, ())
 
             if teacher_id in preferred_teacher_ids:
-                bonus = 0
-                if self.preferred_strength == 'weak': bonus = 20
-                elif self.preferred_strength == 'normal': bonus = 100
-                elif self.preferred_strength == 'strong': bonus = 1000
-                score += bonus
+                score += scoring.PREFERRED_BONUSES.get(
+                    self.preferred_strength, 0)
         return score
 
-    # ▼▼▼ 修正点3: Assignment作成時にstatusを設定しない ▼▼▼
-    def _assign_lesson_to_slot(self, lesson, slot_info,
-                               newly_created_assignments):
+    def _assign_lesson_to_slot(self, lesson, slot_info):
+        """レッスンをメモリ上で配置し、インデックスを更新する (DBには書かない)"""
         assignment_key = (slot_info['teacher_id'], slot_info['date'],
                           slot_info['time_slot_id'])
+        self.placements[lesson] = assignment_key
 
         # 配置履歴を更新
         student_subject_key = (lesson.student_id, lesson.subject_id)
-        self.lesson_placement_dates[student_subject_key] = slot_info['date']
+        bisect.insort(self.lesson_dates.setdefault(student_subject_key, []),
+                      slot_info['date'])
+
+        self.assignment_fill[assignment_key] = self.assignment_fill.get(
+            assignment_key, 0) + 1
+        self.student_busy.add((slot_info['date'], slot_info['time_slot_id'],
+                               lesson.student_id))
+        self.availability.mark_placed(assignment_key, lesson.student_id)
+        if self.scorer:
+            self.scorer.mark_placed(assignment_key, lesson.student_id)
+
+    def _release_lesson(self, lesson):
+        """_assign_lesson_to_slot で配置したレッスンを外す"""
+        assignment_key = self.placements.pop(lesson)
+        teacher_id, date, time_slot_id = assignment_key
+
+        dates = self.lesson_dates[(lesson.student_id, lesson.subject_id)]
+        del dates[bisect.bisect_left(dates, date)]
+
+        self.assignment_fill[assignment_key] -= 1
+        self.student_busy.discard((date, time_slot_id, lesson.student_id))
+        self.availability.mark_released(assignment_key, lesson.student_id)
+        if self.scorer:
+            self.scorer.mark_released(assignment_key, lesson.student_id)
 
-        assignment = newly_created_assignments.get(assignment_key)
-
-        if not assignment:
-            assignment = Assignment.query.filter_by(
-                teacher_id=slot_info['teacher_id'],
-                date=slot_info['date'],
-                time_slot_id=slot_info['time_slot_id']).first()
-
-        if assignment:
-            if len(assignment.lessons) < 2:
-                assignment.lessons.append(lesson)
+    # ▼▼▼ 修正点3: Assignment作成時にstatusを設定しない ▼▼▼
+    def _write_placements(self):
+        """解放したレッスンの削除と配置結果の追加を、集合単位のSQLで書き込む
+
+        呼び出し側で1回だけ commit するので、途中で失敗しても既存の配置は残る。
+        """
+        # ID 指定の executemany は ORM を通さず、テーブルに対して直接実行する
+        lesson_table = Lesson.__table__
+
+        # 1. 解放したレッスンを削除する
+        if self.incremental:
+            if self.released_ids:
+                db.session.execute(
+                    delete(lesson_table).where(
+                        lesson_table.c.id == bindparam('lesson_id')),
+                    [{'lesson_id': l_id} for l_id in self.released_ids])
         else:
-            # Assignment作成時にstatusは不要になった
-            assignment = Assignment(teacher_id=slot_info['teacher_id'],
-                                    date=slot_info['date'],
-                                    time_slot_id=slot_info['time_slot_id'])
-            db.session.add(assignment)
-            assignment.lessons.append(lesson)
-            newly_created_assignments[assignment_key] = assignment
-
-        db.session.add(lesson)
+            db.session.execute(
+                delete(Lesson).where(
+                    Lesson.status == 'auto',
+                    Lesson.assignment_id.in_(
+                        select(Assignment.id).where(
+                            Assignment.date.between(self.start_date,
+                                                    self.end_date)))))
+
+        # 2. 作り直されたリクエストへの紐付けを更新する
+        if self.relinks:
+            db.session.execute(
+                update(lesson_table).where(
+                    lesson_table.c.id == bindparam('lesson_id')).values(
+                        request_id=bindparam('new_request_id')),
+                [{
+                    'lesson_id': l_id,
+                    'new_request_id': req_id
+                } for l_id, req_id in self.relinks.items()])
+
+        # 3. 新しく使うコマの Assignment をまとめて作成し、id を受け取る
+        new_keys = sorted(
+            {key
+             for key in self.placements.values()} - self.assignments_map.keys(),
+            key=lambda k: (k[1], k[2], k[0]))
+        if new_keys:
+            result = db.session.execute(
+                insert(Assignment).returning(Assignment.id,
+                                             Assignment.teacher_id,
+                                             Assignment.date,
+                                             Assignment.time_slot_id,
+                                             sort_by_parameter_order=True),
+                [{
+                    'teacher_id': teacher_id,
+                    'date': date,
+                    'time_slot_id': time_slot_id
+                } for teacher_id, date, time_slot_id in new_keys])
+            for assignment_id, teacher_id, date, time_slot_id in result:
+                self.assignments_map[(teacher_id, date,
+                                      time_slot_id)] = assignment_id
+
+        # 4. レッスンをまとめて追加する (status は 'auto'。PostgreSQL では COPY)
+        if self.placements:
+            bulk.insert_rows(Lesson.__table__, [{
+                'student_id': lesson.student_id,
+                'subject_id': lesson.subject_id,
+                'request_id': lesson.request_id,
+                'assignment_id': self.assignments_map[key],
+                'status': 'auto'
+            } for lesson, key in self.placements.items()])
+
+        # 5. レッスンが空になったコマを1文で削除する
+        result = db.session.execute(
+            delete(Assignment).where(
+                Assignment.date.between(self.start_date, self.end_date),
+                ~exists().where(Lesson.assignment_id == Assignment.id)))
+        if result.rowcount:
+            print(f"{result.rowcount}個の空になったコマを削除します。")
+
+
+def _run_attempt(problem, options, seed):
+    """ワーカープロセスで、1つの seed について貪欲法 (+局所探索) を実行する"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        generator = ScheduleGenerator.from_problem(problem, options, seed)
+        unplaced = generator._place_greedily(
+            generator._sort_lessons(problem.lessons()))
+        search = local_search.LocalSearch(generator, unplaced,
+                                          generator.improve_seconds, seed)
+        if generator.improve_seconds:
+            search.run()
+        soft_score = search.total_score()
+
+    return {
+        'seed':
+        seed,
+        'placed':
+        len(generator.placements),
+        'soft_score':
+        soft_score,
+        'placements': [(lesson.student_id, lesson.subject_id,
+                        lesson.request_id, lesson.priority, key)
+                       for lesson, key in generator.placements.items()]
+    }
@@ -0,0 +1,169 @@
+# scoring.py (候補コマの一括スコアリング)
+
+import bisect
+
+try:
+    import numpy as np
+except ImportError:  # numpy が無い環境ではスカラー版の採点を使う
+    np = None
+
+# 候補コマの点数 (スカラー版・一括版・配置候補の提案・CP-SAT で共通)
+BASE_SCORE = 100
+# 科目間隔ルールを満たしたときの加点
+INTERVAL_BONUS = 50
+# 科目間隔ルール・優先講師ルールの重み (局所探索でも使う)
+INTERVAL_PENALTIES = {'weak': 10, 'normal': 60, 'strong': 1000}
+PREFERRED_BONUSES = {'weak': 20, 'normal': 100, 'strong': 1000}
+# 点数がこの値以下の候補は配置に使わない
+REJECT_SCORE = -1
+
+
+def nearest_interval(dates, candidate_date):
+    """候補日から前後で最も近いレッスン日 (dates は昇順) までの日数 (無ければ None)"""
+    if not dates:
+        return None
+    i = bisect.bisect_left(dates, candidate_date)
+    gaps = []
+    if i > 0:
+        gaps.append((candidate_date - dates[i - 1]).days)
+    if i < len(dates):
+        gaps.append((dates[i] - candidate_date).days)
+    return min(gaps)
+
+
+def interval_score(dates, candidate_date, interval_days, strength):
+    """科目間隔ルールの点数
+
+    同じ生徒・科目で最も近いレッスンとの間隔が interval_days 以上なら加点し、
+    足りなければ不足日数 x 強度ごとの重みを減点する。レッスンが無ければ 0。
+    """
+    interval = nearest_interval(dates, candidate_date)
+    if interval is None:
+        return 0
+    if interval >= interval_days:
+        return INTERVAL_BONUS
+    return -INTERVAL_PENALTIES.get(strength, 0) * (interval_days - interval)
+
+
+def is_available():
+    return np is not None
+
+
+class BatchSlotScorer:
+    """期間内の全候補コマを配列化し、1レッスン分をまとめて採点する"""
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.keys = list(generator.shift_keys)
+        self.index_of = {key: i for i, key in enumerate(self.keys)}
+
+        self.teacher_ids = np.array([k[0] for k in self.keys], dtype=np.int64)
+        self.date_ordinals = np.array([k[1].toordinal() for k in self.keys],
+                                      dtype=np.int64)
+        self.time_slot_ids = np.array([k[2] for k in self.keys],
+                                      dtype=np.int64)
+        # 日付とコマを1つの整数にまとめたセル番号 (生徒の重複判定用)
+        self.cell_codes = self.date_ordinals * 100 + self.time_slot_ids
+        self.capacity = np.array(
+            [2 - generator.assignment_fill.get(k, 0) for k in self.keys],
+            dtype=np.int64)
+
+        self.busy_cells = {}
+        for date, time_slot_id, student_id in generator.student_busy:
+            self.busy_cells.setdefault(student_id, []).append(
+                date.toordinal() * 100 + time_slot_id)
+
+        self._qualified_masks = {}
+        self._preferred_masks = {}
+
+    def _qualified_mask(self, subject_id):
+        mask = self._qualified_masks.get(subject_id)
+        if mask is None:
+            if self.generator.subject_levels.get(subject_id) == '高校':
+                qualified = [
+                    t_id for t_id, subject_ids in
+                    self.generator.teacher_subject_ids.items()
+                    if subject_id in subject_ids
+                ]
+                mask = np.isin(self.teacher_ids, qualified)
+            else:
+                mask = np.ones(len(self.keys), dtype=bool)
+            self._qualified_masks[subject_id] = mask
+        return mask
+
+    def _preferred_mask(self, student_id):
+        mask = self._preferred_masks.get(student_id)
+        if mask is None:
+            preferred = list(
+                self.generator.preferred_teacher_ids.get(student_id, ()))
+            mask = np.isin(self.teacher_ids, preferred)
+            self._preferred_masks[student_id] = mask
+        return mask
+
+    def feasible_mask(self, lesson):
+        mask = self._qualified_mask(lesson.subject_id) & (self.capacity > 0)
+        busy = self.busy_cells.get(lesson.student_id)
+        if busy:
+            mask &= ~np.isin(self.cell_codes, busy)
+        return mask
+
+    def scores(self, lesson):
+        """全候補のスコアを返す (値はスカラー版と一致する)"""
+        gen = self.generator
+        scores = np.full(len(self.keys), BASE_SCORE, dtype=np.int64)
+        if gen.subject_interval_rule_active:
+            dates = gen.lesson_dates.get(
+                (lesson.student_id, lesson.subject_id))
+            if dates:
+                interval = self._nearest_intervals(dates)
+                penalty_base = INTERVAL_PENALTIES.get(gen.interval_strength, 0)
+                scores += np.where(
+                    interval >= gen.subject_interval_days, INTERVAL_BONUS,
+                    -penalty_base * (gen.subject_interval_days - interval))
+        if gen.preferred_teacher_rule_active:
+            bonus = PREFERRED_BONUSES.get(gen.preferred_strength, 0)
+            scores += np.where(self._preferred_mask(lesson.student_id), bonus,
+                               0)
+        return scores
+
+    def _nearest_intervals(self, dates):
+        """各候補日から、前後で最も近いレッスン日 (dates は昇順) までの日数"""
+        ordinals = np.array([d.toordinal() for d in dates], dtype=np.int64)
+        i = np.searchsorted(ordinals, self.date_ordinals)
+        large = np.iinfo(np.int64).max
+        before = np.where(i > 0,
+                          self.date_ordinals - ordinals[np.maximum(i - 1, 0)],
+                          large)
+        after = np.where(i < len(ordinals),
+                         ordinals[np.minimum(i, len(ordinals) - 1)] -
+                         self.date_ordinals, large)
+        return np.minimum(before, after)
+
+    def best_slot(self, lesson):
+        if not self.keys:
+            return None
+        scores = np.where(self.feasible_mask(lesson), self.scores(lesson),
+                          np.iinfo(np.int64).min)
+        best = int(np.argmax(scores))
+        # スカラー版と同様、スコアが -1 以下の候補は採用しない
+        if scores[best] <= REJECT_SCORE:
+            return None
+        teacher_id, date, time_slot_id = self.keys[best]
+        return {
+            "teacher_id": teacher_id,
+            "date": date,
+            "time_slot_id": time_slot_id
+        }
+
+    def mark_placed(self, key, student_id):
+        i = self.index_of.get(key)
+        if i is not None:
+            self.capacity[i] -= 1
+        self.busy_cells.setdefault(student_id, []).append(
+            key[1].toordinal() * 100 + key[2])
+
+    def mark_released(self, key, student_id):
+        i = self.index_of.get(key)
+        if i is not None:
+            self.capacity[i] += 1
+        self.busy_cells[student_id].remove(key[1].toordinal() * 100 + key[2])
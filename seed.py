@@ -2,6 +2,7 @@
 
 from app import create_app
 from extensions import db
+import revisions
 from models import Teacher, Student, Subject, TimeSlot, StudentRequest, Shift, Lesson, Assignment, PlanningPeriod
 from datetime import date, timedelta
 import random
@@ -11,6 +12,171 @@ START_DATE = date(2025, 7, 1)
 END_DATE = date(2025, 8, 31)
 TOTAL_REQUESTED_LESSONS = 150
 
+# --- マスタデータ (synthetic_data.py の合成データ生成でも使う) ---
+TIME_SLOTS_DATA = [{
+    'id': 1,
+    'weekdayTime': '9:00-10:00',
+    'weekendTime': '9:00-10:00'
+}, {
+    'id': 2,
+    'weekdayTime': '10:10-11:10',
+    'weekendTime': '10:10-11:10'
+}, {
+    'id': 3,
+    'weekdayTime': '11:20-12:20',
+    'weekendTime': '11:20-12:20'
+}, {
+    'id': 4,
+    'weekdayTime': '12:30-13:30',
+    'weekendTime': '12:30-13:30'
+}, {
+    'id': 5,
+    'weekdayTime': '14:10-15:10',
+    'weekendTime': '13:40-14:40'
+}, {
+    'id': 6,
+    'weekdayTime': '15:15-16:15',
+    'weekendTime': '14:50-15:50'
+}, {
+    'id': 7,
+    'weekdayTime': '16:20-17:20',
+    'weekendTime': '16:00-17:00'
+}, {
+    'id': 8,
+    'weekdayTime': '17:25-18:25',
+    'weekendTime': '17:10-18:10'
+}, {
+    'id': 9,
+    'weekdayTime': '18:30-19:30',
+    'weekendTime': '18:20-19:20'
+}, {
+    'id': 10,
+    'weekdayTime': '19:35-20:35',
+    'weekendTime': '19:30-20:30'
+}, {
+    'id': 11,
+    'weekdayTime': '20:40-21:40',
+    'weekendTime': '20:40-21:40'
+}]
+
+SUBJECTS_DATA = [
+    # 小学生
+    {
+        'name': '国語(小学)',
+        'display_name': '国語',
+        'level': '小学'
+    },
+    {
+        'name': '算数(小学)',
+        'display_name': '算数',
+        'level': '小学'
+    },
+    {
+        'name': '理科(小学)',
+        'display_name': '理科',
+        'level': '小学'
+    },
+    {
+        'name': '社会(小学)',
+        'display_name': '社会',
+        'level': '小学'
+    },
+    # 中学生
+    {
+        'name': '国語(中学)',
+        'display_name': '国語',
+        'level': '中学'
+    },
+    {
+        'name': '数学(中学)',
+        'display_name': '数学',
+        'level': '中学'
+    },
+    {
+        'name': '理科(中学)',
+        'display_name': '理科',
+        'level': '中学'
+    },
+    {
+        'name': '社会(中学)',
+        'display_name': '社会',
+        'level': '中学'
+    },
+    {
+        'name': '英語(中学)',
+        'display_name': '英語',
+        'level': '中学'
+    },
+    # 高校生
+    {
+        'name': '現代文',
+        'display_name': '現文',
+        'level': '高校'
+    },
+    {
+        'name': '古文',
+        'display_name': '古文',
+        'level': '高校'
+    },
+    {
+        'name': '数学I/A',
+        'display_name': '数IA',
+        'level': '高校'
+    },
+    {
+        'name': '数学II/B',
+        'display_name': '数IIB',
+        'level': '高校'
+    },
+    {
+        'name': '数学III',
+        'display_name': '数III',
+        'level': '高校'
+    },
+    {
+        'name': '英語(高校)',
+        'display_name': '英語',
+        'level': '高校'
+    },
+    {
+        'name': '物理',
+        'display_name': '物理',
+        'level': '高校'
+    },
+    {
+        'name': '化学',
+        'display_name': '化学',
+        'level': '高校'
+    },
+    {
+        'name': '生物',
+        'display_name': '生物',
+        'level': '高校'
+    },
+]
+
+
+def create_time_slots():
+    for ts_data in TIME_SLOTS_DATA:
+        ts = TimeSlot(id=ts_data['id'],
+                      weekday_time=ts_data['weekdayTime'],
+                      weekendTime=ts_data['weekendTime'])
+        db.session.add(ts)
+    db.session.commit()
+
+
+def create_subjects():
+    """科目を作成し、{科目名: Subject} を返す"""
+    subjects = {}
+    for sub_data in SUBJECTS_DATA:
+        sub = Subject(name=sub_data['name'],
+                      display_name=sub_data['display_name'],
+                      level=sub_data['level'])
+        db.session.add(sub)
+        subjects[sub_data['name']] = sub
+    db.session.commit()
+    return subjects
+
 
 # --- ここからスクリプト本体 ---
 def seed_data():
@@ -24,165 +190,13 @@ def seed_data():
 
         # --- 1. 時間スロットデータの作成 (変更なし) ---
         print("時間スロットを作成します...")
-        time_slots_data = [{
-            'id': 1,
-            'weekdayTime': '9:00-10:00',
-            'weekendTime': '9:00-10:00'
-        }, {
-            'id': 2,
-            'weekdayTime': '10:10-11:10',
-            'weekendTime': '10:10-11:10'
-        }, {
-            'id': 3,
-            'weekdayTime': '11:20-12:20',
-            'weekendTime': '11:20-12:20'
-        }, {
-            'id': 4,
-            'weekdayTime': '12:30-13:30',
-            'weekendTime': '12:30-13:30'
-        }, {
-            'id': 5,
-            'weekdayTime': '14:10-15:10',
-            'weekendTime': '13:40-14:40'
-        }, {
-            'id': 6,
-            'weekdayTime': '15:15-16:15',
-            'weekendTime': '14:50-15:50'
-        }, {
-            'id': 7,
-            'weekdayTime': '16:20-17:20',
-            'weekendTime': '16:00-17:00'
-        }, {
-            'id': 8,
-            'weekdayTime': '17:25-18:25',
-            'weekendTime': '17:10-18:10'
-        }, {
-            'id': 9,
-            'weekdayTime': '18:30-19:30',
-            'weekendTime': '18:20-19:20'
-        }, {
-            'id': 10,
-            'weekdayTime': '19:35-20:35',
-            'weekendTime': '19:30-20:30'
-        }, {
-            'id': 11,
-            'weekdayTime': '20:40-21:40',
-            'weekendTime': '20:40-21:40'
-        }]
-        for ts_data in time_slots_data:
-            ts = TimeSlot(id=ts_data['id'],
-                          weekday_time=ts_data['weekdayTime'],
-                          weekendTime=ts_data['weekendTime'])
-            db.session.add(ts)
-        db.session.commit()
+        create_time_slots()
 
         # --- 2. 科目・講師・生徒の基本データ作成 ---
         print("科目、講師、生徒の基本データを作成します...")
 
         # ▼▼▼ 科目データを全面的に修正 ▼▼▼
-        subjects_data = [
-            # 小学生
-            {
-                'name': '国語(小学)',
-                'display_name': '国語',
-                'level': '小学'
-            },
-            {
-                'name': '算数(小学)',
-                'display_name': '算数',
-                'level': '小学'
-            },
-            {
-                'name': '理科(小学)',
-                'display_name': '理科',
-                'level': '小学'
-            },
-            {
-                'name': '社会(小学)',
-                'display_name': '社会',
-                'level': '小学'
-            },
-            # 中学生
-            {
-                'name': '国語(中学)',
-                'display_name': '国語',
-                'level': '中学'
-            },
-            {
-                'name': '数学(中学)',
-                'display_name': '数学',
-                'level': '中学'
-            },
-            {
-                'name': '理科(中学)',
-                'display_name': '理科',
-                'level': '中学'
-            },
-            {
-                'name': '社会(中学)',
-                'display_name': '社会',
-                'level': '中学'
-            },
-            {
-                'name': '英語(中学)',
-                'display_name': '英語',
-                'level': '中学'
-            },
-            # 高校生
-            {
-                'name': '現代文',
-                'display_name': '現文',
-                'level': '高校'
-            },
-            {
-                'name': '古文',
-                'display_name': '古文',
-                'level': '高校'
-            },
-            {
-                'name': '数学I/A',
-                'display_name': '数IA',
-                'level': '高校'
-            },
-            {
-                'name': '数学II/B',
-                'display_name': '数IIB',
-                'level': '高校'
-            },
-            {
-                'name': '数学III',
-                'display_name': '数III',
-                'level': '高校'
-            },
-            {
-                'name': '英語(高校)',
-                'display_name': '英語',
-                'level': '高校'
-            },
-            {
-                'name': '物理',
-                'display_name': '物理',
-                'level': '高校'
-            },
-            {
-                'name': '化学',
-                'display_name': '化学',
-                'level': '高校'
-            },
-            {
-                'name': '生物',
-                'display_name': '生物',
-                'level': '高校'
-            },
-        ]
-        subjects = {}
-        for sub_data in subjects_data:
-            sub = Subject(name=sub_data['name'],
-                          display_name=sub_data['display_name'],
-                          level=sub_data['level'])
-            db.session.add(sub)
-            subjects[sub_data['name']] = sub
-        db.session.commit()
+        subjects = create_subjects()
 
         # ▼▼▼ 担当科目を新しい定義に合わせる ▼▼▼
         t1 = Teacher(name='田中先生',
@@ -358,6 +372,8 @@ def seed_data():
             assignment2.lessons.append(lesson2)
             db.session.add(assignment2)
         db.session.commit()
+        # 起動中のサーバーが作り直す前のデータのキャッシュを返さないようにする
+        revisions.bump_all()
 
         print("\n✅ データベースに初期データを投入しました。")
         print(f"作成された計画期間: {test_period.name}")
@@ -0,0 +1,179 @@
+# shifts.py (講師シフトの差分保存と一括インポート)
+
+import csv
+import io
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete
+
+import bulk
+from extensions import db
+from models import Shift, Teacher, TimeSlot
+
+# インポートで「出勤可」とみなす値 (小文字で比較する)
+TRUE_VALUES = {'1', 'true', 'yes', 'ok', '○', '◯'}
+FALSE_VALUES = {'0', 'false', 'no', '×', '✕', ''}
+
+# INSERT ... ON CONFLICT に使う一意インデックス (migrate.py を実行する前の DB には無い)
+UPSERT_INDEX = 'uq_shift_teacher_date_slot'
+
+
+def has_upsert_index():
+    """shift テーブルに UPSERT_INDEX があるか (アプリケーションコンテキスト内で呼ぶ)
+
+    テーブルがまだ無ければ、db.create_all() でインデックスごと作られるので True を返す。
+    """
+    inspector = db.inspect(db.engine)
+    if not inspector.has_table(Shift.__tablename__):
+        return True
+    return any(index['name'] == UPSERT_INDEX
+               for index in inspector.get_indexes(Shift.__tablename__))
+
+
+def period_shifts_query(period, teacher_ids):
+    """teacher_ids の講師の期間内のシフト (出勤不可の行も含む) を読むクエリ"""
+    return db.session.query(
+        Shift.id, Shift.teacher_id, Shift.date, Shift.time_slot_id,
+        Shift.is_available).filter(
+            Shift.teacher_id.in_(teacher_ids),
+            Shift.date.between(period.start_date, period.end_date))
+
+
+def load_period_shifts(period, teacher_ids):
+    """(teacher_id, date, time_slot_id) -> (id, is_available) を返す"""
+    rows = period_shifts_query(period, teacher_ids).all()
+    return {(row.teacher_id, row.date, row.time_slot_id):
+            (row.id, row.is_available)
+            for row in rows}
+
+
+def apply_shifts(period, desired, teacher_ids, replace=True):
+    """desired ({(teacher_id, date, time_slot_id): is_available}) を DB に反映する
+
+    replace=True なら、teacher_ids の講師の期間内シフトのうち desired に無いものを
+    削除する。変更のあった行だけを DELETE と INSERT ... ON CONFLICT で書き込む。
+    一意インデックスの無い DB (app.config['SHIFT_UPSERT'] が False) では、
+    更新する行も DELETE してから INSERT する。
+    出勤可否が変わったセル (teacher_id, date, time_slot_id) の集合を返す。
+    """
+    existing = load_period_shifts(period, teacher_ids)
+
+    removed_ids = []
+    changed_cells = set()
+    if replace:
+        for cell, (shift_id, is_available) in existing.items():
+            if cell not in desired:
+                removed_ids.append(shift_id)
+                if is_available:
+                    changed_cells.add(cell)
+
+    upserts = []
+    # 出勤可否を書き換える既存の行の id
+    updated_ids = []
+    for cell, is_available in desired.items():
+        current = existing.get(cell)
+        if current is not None and current[1] == is_available:
+            continue
+        if current is not None:
+            updated_ids.append(current[0])
+        if is_available or current is not None:
+            changed_cells.add(cell)
+        teacher_id, date, time_slot_id = cell
+        upserts.append({
+            'teacher_id': teacher_id,
+            'date': date,
+            'time_slot_id': time_slot_id,
+            'is_available': is_available
+        })
+    upserts.sort(key=lambda row: (row['teacher_id'], row['date'],
+                                  row['time_slot_id']))
+
+    upsert = current_app.config.get('SHIFT_UPSERT', True)
+    deleted_ids = removed_ids if upsert else removed_ids + updated_ids
+    if deleted_ids:
+        db.session.execute(
+            delete(Shift).where(Shift.id.in_(deleted_ids)))
+    if upsert:
+        bulk.upsert_rows(Shift.__table__, upserts,
+                         ['teacher_id', 'date', 'time_slot_id'],
+                         ['is_available'])
+    else:
+        bulk.insert_rows(Shift.__table__, upserts)
+    current_app.logger.info(
+        f"シフトを保存しました: 追加・更新 {len(upserts)}件, 削除 {len(removed_ids)}件")
+    return changed_cells
+
+
+def parse_availability(value):
+    """インポートの出勤可否の値を bool にする。解釈できなければ None"""
+    if isinstance(value, bool):
+        return value
+    text = str(value if value is not None else '').strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    return None
+
+
+def read_import_rows(request):
+    """リクエストの本文 (JSON または CSV) から、インポートする行の dict のリストを取り出す
+
+    JSON は {"shifts": [{...}, ...]}、CSV はヘッダー付きで
+    teacher_id (または teacher_name), date, time_slot_id, is_available の列を持つ。
+    """
+    upload = request.files.get('file')
+    if upload is not None:
+        text = upload.read().decode('utf-8-sig')
+    elif request.is_json:
+        return list((request.get_json() or {}).get('shifts', []))
+    else:
+        text = request.get_data(as_text=True)
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def build_import(period, rows):
+    """インポートする行を検証し、(desired, teacher_ids, errors) を返す
+
+    errors は (行番号, メッセージ) のリスト。行番号はデータの1行目を1とする。
+    """
+    teachers_by_name = {}
+    teacher_ids = set()
+    for teacher_id, name in db.session.query(Teacher.id, Teacher.name):
+        teacher_ids.add(teacher_id)
+        teachers_by_name[name] = teacher_id
+    time_slot_ids = {ts_id for (ts_id, ) in db.session.query(TimeSlot.id)}
+
+    desired = {}
+    imported_teachers = set()
+    errors = []
+    for line, row in enumerate(rows, start=1):
+        try:
+            if row.get('teacher_id') not in (None, ''):
+                teacher_id = int(row['teacher_id'])
+            else:
+                teacher_id = teachers_by_name.get(
+                    (row.get('teacher_name') or '').strip())
+            if teacher_id not in teacher_ids:
+                errors.append((line, '講師が見つかりません。'))
+                continue
+            date = datetime.strptime(str(row['date']).strip(),
+                                     '%Y-%m-%d').date()
+            time_slot_id = int(row['time_slot_id'])
+        except (KeyError, TypeError, ValueError):
+            errors.append((line, '講師・日付 (YYYY-MM-DD)・時限の形式が正しくありません。'))
+            continue
+        if not period.start_date <= date <= period.end_date:
+            errors.append((line, '日付が計画期間外です。'))
+            continue
+        if time_slot_id not in time_slot_ids:
+            errors.append((line, '時限が見つかりません。'))
+            continue
+        is_available = parse_availability(row.get('is_available', True))
+        if is_available is None:
+            errors.append((line, '出勤可否の値が正しくありません。'))
+            continue
+        desired[(teacher_id, date, time_slot_id)] = is_available
+        imported_teachers.add(teacher_id)
+    return desired, imported_teachers, errors
@@ -28,12 +28,20 @@ document.addEventListener('DOMContentLoaded', () => {
         cancelBtn: document.getElementById('cancel-auto-assign-btn'),
         loadingOverlay: document.getElementById('loading-overlay'),
         loadingProgress: document.getElementById('loading-progress'),
+        loadingDetail: document.getElementById('loading-detail'),
+        cancelJobBtn: document.getElementById('cancel-job-btn'),
         // オプション入力要素
         enableIntervalRule: document.getElementById('enable-interval-rule'),
         intervalDays: document.getElementById('interval-days'),
         intervalStrength: document.getElementById('interval-strength'),
         enablePreferredRule: document.getElementById('enable-preferred-rule'),
-        preferredStrength: document.getElementById('preferred-strength')
+        preferredStrength: document.getElementById('preferred-strength'),
+        assignMode: document.getElementById('assign-mode'),
+        solverSelect: document.getElementById('solver-select'),
+        solverTimeLimit: document.getElementById('solver-time-limit'),
+        improveSeconds: document.getElementById('improve-seconds'),
+        multiStart: document.getElementById('multi-start'),
+        precheckResult: document.getElementById('precheck-result')
     };
 
     // --- 状態管理 ---
@@ -42,6 +50,7 @@ document.addEventListener('DOMContentLoaded', () => {
     let activeTeacherIds = [];
     let selection = { mode: 'add', studentId: null, subjectId: null, lessonId: null, element: null };
     let placementInfo = {};
+    let suggestionRequestSeq = 0; // 配置候補の取得が前後した場合に古い結果を捨てるための番号
     let isLockMode = false
     let activeGradeFilter = 'all';
     const timeSlotsMaster = [ { id: 1, weekday: '9:00-10:00', weekend: '9:00-10:00' }, { id: 2, weekday: '10:10-11:10', weekend: '10:10-11:10' }, { id: 3, weekday: '11:20-12:20', weekend: '11:20-12:20' }, { id: 4, weekday: '12:30-13:30', weekend: '12:30-13:30' }, { id: 5, weekday: '14:10-15:10', weekend: '13:40-14:40' }, { id: 6, weekday: '15:15-16:15', weekend: '14:50-15:50' }, { id: 7, weekday: '16:20-17:20', weekend: '16:00-17:00' }, { id: 8, weekday: '17:25-18:25', weekend: '17:10-18:10' }, { id: 9, weekday: '18:30-19:30', weekend: '18:20-19:20' }, { id: 10, weekday: '19:35-20:35', weekend: '19:30-20:30' }, { id: 11, weekday: '20:40-21:40', weekend: '20:40-21:40' } ];
@@ -52,9 +61,9 @@ document.addEventListener('DOMContentLoaded', () => {
             return;
         }
         try {
-            const response = await fetch(`/api/planner-data/${periodId}`);
+            const response = await fetch(`/api/planner-data/${periodId}?format=compact`);
             if (!response.ok) throw new Error('プランナーデータの取得に失敗しました。');
-            plannerData = await response.json();
+            plannerData = decodePlannerData(await response.json());
             renderTeacherFilter();
             activeTeacherIds = plannerData.teachers.map(t => t.id);
             updateTeacherFilterUI();
@@ -66,6 +75,126 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // ▼▼▼ コンパクト形式 (列指向の配列) を通常の形式に展開する ▼▼▼
+    function decodePlannerData(data) {
+        if (data.format !== 'compact') return data;
+
+        const [year, month, day] = data.period.start_date.split('-').map(Number);
+        const dateCache = {};
+        const dateOf = (offset) => {
+            if (!(offset in dateCache)) {
+                dateCache[offset] = new Date(Date.UTC(year, month - 1, day + offset)).toISOString().slice(0, 10);
+            }
+            return dateCache[offset];
+        };
+        const { students, subjects, teachers } = data;
+
+        const assignments = {};
+        const assignmentList = data.assignments.day.map((offset, i) => {
+            const teacher = teachers[data.assignments.teacher[i]];
+            const assignment = {
+                teacher_id: teacher ? teacher.id : null,
+                teacher_name: teacher ? teacher.display_name : '不明',
+                lessons: []
+            };
+            const key = `${dateOf(offset)}-${data.assignments.slot[i]}`;
+            (assignments[key] = assignments[key] || []).push(assignment);
+            return assignment;
+        });
+        data.lessons.id.forEach((lessonId, i) => {
+            const s = data.lessons.student[i];
+            const sub = data.lessons.subject[i];
+            assignmentList[data.lessons.assignment[i]].lessons.push({
+                id: lessonId,
+                status: data.statuses[data.lessons.status[i]],
+                student_id: s >= 0 ? students.id[s] : null,
+                student_name: s >= 0 ? students.display_name[s] : '不明',
+                subject_id: sub >= 0 ? subjects.id[sub] : null,
+                subject_name: sub >= 0 ? subjects.name[sub] : '不明'
+            });
+        });
+
+        const shifts = {};
+        data.shifts.day.forEach((offset, i) => {
+            const teacher = teachers[data.shifts.teacher[i]];
+            if (teacher) shifts[`${dateOf(offset)}-${teacher.id}-${data.shifts.slot[i]}`] = true;
+        });
+
+        const unassignedLessons = data.unassigned.count.map((count, i) => {
+            const s = data.unassigned.student[i];
+            const sub = data.unassigned.subject[i];
+            return {
+                count,
+                student_id: s >= 0 ? students.id[s] : null,
+                subject_id: sub >= 0 ? subjects.id[sub] : null,
+                student_name: s >= 0 ? students.name[s] : '不明',
+                student_grade: s >= 0 ? students.grade[s] : '不明',
+                subject_name: sub >= 0 ? subjects.name[sub] : '不明'
+            };
+        });
+
+        return {
+            period: data.period,
+            teachers,
+            version: data.version,
+            assignments,
+            shifts,
+            unassigned_lessons: unassignedLessons
+        };
+    }
+
+    // ▼▼▼ 前回取得したバージョン以降の変更だけを取得して反映する ▼▼▼
+    async function syncPlanner() {
+        if (plannerData.version === undefined) return initializePlanner();
+        try {
+            const params = new URLSearchParams({ version: plannerData.version });
+            const response = await fetch(`/api/planner-data/${periodId}/changes?${params}`);
+            if (!response.ok) throw new Error('プランナーの差分データの取得に失敗しました。');
+            const changes = await response.json();
+            if (changes.reset) return initializePlanner();
+            applyPlannerChanges(changes);
+            renderAll();
+        } catch (error) {
+            console.error(error);
+            initializePlanner();
+        }
+    }
+
+    function applyPlannerChanges(changes) {
+        // コマ単位で置き換え、空になったコマは削除する
+        Object.entries(changes.assignments).forEach(([key, assignmentsInSlot]) => {
+            if (assignmentsInSlot.length > 0) {
+                plannerData.assignments[key] = assignmentsInSlot;
+            } else {
+                delete plannerData.assignments[key];
+            }
+        });
+        Object.entries(changes.shifts).forEach(([key, isAvailable]) => {
+            if (isAvailable) {
+                plannerData.shifts[key] = true;
+            } else {
+                delete plannerData.shifts[key];
+            }
+        });
+        if (changes.unassigned_lessons.length > 0) {
+            const changed = new Map(changes.unassigned_lessons.map(u => [`${u.student_id}-${u.subject_id}`, u]));
+            const merged = [];
+            plannerData.unassigned_lessons.forEach(u => {
+                const key = `${u.student_id}-${u.subject_id}`;
+                const update = changed.get(key);
+                if (!update) {
+                    merged.push(u);
+                    return;
+                }
+                changed.delete(key);
+                if (update.count > 0) merged.push(update);
+            });
+            changed.forEach(u => { if (u.count > 0) merged.push(u); });
+            plannerData.unassigned_lessons = merged;
+        }
+        plannerData.version = changes.version;
+    }
+
     function renderAll() {
         renderCalendar();
         renderUnassignedLessons();
@@ -314,8 +443,47 @@ document.addEventListener('DOMContentLoaded', () => {
     // ▼▼▼ 自動配置モーダルを開く ▼▼▼
     autoAssign.openModalBtn.addEventListener('click', () => {
         autoAssign.modal.classList.remove('hidden');
+        runPrecheck();
     });
 
+    // ▼▼▼ リクエストがシフトに収まるかを事前に確認して表示する ▼▼▼
+    async function runPrecheck() {
+        const box = autoAssign.precheckResult;
+        box.textContent = '確認中...';
+        try {
+            const response = await fetch(`/api/period/${periodId}/precheck`);
+            const result = await response.json();
+            if (!response.ok) throw new Error(result.error || '事前チェックに失敗しました。');
+
+            const lines = [`配置するレッスン ${result.demand}コマ / 講師の空き席 ${result.seats}席 (配置できる上限 ${result.upper_bound}コマ)`];
+            if (result.shortfall > 0) {
+                lines.push(`⚠ 少なくとも ${result.shortfall}コマは配置できません。`);
+                const subjects = result.subjects.filter(s => s.shortfall > 0).slice(0, 5);
+                if (subjects.length > 0) {
+                    lines.push('不足している科目: ' + subjects.map(s => `${s.name} (${s.shortfall})`).join(', '));
+                }
+                const students = result.students.slice(0, 5);
+                if (students.length > 0) {
+                    lines.push('不足している生徒: ' + students.map(s => `${s.student_name} ${s.subject_name} (${s.shortfall})`).join(', '));
+                }
+                if (result.dates.length > 0) {
+                    lines.push('席の少ない日: ' + result.dates.slice(0, 5).map(d => `${d.date} (${d.seats}席)`).join(', '));
+                }
+            } else {
+                lines.push('✔ シフトの席数の上では全てのレッスンを配置できます。');
+            }
+            box.innerHTML = '';
+            lines.forEach(line => {
+                const p = document.createElement('p');
+                p.textContent = line;
+                box.appendChild(p);
+            });
+        } catch (error) {
+            box.textContent = `事前チェックに失敗しました: ${error.message}`;
+            console.error(error);
+        }
+    }
+
     // ▼▼▼ 自動配置モーダルを閉じる ▼▼▼
     autoAssign.cancelBtn.addEventListener('click', () => {
         autoAssign.modal.classList.add('hidden');
@@ -336,8 +504,21 @@ document.addEventListener('DOMContentLoaded', () => {
             if (autoAssign.enablePreferredRule.checked) {
                 options.preferred_strength = autoAssign.preferredStrength.value;
             }
+            options.mode = autoAssign.assignMode.value;
+            options.solver = autoAssign.solverSelect.value;
+            if (options.solver === 'cpsat') {
+                options.solver_time_limit = parseInt(autoAssign.solverTimeLimit.value, 10);
+            }
+            const improveSeconds = parseInt(autoAssign.improveSeconds.value, 10);
+            if (improveSeconds > 0) {
+                options.improve_seconds = improveSeconds;
+            }
+            const multiStart = parseInt(autoAssign.multiStart.value, 10);
+            if (options.solver === 'greedy' && multiStart > 1) {
+                options.multi_start = multiStart;
+            }
 
-            // APIを呼び出し
+            // APIを呼び出し (ジョブとして登録される)
             const response = await fetch('/api/planner/auto-assign', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
@@ -345,18 +526,83 @@ document.addEventListener('DOMContentLoaded', () => {
             });
             const result = await response.json();
             if (!response.ok) throw new Error(result.error || '自動配置に失敗しました。');
-            
-            alert('自動配置が完了しました！');
-            initializePlanner();
+
+            const job = await watchAutoAssignJob(result.job_id);
+            if (job.status === 'completed') {
+                alert(`自動配置が完了しました！ (今回の配置 ${job.result.placed}コマ, 未配置 ${job.result.unplaced}コマ)`);
+            } else if (job.status === 'cancelled') {
+                alert('自動配置を中止しました。');
+            } else {
+                throw new Error(job.error || '自動配置に失敗しました。');
+            }
+            syncPlanner();
 
         } catch (error) {
             alert(`エラーが発生しました: ${error.message}`);
             console.error(error);
         } finally {
             autoAssign.loadingOverlay.classList.add('hidden');
+            autoAssign.cancelJobBtn.onclick = null;
             resetSelection();
         }
     });
+
+    // ▼▼▼ 自動配置ジョブの進捗を SSE で受け取り、終了したら最終状態を返す ▼▼▼
+    const jobPhaseLabels = {
+        cleanup: '既存の自動配置を整理中',
+        placing: 'レッスンを配置中',
+        solving: '最適化ソルバーで計算中',
+        multi_start: '複数の seed で試行中',
+        improving: '局所探索で改善中',
+        writing: '結果を保存中'
+    };
+
+    function renderJobProgress(job) {
+        const total = job.total || 0;
+        const percent = total > 0 ? Math.floor(job.processed / total * 100) : 0;
+        autoAssign.loadingProgress.textContent = total > 0 ? `${percent}%` : '';
+        const phase = jobPhaseLabels[job.phase] || (job.status === 'queued' ? '実行待ち' : '自動配置を実行中');
+        const counts = job.phase === 'multi_start'
+            ? `試行 ${job.processed}/${total} 回`
+            : `処理 ${job.processed}/${total} レッスン, 配置 ${job.placed}コマ`;
+        autoAssign.loadingDetail.textContent = `${phase}... (${counts}, 経過 ${job.elapsed.toFixed(1)}秒)`;
+    }
+
+    function watchAutoAssignJob(jobId) {
+        autoAssign.loadingProgress.textContent = '';
+        autoAssign.loadingDetail.textContent = '自動配置を実行中...';
+        autoAssign.cancelJobBtn.disabled = false;
+        autoAssign.cancelJobBtn.onclick = async () => {
+            autoAssign.cancelJobBtn.disabled = true;
+            autoAssign.loadingDetail.textContent = '中止しています...';
+            await fetch(`/api/planner/jobs/${jobId}/cancel`, { method: 'POST' });
+        };
+
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`/api/planner/jobs/${jobId}/stream`);
+            source.addEventListener('progress', (e) => renderJobProgress(JSON.parse(e.data)));
+            source.addEventListener('done', (e) => {
+                source.close();
+                resolve(JSON.parse(e.data));
+            });
+            source.onerror = async () => {
+                // 接続が切れた場合はステータスAPIで最終状態を確認する
+                source.close();
+                try {
+                    const response = await fetch(`/api/planner/jobs/${jobId}`);
+                    const job = await response.json();
+                    if (!response.ok) throw new Error(job.error || 'ジョブの状態を取得できませんでした。');
+                    if (['completed', 'failed', 'cancelled'].includes(job.status)) {
+                        resolve(job);
+                    } else {
+                        resolve(await watchAutoAssignJob(jobId));
+                    }
+                } catch (error) {
+                    reject(error);
+                }
+            };
+        });
+    }
     
     calendarContainer.addEventListener('click', async (e) => {
         const lessonEl = e.target.closest('.lesson-item');
@@ -417,7 +663,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     if (!response.ok) throw new Error(result.error || '削除に失敗しました。');
                     alert(result.message);
                     lessonEditModal.classList.add('hidden');
-                    initializePlanner();
+                    syncPlanner();
                 } catch (error) {
                     alert(`エラー: ${error.message}`);
                     console.error(error);
@@ -514,8 +760,10 @@ document.addEventListener('DOMContentLoaded', () => {
     function highlightSlots() {
         // 既存のハイライトをすべてクリア
         document.querySelectorAll('td[class*="-slot"], td[class*="-highlight"]').forEach(cell => {
-            cell.className = cell.className.replace(/possible-slot|empty-and-possible|shift-highlight|dense-\d/g, '').trim();
+            cell.className = cell.className.replace(/possible-slot|empty-and-possible|shift-highlight|suggested-slot|dense-\d/g, '').trim();
             delete cell.dataset.availableTeacherIds;
+            delete cell.dataset.suggestRank;
+            cell.removeAttribute('title');
         });
 
         const allCells = document.querySelectorAll('#calendar-container td[data-date]');
@@ -540,6 +788,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     }
                 }
             });
+            highlightSuggestions();
         } 
         
         // --- レッスン未選択時（シフト確認モード）---
@@ -561,6 +810,60 @@ document.addEventListener('DOMContentLoaded', () => {
             });
         }
     }
+
+    // --- 選択中のレッスンの配置候補 (自動配置と同じ採点の上位) に順位を付ける ---
+    async function highlightSuggestions() {
+        const seq = ++suggestionRequestSeq;
+        const params = new URLSearchParams({
+            student_id: selection.studentId,
+            subject_id: selection.subjectId,
+            k: 10
+        });
+        if (selection.mode === 'move' && selection.lessonId) {
+            params.set('lesson_id', selection.lessonId);
+        }
+        // ルールは自動配置モーダルの設定を使う
+        if (autoAssign.enableIntervalRule.checked) {
+            params.set('subject_interval_days', autoAssign.intervalDays.value);
+            params.set('interval_strength', autoAssign.intervalStrength.value);
+        }
+        if (autoAssign.enablePreferredRule.checked) {
+            params.set('preferred_strength', autoAssign.preferredStrength.value);
+        }
+
+        try {
+            const response = await fetch(`/api/period/${periodId}/suggestions?${params}`);
+            const result = await response.json();
+            if (!response.ok) throw new Error(result.error || '配置候補の取得に失敗しました。');
+            if (seq !== suggestionRequestSeq || !selection.studentId) return; // 選択が変わった
+
+            const teacherNames = Object.fromEntries(plannerData.teachers.map(t => [t.id, t.name]));
+            const suggestedCounts = new Map(); // セル -> そのセルの候補の講師数
+            let rank = 0;
+            result.suggestions.forEach(s => {
+                if (!activeTeacherIds.includes(s.teacher_id)) return;
+                const cell = document.querySelector(`#calendar-container td[data-date="${s.date}"][data-time-slot-id="${s.time_slot_id}"]`);
+                if (!cell || !cell.classList.contains('possible-slot')) return;
+                rank += 1;
+                const line = `${rank}位 ${teacherNames[s.teacher_id] || '不明な講師'} (${s.score}点${s.preferred ? ', 優先講師' : ''})`;
+                const count = suggestedCounts.get(cell) || 0;
+                if (count === 0) {
+                    cell.classList.add('suggested-slot');
+                    cell.dataset.suggestRank = rank;
+                    cell.title = line;
+                } else {
+                    cell.title += `\n${line}`;
+                }
+                // 講師選択で候補の講師が順位順に先頭に並ぶようにする
+                const teacherIds = cell.dataset.availableTeacherIds.split(',').filter(id => id !== String(s.teacher_id));
+                teacherIds.splice(count, 0, String(s.teacher_id));
+                cell.dataset.availableTeacherIds = teacherIds.join(',');
+                suggestedCounts.set(cell, count + 1);
+            });
+        } catch (error) {
+            console.error(error);
+        }
+    }
     
     // (updateRuleViolationHighlights, show...Modal, findLessonById, place/moveLesson は変更なし)
     function updateRuleViolationHighlights() {
@@ -690,7 +993,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const result = await response.json();
             if (!response.ok) throw new Error(result.error || '配置に失敗しました。');
             alert(result.message);
-            initializePlanner();
+            syncPlanner();
         } catch (error) {
             alert(`エラー: ${error.message}`);
         } finally {
@@ -733,7 +1036,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const result = await response.json();
             if (!response.ok) throw new Error(result.error || '移動に失敗しました。');
             alert(result.message);
-            initializePlanner();
+            syncPlanner();
         } catch (error) {
             alert(`エラー: ${error.message}`);
         } finally {
@@ -0,0 +1,159 @@
+# student_requests.py (授業リクエストの差分保存)
+
+from flask import current_app
+from sqlalchemy import bindparam, delete, insert, update
+
+from extensions import db
+from models import Lesson, Student, StudentRequest, Subject
+
+PRIORITIES = ('HIGH', 'MEDIUM', 'LOW')
+DEFAULT_PRIORITY = 'MEDIUM'
+
+
+def parse_payload(payload):
+    """{"生徒ID-科目ID": 回数 または {"count": 回数, "priority": 優先度}} を検証する
+
+    (desired, results) を返す。desired は (student_id, subject_id) -> (回数, 優先度 or None)、
+    results は形式が正しくない行の結果のリスト。
+    """
+    student_ids = {s_id for (s_id, ) in db.session.query(Student.id)}
+    subject_ids = {s_id for (s_id, ) in db.session.query(Subject.id)}
+
+    desired = {}
+    results = []
+    for key, value in payload.items():
+        try:
+            student_id, subject_id = (int(part) for part in key.split('-'))
+            if isinstance(value, dict):
+                count = int(value.get('count', 0))
+                priority = value.get('priority')
+            else:
+                count, priority = int(value), None
+        except (AttributeError, TypeError, ValueError):
+            results.append(_error(key, 'キーは「生徒ID-科目ID」、値は回数で指定してください。'))
+            continue
+        if student_id not in student_ids or subject_id not in subject_ids:
+            results.append(_error(key, '生徒または科目が見つかりません。'))
+        elif count < 0:
+            results.append(_error(key, '回数は0以上で指定してください。'))
+        elif priority is not None and priority not in PRIORITIES:
+            results.append(_error(key, f"優先度は {', '.join(PRIORITIES)} のいずれかです。"))
+        else:
+            desired[(student_id, subject_id)] = (count, priority)
+    return desired, results
+
+
+def apply_requests(period_id, desired):
+    """desired を期間のリクエストと突き合わせ、追加・更新・削除をまとめて書き込む
+
+    既存の行は id と優先度 (指定が無い場合) を保ったまま回数だけを更新する。
+    desired に無い (または回数0の) 行は削除するが、レッスンが紐付いている行は
+    紐付けを残すため回数0にする。
+    (行ごとの結果のリスト, 回数・優先度が変わった (student_id, subject_id) の集合) を返す。
+    """
+    existing = {(req.student_id, req.subject_id): req
+                for req in db.session.query(
+                    StudentRequest.id, StudentRequest.student_id,
+                    StudentRequest.subject_id, StudentRequest.requested_lessons,
+                    StudentRequest.priority).filter(
+                        StudentRequest.planning_period_id == period_id)}
+
+    results = []
+    inserts = []
+    updates = []
+    removals = []
+    for group, (count, priority) in desired.items():
+        current = existing.get(group)
+        if current is None:
+            if count > 0:
+                inserts.append({
+                    'student_id': group[0],
+                    'subject_id': group[1],
+                    'requested_lessons': count,
+                    'priority': priority or DEFAULT_PRIORITY,
+                    'planning_period_id': period_id
+                })
+            else:
+                results.append(_result(group, 'unchanged', None, 0, priority))
+            continue
+        if count == 0:
+            removals.append(current)
+            continue
+        priority = priority or current.priority
+        if (count, priority) == (current.requested_lessons, current.priority):
+            results.append(_result(group, 'unchanged', current.id, count,
+                                   priority))
+            continue
+        updates.append({
+            'request_id': current.id,
+            'new_count': count,
+            'new_priority': priority
+        })
+        results.append(_result(group, 'updated', current.id, count, priority))
+    removals += [req for group, req in existing.items() if group not in desired]
+
+    # レッスンが紐付いている行は削除せずに回数0にする
+    linked_ids = set()
+    if removals:
+        linked_ids = {
+            request_id
+            for (request_id, ) in db.session.query(Lesson.request_id).filter(
+                Lesson.request_id.in_([req.id for req in removals])).distinct()
+        }
+    deleted_ids = []
+    for req in removals:
+        group = (req.student_id, req.subject_id)
+        if req.id in linked_ids and req.requested_lessons == 0:
+            results.append(
+                _result(group, 'unchanged', req.id, 0, req.priority))
+        elif req.id in linked_ids:
+            updates.append({
+                'request_id': req.id,
+                'new_count': 0,
+                'new_priority': req.priority
+            })
+            results.append(_result(group, 'zeroed', req.id, 0, req.priority))
+        else:
+            deleted_ids.append(req.id)
+            results.append(_result(group, 'deleted', req.id, 0, req.priority))
+
+    table = StudentRequest.__table__
+    if deleted_ids:
+        db.session.execute(delete(table).where(table.c.id.in_(deleted_ids)))
+    if updates:
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('request_id')).values(
+                requested_lessons=bindparam('new_count'),
+                priority=bindparam('new_priority')), updates)
+    if inserts:
+        inserted = db.session.execute(
+            insert(table).returning(table.c.id, sort_by_parameter_order=True),
+            inserts)
+        for row, (request_id, ) in zip(inserts, inserted):
+            results.append(
+                _result((row['student_id'], row['subject_id']), 'inserted',
+                        request_id, row['requested_lessons'], row['priority']))
+    current_app.logger.info(
+        f"リクエストを保存しました: 追加 {len(inserts)}件, 更新 {len(updates)}件, "
+        f"削除 {len(deleted_ids)}件")
+
+    changed_groups = {(result['student_id'], result['subject_id'])
+                      for result in results
+                      if result['status'] != 'unchanged'}
+    return results, changed_groups
+
+
+def _result(group, status, request_id, count, priority):
+    return {
+        'key': f"{group[0]}-{group[1]}",
+        'student_id': group[0],
+        'subject_id': group[1],
+        'status': status,
+        'request_id': request_id,
+        'requested_lessons': count,
+        'priority': priority
+    }
+
+
+def _error(key, message):
+    return {'key': key, 'status': 'error', 'message': message}
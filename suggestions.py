@@ -0,0 +1,141 @@
+# suggestions.py (1レッスン分の配置候補の提案)
+#
+# プランナーでレッスンを選んだときに、生徒・科目を配置できる (講師, 日付, 時限) を
+# 自動配置と同じ採点 (scoring.py) で並べ、上位 k 件を返す。貪欲法と同じく、
+# 点数が scoring.REJECT_SCORE 以下の候補は配置できるコマでも提案しない。
+# 配置できるかどうかは期間の空き状況のビットセット (availability.get_cached_model) で判定し、
+# DB からはこの生徒の同じ科目のレッスン日と優先講師だけを読む。
+# 同点なら貪欲法と同じく日付・時限・講師の順で前のものを上位にする。
+
+import itertools
+
+from availability import get_cached_model, iter_bits
+from extensions import db
+from models import Assignment, Lesson, student_preferred_teachers
+import scoring
+
+DEFAULT_K = 10
+MAX_K = 100
+
+
+def _ranked(candidates_by_score):
+    """(点数, セル, teacher_id) を点数の高い順、同点なら日付・時限・講師の順に返す"""
+    for score in sorted(candidates_by_score, reverse=True):
+        candidates = candidates_by_score[score]
+        union = 0
+        for _, bits in candidates:
+            union |= bits
+        for cell in iter_bits(union):
+            for teacher_id, bits in candidates:
+                if bits >> cell & 1:
+                    yield score, cell, teacher_id
+
+
+def suggest_slots(period, student_id, subject_id, options, k=DEFAULT_K,
+                  lesson_id=None):
+    """配置候補を点数の高い順に k 件返す (feasible_count は提案できる候補の総数)
+
+    options は自動配置と同じ形式 ('subject_interval_days' / 'interval_strength' /
+    'preferred_strength')。lesson_id を指定すると、そのレッスンを移動する前提で
+    今のコマを空きとして扱い、今と同じコマは候補から外す。
+    """
+    model = get_cached_model(period)
+    k = max(1, min(int(k), MAX_K))
+
+    # 移動するレッスンの今のコマ
+    current = None
+    if lesson_id:
+        current = db.session.query(
+            Assignment.teacher_id, Assignment.date,
+            Assignment.time_slot_id).join(
+                Lesson, Lesson.assignment_id == Assignment.id).filter(
+                    Lesson.id == lesson_id).first()
+    current_cell = model.cell_of(current[1],
+                                 current[2]) if current else None
+
+    student_free = model.student_free(student_id)
+    if current_cell is not None:
+        student_free |= 1 << current_cell
+    feasible = {}
+    for teacher_id in model.qualified_teachers(subject_id):
+        teacher_free = model.teacher_free(teacher_id)
+        if current_cell is not None and teacher_id == current[0]:
+            # 今のコマは自分が抜けても同じ場所なので候補にしない
+            teacher_free &= ~(1 << current_cell)
+        bits = teacher_free & student_free
+        if bits:
+            feasible[teacher_id] = bits
+
+    # 科目間隔ルール用: この生徒・科目のレッスン日 (移動するレッスン自身は除く)
+    interval_days = options.get('subject_interval_days')
+    lesson_dates = []
+    if interval_days is not None:
+        query = db.session.query(Assignment.date).join(
+            Lesson, Lesson.assignment_id == Assignment.id).filter(
+                Lesson.student_id == student_id,
+                Lesson.subject_id == subject_id)
+        if lesson_id:
+            query = query.filter(Lesson.id != lesson_id)
+        lesson_dates = sorted(date for (date, ) in query)
+    interval_strength = options.get('interval_strength', 'normal')
+
+    preferred_ids = set()
+    bonus = 0
+    if 'preferred_strength' in options:
+        preferred_ids = {
+            t_id
+            for (t_id, ) in db.session.query(
+                student_preferred_teachers.c.teacher_id).filter(
+                    student_preferred_teachers.c.student_id == student_id)
+        }
+        bonus = scoring.PREFERRED_BONUSES.get(options['preferred_strength'],
+                                              0)
+
+    # 点数は 日ごとの間隔の点数 + 優先講師のボーナス なので、日ごとに1回だけ計算し、
+    # 同じ点数になる日のセルをまとめたビットセットを点数の高い順に見ていく
+    n_slots = len(model.time_slot_ids)
+    day_cells = (1 << n_slots) - 1
+    day_intervals = []
+    cells_by_score = {}
+    for day in range(model.n_days):
+        score = scoring.BASE_SCORE
+        interval = None
+        if interval_days is not None:
+            day_date = model.cell_key(day * n_slots)[0]
+            interval = scoring.nearest_interval(lesson_dates, day_date)
+            score += scoring.interval_score(lesson_dates, day_date,
+                                            interval_days, interval_strength)
+        day_intervals.append(interval)
+        cells_by_score[score] = cells_by_score.get(
+            score, 0) | (day_cells << (day * n_slots))
+
+    # 合計点 -> [(teacher_id, その点数になるセル), ...] (自動配置で使わない点数の候補は除く)
+    candidates_by_score = {}
+    candidate_count = 0
+    for teacher_id in sorted(feasible):
+        teacher_bonus = bonus if teacher_id in preferred_ids else 0
+        for score, cells in cells_by_score.items():
+            bits = feasible[teacher_id] & cells
+            if bits and score + teacher_bonus > scoring.REJECT_SCORE:
+                candidates_by_score.setdefault(score + teacher_bonus,
+                                               []).append((teacher_id, bits))
+                candidate_count += bin(bits).count('1')
+
+    suggestions = []
+    for score, cell, teacher_id in itertools.islice(
+            _ranked(candidates_by_score), k):
+        date, time_slot_id = model.cell_key(cell)
+        suggestions.append({
+            'teacher_id': teacher_id,
+            'date': date.strftime('%Y-%m-%d'),
+            'time_slot_id': time_slot_id,
+            'score': score,
+            'interval': day_intervals[cell // n_slots],
+            'preferred': teacher_id in preferred_ids
+        })
+    return {
+        'student_id': student_id,
+        'subject_id': subject_id,
+        'feasible_count': candidate_count,
+        'suggestions': suggestions
+    }
@@ -0,0 +1,361 @@
+# synthetic_data.py (負荷試験用の大規模な合成データ生成)
+#
+# seed.py と同じ時間スロット・科目マスタの上に、講師・生徒・計画期間・シフト・
+# 授業リクエスト (と任意で配置済みのレッスン) をまとめて INSERT で作成する。
+# 同じ --seed なら同じデータになる。
+#
+# 使い方 (例: 3校舎・講師150人・生徒3000人・2期間、リクエストの3割を配置済みにする):
+#   python synthetic_data.py --campuses 3 --teachers 150 --students 3000 \
+#       --periods 2 --prefill 0.3 --seed 42
+# --subjects を指定すると科目数を変えられる (seed.py の科目から各レベル順に選び、
+# 足りない分は「選択N」の科目を追加する)。
+
+import argparse
+import random
+import time
+from datetime import timedelta
+
+from sqlalchemy import func, insert
+
+import bulk
+import revisions
+from extensions import db
+from models import (Teacher, Student, Subject, StudentRequest, Shift, Lesson,
+                    Assignment, PlanningPeriod, teacher_subjects,
+                    student_preferred_teachers)
+from app import create_app
+from seed import START_DATE, SUBJECTS_DATA, TIME_SLOTS_DATA, create_time_slots
+
+CAMPUS_NAMES = ['渋谷校', '新宿校', '池袋校', '横浜校', '大宮校', '千葉校', '立川校', '町田校']
+SURNAMES = [
+    '佐藤', '鈴木', '高橋', '田中', '伊藤', '渡辺', '山本', '中村', '小林', '加藤', '吉田',
+    '山田', '佐々木', '山口', '松本', '井上', '木村', '林', '斎藤', '清水'
+]
+GIVEN_NAMES = [
+    '陽翔', '蓮', '湊', '大翔', '悠真', '結菜', '陽菜', '葵', '凛', '芽依', '健太', '美咲',
+    '翔太', '彩花', '拓海', '優奈'
+]
+GRADES = ['小4', '小5', '小6', '中1', '中2', '中3', '高1', '高2', '高3', '浪人']
+PRIORITIES = ['HIGH', 'MEDIUM', 'MEDIUM', 'LOW']
+# 科目のレベル (生徒は学年に合ったレベルの科目だけをリクエストする)
+LEVELS = ['小学', '中学', '高校']
+
+DEFAULTS = {
+    'campuses': 3,
+    'teachers': 60,
+    'students': 1200,
+    'periods': 2,
+    'period_days': 28,
+    'shift_density': 0.35,
+    'requests_per_student': (1, 3),
+    'lessons_per_request': (2, 6),
+    'preferred_ratio': 0.2,
+    'prefill': 0.0,
+    'subjects': None,  # None なら seed.py と同じ科目
+    'seed': 0,
+}
+
+
+def subject_level(grade):
+    """学年から対象の科目レベルを返す (科目選択画面と同じ判定)"""
+    if grade.startswith('小'):
+        return '小学'
+    if grade.startswith('中'):
+        return '中学'
+    return '高校'
+
+
+def subject_data(count=None):
+    """count 科目分の科目マスタのリストを返す (None なら seed.py の SUBJECTS_DATA)
+
+    レベルごとに1科目ずつ順番に選び、seed.py の科目を使い切ったレベルには
+    「選択N」の科目を追加する。
+    """
+    if count is None:
+        return list(SUBJECTS_DATA)
+    base = {
+        level: [s for s in SUBJECTS_DATA if s['level'] == level]
+        for level in LEVELS
+    }
+    taken = {level: 0 for level in LEVELS}
+    result = []
+    while len(result) < count:
+        level = LEVELS[len(result) % len(LEVELS)]
+        index = taken[level]
+        taken[level] += 1
+        if index < len(base[level]):
+            result.append(base[level][index])
+        else:
+            number = index - len(base[level]) + 1
+            result.append({
+                'name': f"選択{number}({level})",
+                'display_name': f"選択{number}",
+                'level': level
+            })
+    return result
+
+
+def _insert_returning_ids(model, rows):
+    if not rows:
+        return []
+    result = db.session.execute(
+        insert(model).returning(model.id, sort_by_parameter_order=True), rows)
+    return [row_id for (row_id, ) in result]
+
+
+def generate(options=None):
+    """合成データを作成し、テーブルごとの件数を返す (アプリケーションコンテキスト内で呼ぶ)"""
+    options = dict(DEFAULTS, **(options or {}))
+    # 校舎ごとに講師がいないと、その校舎の生徒の優先講師・配置済みレッスンを作れない
+    if options['teachers'] < max(options['campuses'], 1):
+        raise ValueError(f"講師数 ({options['teachers']}) は校舎数 "
+                         f"({options['campuses']}) 以上にしてください。")
+    # 各レベルに1科目以上ないと、その学年の生徒がリクエストを作れない
+    if options['subjects'] is not None and options['subjects'] < len(LEVELS):
+        raise ValueError(f"科目数 ({options['subjects']}) は {len(LEVELS)} "
+                         "(小学・中学・高校に1科目ずつ) 以上にしてください。")
+    rng = random.Random(options['seed'])
+
+    print("データベースを初期化します...")
+    db.drop_all()
+    db.create_all()
+    create_time_slots()
+    subject_rows = subject_data(options['subjects'])
+    subjects_by_level = {}
+    for subject_id, row in zip(_insert_returning_ids(Subject, subject_rows),
+                               subject_rows):
+        subjects_by_level.setdefault(row['level'], []).append(subject_id)
+    high_school_subjects = subjects_by_level['高校']
+    time_slot_ids = sorted(ts['id'] for ts in TIME_SLOTS_DATA)
+
+    campuses = CAMPUS_NAMES[:options['campuses']] or CAMPUS_NAMES[:1]
+    if len(campuses) < options['campuses']:
+        campuses += [f"第{i + 1}校" for i in range(len(campuses),
+                                                   options['campuses'])]
+
+    # --- 講師 (高校科目は2〜4科目を担当。1割はどの科目も担当できる) ---
+    print(f"講師を{options['teachers']}人作成します...")
+    teacher_rows = []
+    teacher_campus = []
+    for i in range(options['teachers']):
+        surname, given = rng.choice(SURNAMES), rng.choice(GIVEN_NAMES)
+        campus = campuses[i % len(campuses)]
+        teacher_rows.append({
+            'name': f"{surname} {given} ({campus})",
+            'display_name': f"{surname}{i + 1}",
+            'is_joker': rng.random() < 0.1
+        })
+        teacher_campus.append(campus)
+    teacher_ids = _insert_returning_ids(Teacher, teacher_rows)
+    qualifications = []
+    teacher_subjects_map = {}
+    for teacher_id, row in zip(teacher_ids, teacher_rows):
+        if row['is_joker']:
+            chosen = list(high_school_subjects)
+        else:
+            chosen = rng.sample(
+                high_school_subjects,
+                min(rng.randint(2, 4), len(high_school_subjects)))
+        teacher_subjects_map[teacher_id] = set(chosen)
+        qualifications += [{
+            'teacher_id': teacher_id,
+            'subject_id': subject_id
+        } for subject_id in chosen]
+    bulk.insert_rows(teacher_subjects, qualifications)
+    campus_teachers = {}
+    for teacher_id, campus in zip(teacher_ids, teacher_campus):
+        campus_teachers.setdefault(campus, []).append(teacher_id)
+
+    # --- 生徒 (一部は同じ校舎の講師を優先講師にする) ---
+    print(f"生徒を{options['students']}人作成します...")
+    student_rows = []
+    student_campus = []
+    for i in range(options['students']):
+        surname, given = rng.choice(SURNAMES), rng.choice(GIVEN_NAMES)
+        grade = rng.choice(GRADES)
+        campus = campuses[i % len(campuses)]
+        student_rows.append({
+            'name': f"{surname} {given}({grade})",
+            'display_name': f"{surname}{i + 1}",
+            'grade': grade
+        })
+        student_campus.append(campus)
+    student_ids = _insert_returning_ids(Student, student_rows)
+    preferred = []
+    for student_id, campus in zip(student_ids, student_campus):
+        if rng.random() < options['preferred_ratio']:
+            preferred.append({
+                'student_id': student_id,
+                'teacher_id': rng.choice(campus_teachers[campus])
+            })
+    bulk.insert_rows(student_preferred_teachers, preferred)
+    db.session.commit()
+
+    for index in range(options['periods']):
+        start = START_DATE + timedelta(days=index * options['period_days'])
+        end = start + timedelta(days=options['period_days'] - 1)
+        period = PlanningPeriod(
+            name=f"{start.strftime('%Y年%m月%d日')}〜 合成データ期間{index + 1}",
+            start_date=start,
+            end_date=end,
+            status='active' if index == 0 else 'planning')
+        db.session.add(period)
+        db.session.flush()
+        print(f"計画期間 {period.name} のデータを作成します...")
+        dates = [
+            start + timedelta(days=i) for i in range(options['period_days'])
+        ]
+
+        # --- シフト (講師ごとに shift_density の割合のコマに出勤) ---
+        cells = [(d, ts_id) for d in dates for ts_id in time_slot_ids]
+        shift_rows = []
+        campus_cells = {campus: [] for campus in campuses}
+        for teacher_id, campus in zip(teacher_ids, teacher_campus):
+            for shift_date, ts_id in rng.sample(
+                    cells, int(len(cells) * options['shift_density'])):
+                shift_rows.append({
+                    'teacher_id': teacher_id,
+                    'date': shift_date,
+                    'time_slot_id': ts_id,
+                    'is_available': True
+                })
+                campus_cells[campus].append((teacher_id, shift_date, ts_id))
+        bulk.insert_rows(Shift.__table__, shift_rows)
+
+        # --- 授業リクエスト ---
+        request_rows = []
+        for student_id, row in zip(student_ids, student_rows):
+            level_subjects = subjects_by_level[subject_level(row['grade'])]
+            count = min(rng.randint(*options['requests_per_student']),
+                        len(level_subjects))
+            for subject_id in rng.sample(level_subjects, count):
+                request_rows.append({
+                    'student_id': student_id,
+                    'subject_id': subject_id,
+                    'requested_lessons':
+                    rng.randint(*options['lessons_per_request']),
+                    'priority': rng.choice(PRIORITIES),
+                    'planning_period_id': period.id
+                })
+        request_ids = _insert_returning_ids(StudentRequest, request_rows)
+
+        if options['prefill'] > 0:
+            _prefill_lessons(rng, options['prefill'], request_rows,
+                             request_ids, student_ids, student_campus,
+                             campus_cells, teacher_subjects_map,
+                             set(high_school_subjects))
+        db.session.commit()
+
+    counts = {
+        model.__tablename__: db.session.query(func.count(model.id)).scalar()
+        for model in (Teacher, Student, PlanningPeriod, Shift, StudentRequest,
+                      Assignment, Lesson)
+    }
+    counts['requested_lessons'] = db.session.query(
+        func.sum(StudentRequest.requested_lessons)).scalar() or 0
+    # 起動中のサーバーが作り直す前のデータのキャッシュを返さないようにする
+    revisions.bump_all()
+    return counts
+
+
+def _prefill_lessons(rng, ratio, request_rows, request_ids, student_ids,
+                     student_campus, campus_cells, teacher_subjects_map,
+                     high_school_subjects):
+    """リクエストの ratio の割合を、制約 (定員2名・生徒の重複なし・担当科目) を守って配置済みにする"""
+    campus_of = dict(zip(student_ids, student_campus))
+    fill = {}
+    busy = set()
+    lessons = []
+    for row, request_id in zip(request_rows, request_ids):
+        candidates = campus_cells[campus_of[row['student_id']]]
+        if not candidates:
+            continue
+        for _ in range(round(row['requested_lessons'] * ratio)):
+            for _ in range(20):
+                teacher_id, lesson_date, ts_id = cell = rng.choice(candidates)
+                if (fill.get(cell, 0) >= 2 or
+                    (lesson_date, ts_id, row['student_id']) in busy or
+                    (row['subject_id'] in high_school_subjects and
+                     row['subject_id'] not in teacher_subjects_map[teacher_id])):
+                    continue
+                fill[cell] = fill.get(cell, 0) + 1
+                busy.add((lesson_date, ts_id, row['student_id']))
+                lessons.append((cell, row, request_id))
+                break
+
+    cells = sorted(fill, key=lambda c: (c[1], c[2], c[0]))
+    assignment_ids = dict(
+        zip(cells,
+            _insert_returning_ids(Assignment, [{
+                'teacher_id': teacher_id,
+                'date': lesson_date,
+                'time_slot_id': ts_id
+            } for teacher_id, lesson_date, ts_id in cells])))
+    bulk.insert_rows(Lesson.__table__, [{
+        'student_id': row['student_id'],
+        'subject_id': row['subject_id'],
+        'request_id': request_id,
+        'assignment_id': assignment_ids[cell],
+        'status': 'auto'
+    } for cell, row, request_id in lessons])
+    print(f"  {len(lessons)}コマのレッスンを配置済みにしました。")
+
+
+def _range(text):
+    low, _, high = text.partition('-')
+    return int(low), int(high or low)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='負荷試験用の合成データでデータベースを作り直す')
+    parser.add_argument('--campuses', type=int, default=DEFAULTS['campuses'])
+    parser.add_argument('--teachers', type=int, default=DEFAULTS['teachers'])
+    parser.add_argument('--students', type=int, default=DEFAULTS['students'])
+    parser.add_argument('--periods', type=int, default=DEFAULTS['periods'])
+    parser.add_argument('--period-days',
+                        type=int,
+                        default=DEFAULTS['period_days'])
+    parser.add_argument('--shift-density',
+                        type=float,
+                        default=DEFAULTS['shift_density'],
+                        help='講師が出勤するコマの割合 (0〜1)')
+    parser.add_argument('--requests-per-student',
+                        type=_range,
+                        default=DEFAULTS['requests_per_student'],
+                        help='生徒1人あたりのリクエスト科目数 (例: 1-3)')
+    parser.add_argument('--lessons-per-request',
+                        type=_range,
+                        default=DEFAULTS['lessons_per_request'],
+                        help='1リクエストあたりのコマ数 (例: 2-6)')
+    parser.add_argument('--preferred-ratio',
+                        type=float,
+                        default=DEFAULTS['preferred_ratio'],
+                        help='優先講師を持つ生徒の割合 (0〜1)')
+    parser.add_argument('--prefill',
+                        type=float,
+                        default=DEFAULTS['prefill'],
+                        help='配置済みにするリクエストの割合 (0〜1)')
+    parser.add_argument('--subjects',
+                        type=int,
+                        default=DEFAULTS['subjects'],
+                        help='科目数 (3以上。省略時は seed.py と同じ科目)')
+    parser.add_argument('--seed', type=int, default=DEFAULTS['seed'])
+    args = parser.parse_args()
+
+    if args.teachers < max(args.campuses, 1):
+        parser.error('--teachers は --campuses 以上にしてください')
+    if args.subjects is not None and args.subjects < len(LEVELS):
+        parser.error(f'--subjects は {len(LEVELS)} 以上にしてください')
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        counts = generate(vars(args))
+        elapsed = time.perf_counter() - started
+    print(f"\n✅ 合成データを作成しました ({elapsed:.1f}秒)")
+    for name, count in counts.items():
+        print(f"  {name}: {count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# tests/conftest.py (テスト共通のフィクスチャ)
+#
+# テストごとに一時ディレクトリの SQLite ファイルを作り、synthetic_data.py の
+# 小さな合成データ (seed 固定) を入れて使う。
+
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# テスト用の小さなデータセット
+SMALL_DATASET = {
+    'campuses': 2,
+    'teachers': 12,
+    'students': 80,
+    'periods': 1,
+    'period_days': 14,
+    'prefill': 0.3,
+    'seed': 0,
+}
+
+
+def quiet(function, *args, **kwargs):
+    """進捗表示 (print) を抑えて function を呼ぶ"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+def make_app(database_url, dataset=None):
+    """database_url の DB を使うアプリを作り、合成データを入れる"""
+    os.environ['DATABASE_URL'] = database_url
+    from app import create_app
+    from extensions import db
+    import synthetic_data
+
+    app = create_app()
+    with app.app_context():
+        quiet(synthetic_data.generate, dict(SMALL_DATASET, **(dataset or {})))
+        db.session.remove()
+    return app
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    database_url = 'sqlite:///' + str(tmp_path / 'schedule.db')
+    # 終了時に DATABASE_URL を元に戻す
+    monkeypatch.setenv('DATABASE_URL', database_url)
+    app = make_app(database_url)
+    yield app
+    from extensions import db
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,70 @@
+# tests/test_concurrency.py (自動配置の実行中も読み込みが失敗しないこと)
+#
+# WAL モードの一時 DB で自動配置ジョブを実行しながら、複数のスレッドから
+# プランナーのデータを読み続け、エラー (database is locked など) が0件であることを確認する。
+
+import threading
+import time
+
+from extensions import db
+
+READERS = 8
+JOB_TIMEOUT = 120
+
+
+def test_readers_keep_working_during_generate(app):
+    with app.app_context():
+        journal_mode = db.session.execute(
+            db.text('PRAGMA journal_mode')).scalar()
+        db.session.remove()
+    assert journal_mode.lower() == 'wal'
+
+    client = app.test_client()
+    response = client.post('/api/planner/auto-assign',
+                           json={
+                               'period_id': 1,
+                               'options': {
+                                   'seed': 0,
+                                   'subject_interval_days': 3,
+                                   'preferred_strength': 'normal'
+                               }
+                           })
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+
+    done = threading.Event()
+    errors = []
+    reads = []
+
+    def read_planner():
+        reader = app.test_client()
+        count = 0
+        while not done.is_set():
+            try:
+                response = reader.get('/api/planner-data/1')
+                if response.status_code != 200:
+                    errors.append((response.status_code, response.data[:200]))
+                count += 1
+            except Exception as e:
+                errors.append(repr(e))
+        reads.append(count)
+
+    threads = [threading.Thread(target=read_planner) for _ in range(READERS)]
+    for thread in threads:
+        thread.start()
+    try:
+        deadline = time.time() + JOB_TIMEOUT
+        while time.time() < deadline:
+            job = client.get(f'/api/planner/jobs/{job_id}').get_json()
+            if job['status'] in ('completed', 'failed', 'cancelled'):
+                break
+            time.sleep(0.05)
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join()
+
+    assert job['status'] == 'completed', job
+    assert job['result']['placed'] > 0
+    assert errors == []
+    assert sum(reads) >= READERS
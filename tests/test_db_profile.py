@@ -0,0 +1,23 @@
+# tests/test_db_profile.py (データベース接続の設定)
+
+from conftest import make_app
+
+
+def test_uses_queue_pool():
+    import db_profile
+
+    assert db_profile.uses_queue_pool('sqlite:////tmp/schedule.db')
+    assert db_profile.uses_queue_pool('postgresql+psycopg://localhost/db')
+    assert not db_profile.uses_queue_pool('sqlite://')
+    assert not db_profile.uses_queue_pool('sqlite:///:memory:')
+
+
+def test_in_memory_database(monkeypatch):
+    """DATABASE_URL=sqlite:// (StaticPool) でもアプリを作って使える"""
+    monkeypatch.setenv('DATABASE_URL', 'sqlite://')
+    app = make_app('sqlite://')
+    assert 'pool_size' not in app.config['SQLALCHEMY_ENGINE_OPTIONS']
+
+    response = app.test_client().get('/api/planner-data/1')
+    assert response.status_code == 200
+    assert response.get_json()['assignments']
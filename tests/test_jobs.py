@@ -0,0 +1,36 @@
+# tests/test_jobs.py (自動配置ジョブのキャンセル)
+
+from jobs import JobQueue, Job
+
+
+def _queued_job(job_queue):
+    job = Job('1', 1, {})
+    job_queue.jobs[job.id] = job
+    return job
+
+
+def test_cancelled_job_is_not_started():
+    # キューから取り出した後、_execute の前に cancel() された場合
+    job_queue = JobQueue(app=None)
+    job = _queued_job(job_queue)
+    job_queue.cancel(job.id)
+    version = job.version
+
+    job_queue._execute(job)
+
+    assert job.status == 'cancelled'
+    assert job.started_at is None
+    assert job.version == version
+
+
+def test_cancel_requested_before_start_finishes_job():
+    # cancel() が cancel_event を立てた直後 (状態を変える前) に開始しようとした場合
+    job_queue = JobQueue(app=None)
+    job = _queued_job(job_queue)
+    job.cancel_event.set()
+
+    job_queue._execute(job)
+
+    assert job.status == 'cancelled'
+    assert job.started_at is None
+    assert job_queue.cancel(job.id).status == 'cancelled'
@@ -0,0 +1,46 @@
+# tests/test_local_search.py (局所探索による改善フェーズ)
+
+from conftest import quiet
+
+# 「strong」の科目間隔ルールは、貪欲法・CP-SAT では破れない制約として扱う
+HARD_INTERVAL = {
+    'seed': 0,
+    'subject_interval_days': 3,
+    'interval_strength': 'strong',
+}
+
+
+def _interval_violations(generator):
+    """今回配置したレッスンのうち、同じ生徒・科目のレッスンと間隔が足りないものの数"""
+    import scoring
+
+    violations = 0
+    for lesson, (_, date, _) in generator.placements.items():
+        dates = list(generator.lesson_dates[(lesson.student_id,
+                                              lesson.subject_id)])
+        dates.remove(date)
+        interval = scoring.nearest_interval(dates, date)
+        if interval is not None and interval < generator.subject_interval_days:
+            violations += 1
+    return violations
+
+
+def test_improve_keeps_hard_interval_rule(app):
+    from extensions import db
+    from local_search import LocalSearch
+    from models import PlanningPeriod
+    from scheduler import ScheduleGenerator
+
+    with app.app_context():
+        period_id = db.session.query(PlanningPeriod.id).scalar()
+        generator = quiet(ScheduleGenerator, period_id, HARD_INTERVAL)
+        lessons = quiet(generator._prepare_run)
+        unplaced = quiet(generator._place_greedily,
+                         generator._sort_lessons(lessons))
+        greedy_placed = len(generator.placements)
+        greedy_violations = _interval_violations(generator)
+
+        search = LocalSearch(generator, unplaced, 2, seed=0)
+        quiet(search.run)
+        assert len(generator.placements) >= greedy_placed
+        assert _interval_violations(generator) <= greedy_violations
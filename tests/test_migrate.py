@@ -0,0 +1,31 @@
+# tests/test_migrate.py (インデックスの作成と実行計画の確認)
+
+from conftest import quiet
+
+
+def test_migrate_uses_indexes(app):
+    """migrate.py の後、スケジューラ・プランナーのクエリがインデックスを使う"""
+    from extensions import db
+    import migrate
+
+    with app.app_context():
+        # migrate.py を実行する前の DB と同じく、インデックスの無い状態から始める
+        for table in ('shift', 'student_request', 'assignment', 'lesson'):
+            for index in db.inspect(db.engine).get_indexes(table):
+                db.session.execute(db.text(f'DROP INDEX {index["name"]}'))
+        db.session.commit()
+        db.session.remove()
+
+    assert quiet(migrate.migrate)
+    with app.app_context():
+        assert quiet(migrate.check_query_plans)
+
+
+def test_check_query_plans_reports_missing_index(app):
+    from extensions import db
+    import migrate
+
+    with app.app_context():
+        db.session.execute(db.text('DROP INDEX ix_shift_date_slot'))
+        db.session.commit()
+        assert not quiet(migrate.check_query_plans)
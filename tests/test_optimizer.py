@@ -0,0 +1,32 @@
+# tests/test_optimizer.py (CP-SAT による一括最適配置)
+
+import pytest
+
+from conftest import quiet
+
+pytest.importorskip('ortools')
+
+
+@pytest.mark.parametrize('rules', [
+    {
+        'subject_interval_days': 3,
+        'preferred_strength': 'normal'
+    },
+    {
+        'subject_interval_days': 3,
+        'interval_strength': 'strong'
+    },
+])
+def test_cpsat_finds_a_solution(app, rules):
+    """CPU が少なくても、貪欲法のヒントから制限時間内に CP-SAT の解が得られる"""
+    from extensions import db
+    from models import PlanningPeriod
+    from scheduler import ScheduleGenerator
+
+    with app.app_context():
+        period_id = db.session.query(PlanningPeriod.id).scalar()
+        options = dict(rules, seed=0, solver='cpsat', solver_time_limit=5)
+        generator = quiet(ScheduleGenerator, period_id, options)
+        result = quiet(generator.generate)
+        assert result['solver'] == 'cpsat'
+        assert result['placed'] > 0
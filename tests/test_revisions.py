@@ -0,0 +1,93 @@
+# tests/test_revisions.py (別プロセスの書き込みでキャッシュが無効になること)
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 別のワーカープロセスとして、API でレッスンを1件削除する
+DELETE_LESSON = """
+from app import create_app
+from extensions import db
+from models import Lesson
+app = create_app()
+with app.app_context():
+    lesson_id = db.session.query(Lesson.id).order_by(Lesson.id).limit(1).scalar()
+    db.session.remove()
+response = app.test_client().delete(f'/api/planner/lessons/{lesson_id}')
+assert response.status_code == 200, response.data
+"""
+
+
+def _run_in_other_process(code):
+    subprocess.run([sys.executable, '-c', code],
+                   cwd=ROOT,
+                   env=dict(os.environ),
+                   check=True,
+                   capture_output=True)
+
+
+def test_analysis_cache_sees_writes_from_other_process(app):
+    client = app.test_client()
+    before = client.get('/api/period/1/analysis').get_json()
+    assert client.get('/api/period/1/analysis').get_json() == before
+
+    _run_in_other_process(DELETE_LESSON)
+
+    after = client.get('/api/period/1/analysis').get_json()
+    assert after != before
+
+
+def test_etag_changes_after_write_from_other_process(app):
+    client = app.test_client()
+    response = client.get('/api/planner-data/1')
+    etag = response.headers['ETag']
+    assert client.get('/api/planner-data/1',
+                      headers={
+                          'If-None-Match': etag
+                      }).status_code == 304
+
+    _run_in_other_process(DELETE_LESSON)
+
+    response = client.get('/api/planner-data/1',
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_planner_changes_after_local_write(app):
+    client = app.test_client()
+    version = client.get('/api/planner-data/1').get_json()['version']
+    unchanged = client.get(
+        f'/api/planner-data/1/changes?version={version}').get_json()
+    assert not unchanged['reset'] and unchanged['version'] == version
+    assert unchanged['assignments'] == {}
+
+    lesson = next(lesson for assignments in client.get(
+        '/api/planner-data/1').get_json()['assignments'].values()
+                  for assignment in assignments
+                  for lesson in assignment['lessons'])
+    response = client.delete(f"/api/planner/lessons/{lesson['id']}")
+    assert response.status_code == 200
+
+    changes = client.get(
+        f'/api/planner-data/1/changes?version={version}').get_json()
+    assert not changes['reset']
+    assert changes['version'] != version
+    assert changes['assignments']
+
+
+def test_planner_changes_reset_after_write_from_other_process(app):
+    """別のワーカーの変更はこのプロセスの履歴に無いので、空の差分ではなく全体を読み直させる"""
+    client = app.test_client()
+    version = client.get('/api/planner-data/1').get_json()['version']
+
+    _run_in_other_process(DELETE_LESSON)
+
+    changes = client.get(
+        f'/api/planner-data/1/changes?version={version}').get_json()
+    assert changes['reset']
+    assert changes['version'] != version
+    assert client.get('/api/planner-data/1').get_json(
+    )['version'] == changes['version']
@@ -0,0 +1,69 @@
+# tests/test_scoring.py (スカラー版と一括版 (numpy) の採点の一致)
+
+import pytest
+
+from conftest import quiet
+
+np = pytest.importorskip('numpy')
+
+RULE_OPTIONS = [
+    {},
+    {
+        'subject_interval_days': 3,
+        'interval_strength': 'normal',
+        'preferred_strength': 'normal'
+    },
+    {
+        'subject_interval_days': 5,
+        'interval_strength': 'strong',
+        'preferred_strength': 'weak'
+    },
+]
+
+
+def _greedy_placements(period_id, options):
+    """DB に書き込まずに貪欲法を実行し、配置結果を返す"""
+    from scheduler import ScheduleGenerator
+
+    generator = quiet(ScheduleGenerator, period_id, options)
+    lessons = quiet(generator._prepare_run)
+    quiet(generator._place_greedily, generator._sort_lessons(lessons))
+    return generator, sorted(
+        (lesson.student_id, lesson.subject_id, lesson.request_id, key)
+        for lesson, key in generator.placements.items())
+
+
+@pytest.mark.parametrize('options', RULE_OPTIONS)
+def test_vectorized_scores_match_scalar(app, options):
+    from models import PlanningPeriod
+    from extensions import db
+
+    with app.app_context():
+        period_id = db.session.query(PlanningPeriod.id).scalar()
+        options = dict(options, seed=0, scoring='vectorized')
+        generator, _ = _greedy_placements(period_id, options)
+        scorer = generator.scorer
+        assert scorer is not None
+
+        # 配置後の状態 (科目ごとのレッスン日が入った状態) で全候補の点数を比べる
+        for lesson in list(generator.placements)[:50]:
+            vectorized = scorer.scores(lesson)
+            scalar = [
+                generator._calculate_slot_score(lesson, teacher_id, date)
+                for teacher_id, date, _ in scorer.keys
+            ]
+            assert vectorized.tolist() == scalar
+
+
+@pytest.mark.parametrize('options', RULE_OPTIONS)
+def test_vectorized_placements_match_scalar(app, options):
+    from models import PlanningPeriod
+    from extensions import db
+
+    with app.app_context():
+        period_id = db.session.query(PlanningPeriod.id).scalar()
+        _, scalar = _greedy_placements(period_id, dict(options, seed=0))
+        _, vectorized = _greedy_placements(
+            period_id, dict(options, seed=0, scoring='vectorized'))
+    assert scalar
+    assert vectorized == scalar
@@ -0,0 +1,59 @@
+# tests/test_shifts.py (シフトの差分保存)
+
+from datetime import datetime, timedelta
+
+
+def _edit_shifts(client):
+    """1件削除・1件を出勤不可に更新・空いているコマに1件追加して保存する"""
+    shift_map = client.get('/api/shifts/1?period_id=1').get_json()
+    keys = sorted(shift_map)
+    assert len(keys) >= 2
+    removed, updated = keys[0], keys[1]
+    del shift_map[removed]
+    shift_map[updated] = {'is_available': False}
+    start = datetime.strptime(updated.rsplit('-', 1)[0], '%Y-%m-%d').date()
+    added = next(key for key in (
+        f"{(start + timedelta(days=day)).strftime('%Y-%m-%d')}-{time_slot_id}"
+        for day in range(14) for time_slot_id in range(1, 12))
+                 if key not in shift_map and key != removed)
+    shift_map[added] = {'is_available': True}
+
+    response = client.post('/api/shifts/1',
+                           json={
+                               'period_id': 1,
+                               'shift_data': shift_map
+                           })
+    assert response.status_code == 200, response.get_json()
+    assert client.get('/api/shifts/1?period_id=1').get_json() == shift_map
+
+
+def test_save_shifts_with_upsert(app):
+    assert app.config['SHIFT_UPSERT']
+    _edit_shifts(app.test_client())
+
+
+def test_save_shifts_without_unique_index(app):
+    """migrate.py を実行していない DB (一意インデックスが無い) でも保存できる"""
+    from app import create_app
+    from extensions import db
+    from models import Shift
+    import shifts
+
+    with app.app_context():
+        db.session.execute(db.text(f'DROP INDEX {shifts.UPSERT_INDEX}'))
+        db.session.commit()
+        db.session.remove()
+        db.engine.dispose()
+
+    unmigrated = create_app()
+    assert not unmigrated.config['SHIFT_UPSERT']
+    _edit_shifts(unmigrated.test_client())
+    with unmigrated.app_context():
+        duplicates = db.session.query(Shift.teacher_id, Shift.date,
+                                      Shift.time_slot_id).group_by(
+                                          Shift.teacher_id, Shift.date,
+                                          Shift.time_slot_id).having(
+                                              db.func.count(Shift.id) > 1)
+        assert duplicates.count() == 0
+        db.session.remove()
+        db.engine.dispose()
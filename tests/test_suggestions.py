@@ -0,0 +1,95 @@
+# tests/test_suggestions.py (配置候補の提案が自動配置の採点と一致すること)
+
+import random
+from datetime import date
+
+import pytest
+
+from conftest import quiet
+
+RULE_OPTIONS = [
+    {},
+    {
+        'subject_interval_days': 3,
+        'interval_strength': 'normal',
+        'preferred_strength': 'normal'
+    },
+    {
+        'subject_interval_days': 7,
+        'interval_strength': 'strong',
+        'preferred_strength': 'weak'
+    },
+]
+
+
+def _expected(generator, student_id, subject_id, k):
+    """ScheduleGenerator の採点で全候補を並べた上位 k 件と、採用できる候補の数"""
+    from availability import iter_bits
+    from scheduler import PlannedLesson
+    import scoring
+
+    lesson = PlannedLesson(student_id, subject_id, None, 'MEDIUM')
+    model = generator.availability
+    ranks = []
+    for teacher_id, bits in model.feasible(student_id, subject_id).items():
+        for cell in iter_bits(bits):
+            score = generator._calculate_slot_score(lesson, teacher_id,
+                                                    model.cell_key(cell)[0])
+            if score > scoring.REJECT_SCORE:
+                ranks.append((score, -cell, -teacher_id))
+    ranks.sort(reverse=True)
+    top = [(-teacher_id, ) + model.cell_key(-cell) + (score, )
+           for score, cell, teacher_id in ranks[:k]]
+    return top, len(ranks)
+
+
+@pytest.mark.parametrize('options', RULE_OPTIONS)
+def test_suggestions_match_scheduler_scores(app, options):
+    from extensions import db
+    from models import PlanningPeriod, StudentRequest
+    from scheduler import ScheduleGenerator
+    import suggestions
+
+    with app.app_context():
+        period = db.session.get(PlanningPeriod, 1)
+        generator = quiet(ScheduleGenerator, period.id, options)
+        requests = db.session.query(StudentRequest.student_id,
+                                    StudentRequest.subject_id).filter_by(
+                                        planning_period_id=period.id).all()
+        for student_id, subject_id in random.Random(0).sample(requests, 30):
+            result = suggestions.suggest_slots(period, student_id, subject_id,
+                                               options, 10)
+            got = [(s['teacher_id'], date.fromisoformat(s['date']),
+                    s['time_slot_id'], s['score'])
+                   for s in result['suggestions']]
+            expected, count = _expected(generator, student_id, subject_id, 10)
+            assert got == expected
+            assert result['feasible_count'] == count
+
+
+def test_suggestions_skip_rejected_scores(app):
+    from availability import get_cached_model
+    from extensions import db
+    from models import PlanningPeriod, StudentRequest
+    import scoring
+    import suggestions
+
+    options = {'subject_interval_days': 30, 'interval_strength': 'strong'}
+    rejected = 0
+    with app.app_context():
+        period = db.session.get(PlanningPeriod, 1)
+        model = get_cached_model(period)
+        for student_id, subject_id in db.session.query(
+                StudentRequest.student_id,
+                StudentRequest.subject_id).filter_by(
+                    planning_period_id=period.id):
+            result = suggestions.suggest_slots(period, student_id, subject_id,
+                                               options, 100)
+            assert all(s['score'] > scoring.REJECT_SCORE
+                       for s in result['suggestions'])
+            feasible = sum(
+                bin(bits).count('1')
+                for bits in model.feasible(student_id, subject_id).values())
+            rejected += feasible - result['feasible_count']
+    # 既存のレッスンから30日以内のコマは全て減点で除かれている
+    assert rejected > 0
@@ -0,0 +1,71 @@
+# tests/test_synthetic_data.py (合成データの生成)
+
+import pytest
+
+from conftest import quiet
+
+
+def test_rejects_fewer_teachers_than_campuses(app):
+    import synthetic_data
+    from extensions import db
+    from models import Teacher
+
+    with app.app_context():
+        teachers = db.session.query(Teacher).count()
+        with pytest.raises(ValueError):
+            synthetic_data.generate({'campuses': 4, 'teachers': 3})
+        # 既存のデータは消さない
+        assert db.session.query(Teacher).count() == teachers
+
+
+def test_one_teacher_per_campus(app):
+    import synthetic_data
+
+    with app.app_context():
+        counts = quiet(synthetic_data.generate, {
+            'campuses': 3,
+            'teachers': 3,
+            'students': 30,
+            'periods': 1,
+            'prefill': 0.5
+        })
+    assert counts['teacher'] == 3
+    assert counts['lesson'] > 0
+
+
+def test_rejects_fewer_subjects_than_levels(app):
+    import synthetic_data
+    from extensions import db
+    from models import Subject
+
+    with app.app_context():
+        subjects = db.session.query(Subject).count()
+        with pytest.raises(ValueError):
+            synthetic_data.generate({'subjects': 2})
+        assert db.session.query(Subject).count() == subjects
+
+
+# (科目数, リクエストされる科目数の下限)。30科目なら seed.py の18科目以外も使われる
+@pytest.mark.parametrize('subjects, min_requested', [(3, 3), (30, 19)])
+def test_subject_count(app, subjects, min_requested):
+    import synthetic_data
+    from extensions import db
+    from models import StudentRequest, Subject
+
+    with app.app_context():
+        counts = quiet(synthetic_data.generate, {
+            'campuses': 2,
+            'teachers': 6,
+            'students': 60,
+            'periods': 1,
+            'subjects': subjects,
+            'prefill': 0.3
+        })
+        levels = [level for (level, ) in db.session.query(Subject.level)]
+        requested = db.session.query(
+            StudentRequest.subject_id).distinct().count()
+        assert db.session.query(Subject).count() == subjects
+        assert set(levels) == set(synthetic_data.LEVELS)
+        assert requested >= min_requested
+    assert counts['student_request'] > 0
+    assert counts['lesson'] > 0